@@ -11,6 +11,7 @@ class FmConst:
     libexecDir = "/usr/libexec/fpemud-refsystem"
     dataDir = "/usr/share/fpemud-refsystem"
     dataKernelCfgRulesDir = os.path.join(dataDir, "kconfig-rules")
+    cacheDir = "/var/cache/fpemud-refsystem"
 
     defaultGentooMirror = "http://distfiles.gentoo.org"
     defaultRsyncMirror = "rsync://rsync.gentoo.org/gentoo-portage"
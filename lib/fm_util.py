@@ -5,6 +5,8 @@ import os
 import re
 import sys
 import bz2
+import gzip
+import lzma
 import pwd
 import grp
 import spwd
@@ -21,8 +23,12 @@ import subprocess
 import struct
 import time
 import fcntl
+import mmap
 import termios
 import hashlib
+import threading
+import contextvars
+import concurrent.futures
 import pyudev
 import kmod
 import selectors
@@ -418,6 +424,10 @@ class FmUtil:
     def md5hash(s):
         return hashlib.md5(s.encode('utf-8')).hexdigest()
 
+    @staticmethod
+    def hashFile(filename):
+        return FileHasher("md5").hashFile(filename)
+
     @staticmethod
     def isEfi():
         return os.path.exists("/sys/firmware/efi")
@@ -1624,105 +1634,34 @@ class FmUtil:
     @staticmethod
     def getMakeConfVar(makeConfFile, varName):
         """Returns variable value, returns "" when not found
-           Multiline variable definition is not supported yet"""
-
-        buf = ""
-        with open(makeConfFile, 'r') as f:
-            buf = f.read()
-
-        m = re.search("^%s=\"(.*)\"$" % (varName), buf, re.MULTILINE)
-        if m is None:
-            return ""
-        varVal = m.group(1)
-
-        while True:
-            m = re.search("\\${(\\S+)?}", varVal)
-            if m is None:
-                break
-            varName2 = m.group(1)
-            varVal2 = FmUtil.getMakeConfVar(makeConfFile, varName2)
-            if varVal2 is None:
-                varVal2 = ""
-
-            varVal = varVal.replace(m.group(0), varVal2)
+           Multiline variable definition is not supported yet
+           Use MakeConf directly when accessing many variables"""
 
-        return varVal
+        return MakeConf(makeConfFile).get(varName)
 
     @staticmethod
     def setMakeConfVar(makeConfFile, varName, varValue):
         """Create or set variable in make.conf
            Multiline variable definition is not supported yet"""
 
-        endEnter = False
-        buf = ""
-        with open(makeConfFile, 'r') as f:
-            buf = f.read()
-            if buf[-1] == "\n":
-                endEnter = True
-
-        m = re.search("^%s=\"(.*)\"$" % (varName), buf, re.MULTILINE)
-        if m is not None:
-            if m.group(1) != varValue:
-                newLine = "%s=\"%s\"" % (varName, varValue)
-                buf = buf.replace(m.group(0), newLine)
-                with open(makeConfFile, 'w') as f:
-                    f.write(buf)
-        else:
-            with open(makeConfFile, 'a') as f:
-                if not endEnter:
-                    f.write("\n")
-                f.write("%s=\"%s\"\n" % (varName, varValue))
+        with MakeConf(makeConfFile) as makeConf:
+            makeConf.set(varName, varValue)
 
     @staticmethod
     def updateMakeConfVarAsValueSet(makeConfFile, varName, valueList):
         """Check variable in make.conf
            Create or set variable in make.conf"""
 
-        endEnter = False
-        buf = ""
-        with open(makeConfFile, 'r') as f:
-            buf = f.read()
-            if buf[-1] == "\n":
-                endEnter = True
-
-        m = re.search("^%s=\"(.*)\"$" % (varName), buf, re.MULTILINE)
-        if m is not None:
-            if set(m.group(1).split(" ")) != set(valueList):
-                newLine = "%s=\"%s\"" % (varName, " ".join(valueList))
-                buf = buf.replace(m.group(0), newLine)
-                with open(makeConfFile, 'w') as f:
-                    f.write(buf)
-        else:
-            with open(makeConfFile, 'a') as f:
-                if not endEnter:
-                    f.write("\n")
-                f.write("%s=\"%s\"\n" % (varName, " ".join(valueList)))
+        with MakeConf(makeConfFile) as makeConf:
+            makeConf.setAsValueSet(varName, valueList)
 
     @staticmethod
     def removeMakeConfVar(makeConfFile, varName):
         """Remove variable in make.conf
            Multiline variable definition is not supported yet"""
 
-        endEnterCount = 0
-        lineList = []
-        with open(makeConfFile, 'r') as f:
-            buf = f.read()
-            endEnterCount = len(buf) - len(buf.rstrip("\n"))
-
-            buf = buf.rstrip("\n")
-            for line in buf.split("\n"):
-                if re.search("^%s=" % (varName), line) is None:
-                    lineList.append(line)
-
-        buf = ""
-        for line in lineList:
-            buf += line + "\n"
-        buf = buf.rstrip("\n")
-        for i in range(0, endEnterCount):
-            buf += "\n"
-
-        with open(makeConfFile, 'w') as f:
-            f.write(buf)
+        with MakeConf(makeConfFile) as makeConf:
+            makeConf.remove(varName)
 
     @staticmethod
     def genSelfSignedCertAndKey(cn, keysize):
@@ -1766,21 +1705,13 @@ class FmUtil:
 
     @staticmethod
     def repoGetPkgNameList(repoDir):
-        dirList = FmUtil.cmdCall("/usr/bin/find", repoDir, "-type", "d").split("\n")
-        pkgList = []
-        for d in dirList:
-            d = d[len(repoDir) + 1:]
-            if "/" not in d:
-                continue
-            pkgList.append(d)
-        return pkgList
+        """returns list<category/package>"""
+
+        return RepoPkgIndex.get(repoDir).getPkgNameList()
 
     @staticmethod
     def repoIsPkgExists(repoDir, pkgName):
-        """Performance optimization needed"""
-
-        pkgList = FmUtil.repoGetPkgNameList(repoDir)
-        return pkgName in pkgList
+        return RepoPkgIndex.get(repoDir).hasPkg(pkgName)
 
     @staticmethod
     def repoIsSysFile(fbasename):
@@ -1798,12 +1729,7 @@ class FmUtil:
 
     @staticmethod
     def repoGetEbuildDirList(repoDir):
-        repoDirInfo = []
-        for fbasename in FmUtil.getFileList(repoDir, 2, "d"):
-            if FmUtil.repoIsSysFile(fbasename):
-                continue
-            repoDirInfo.append(fbasename)
-        return repoDirInfo
+        return RepoPkgIndex.get(repoDir).getPkgNameList()
 
     @staticmethod
     def repoGetRepoName(repoDir):
@@ -1936,15 +1862,6 @@ class FmUtil:
             filelist.append(f)
         return filelist
 
-    @staticmethod
-    def portageGetInstalledFileSet():
-        cmdStr = r"/bin/cat /var/db/pkg/*/*/CONTENTS "
-        cmdStr += r'| /bin/sed -e "s:^obj \(.*\) [[:xdigit:]]\+ [[:digit:]]\+$:\1:" '
-        cmdStr += r'| /bin/sed -e "s:^sym \(.*\) -> .* .*$:\1:" '
-        cmdStr += r'| /bin/sed -e "s:^dir \(.*\)$:\1:" '
-        ret = FmUtil.shellCall(cmdStr)
-        return set(ret.split("\n"))
-
     @staticmethod
     def portageReadCfgMaskFile(filename):
         """Returns list<package-atom>"""
@@ -1984,75 +1901,12 @@ class FmUtil:
             useFlagList.append(item)
         return FmUtil.portageGenerateCfgUseFileByUseFlagList(useFlagList)
 
-    @staticmethod
-    def portageGetGentooHttpMirror(makeConf, defaultMirror, filesWanted):
-        for mr in FmUtil.getMakeConfVar(makeConf, "GENTOO_MIRRORS").split():
-            good = True
-            for fn in filesWanted:
-                if not FmUtil.wgetSpider("%s/%s" % (mr, fn)):
-                    good = False
-                    break
-            if good:
-                return mr
-        return defaultMirror
-
     @staticmethod
     def portageGetGentooPortageRsyncMirror(makeConf, defaultMirror):
         for mr in FmUtil.getMakeConfVar(makeConf, "RSYNC_MIRRORS").split():
             return mr
         return defaultMirror
 
-    @staticmethod
-    def portageGetLinuxKernelMirror(makeConf, defaultMirror, kernelVersion, filesWanted):
-        # we support two mirror file structure:
-        # 1. all files placed under /: a simple structure suitable for local mirrors
-        # 2. /{v3.x,v4.x,...}/*:       an overly complicated structure used by official kernel mirrors
-
-        subdir = None
-        for i in range(3, 9):
-            if kernelVersion.startswith(str(i)):
-                subdir = "v%d.x" % (i)
-        assert subdir is not None
-
-        mirrorList = FmUtil.getMakeConfVar(makeConf, "KERNEL_MIRRORS").split()
-
-        # try file structure 1
-        for mr in mirrorList:
-            good = True
-            for fn in filesWanted:
-                if not FmUtil.wgetSpider("%s/%s" % (mr, fn)):
-                    good = False
-                    break
-            if good:
-                return (mr, filesWanted)
-
-        # try file structure 2
-        for mr in mirrorList:
-            good = True
-            for fn in filesWanted:
-                if not FmUtil.wgetSpider("%s/%s/%s" % (mr, subdir, fn)):
-                    good = False
-                    break
-            if good:
-                return (mr, ["%s/%s" % (subdir, fn) for fn in filesWanted])
-
-        # use default mirror
-        return (defaultMirror, ["%s/%s" % (subdir, fn) for fn in filesWanted])
-
-    @staticmethod
-    def portageGetLinuxFirmwareMirror(makeConf, defaultMirror, filesWanted):
-        ret = defaultMirror
-        for mr in FmUtil.getMakeConfVar(makeConf, "KERNEL_MIRRORS").split():
-            good = True
-            for fn in filesWanted:
-                if not FmUtil.wgetSpider("%s/firmware/%s" % (mr, fn)):
-                    good = False
-                    break
-            if good:
-                ret = mr
-                break
-        return (ret, ["firmware/%s" % (fn) for fn in filesWanted])
-
     @staticmethod
     def portageGetChost():
         return FmUtil.shellCall("/usr/bin/portageq envvar CHOST 2>/dev/null").rstrip("\n")
@@ -2257,21 +2111,32 @@ class FmUtil:
 
     @staticmethod
     def hashDir(dirname):
-        h = hashlib.sha1()
-        for root, dirs, files in os.walk(dirname):
-            for filepath in files:
-                with open(os.path.join(root, filepath), "rb") as f1:
-                    buf = f1.read(4096)
-                    while buf != b'':
-                        h.update(hashlib.sha1(buf).digest())
-                        buf = f1.read(4096)
-        return h.hexdigest()
+        return FileHasher("sha1").hashDir(dirname)
 
     @staticmethod
     def readFile(filename):
         with open(filename) as f:
             return f.read()
 
+    @staticmethod
+    def cacheLoad(filename):
+        """Returns None if the cache file does not exist or is corrupted"""
+
+        try:
+            with open(filename, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def cacheSave(filename, data):
+        # write to a temporary file first, so that the cache is never half-written
+        FmUtil.ensureDir(os.path.dirname(filename))
+        tmpFilename = filename + ".tmp"
+        with open(tmpFilename, "w") as f:
+            json.dump(data, f)
+        os.rename(tmpFilename, filename)
+
     @staticmethod
     def readListFile(filename):
         ret = []
@@ -2521,14 +2386,7 @@ class FmUtil:
 
     @staticmethod
     def verifyFileMd5(filename, md5sum):
-        with open(filename, "rb") as f:
-            thash = hashlib.md5()
-            while True:
-                block = f.read(65536)
-                if len(block) == 0:
-                    break
-                thash.update(block)
-            return thash.hexdigest() == md5sum
+        return FileHasher("md5").hashFile(filename) == md5sum
 
     @staticmethod
     def isBufferAllZero(buf):
@@ -2632,18 +2490,68 @@ class FmUtil:
         kmodList = kmodList2
 
         # get firmware file list
+        # python-kmod bug: can only recognize the last firmware in modinfo
+        # so read the .modinfo section directly
         firmwareList = []
         for k in kmodList:
-            # python-kmod bug: can only recognize the last firmware in modinfo
-            # so use the command output of modinfo directly
-            for line in FmUtil.cmdCall("/bin/modinfo", k).split("\n"):
-                m = re.fullmatch("firmware: +(\\S.*)", line)
-                if m is None:
-                    continue
-                firmwareList.append(os.path.join(firmwareDir, m.group(1)))
+            for fn in FmUtil.kmodReadModinfo(k).get("firmware", []):
+                firmwareList.append(os.path.join(firmwareDir, fn))
 
         return (kmodList, firmwareList)
 
+    @staticmethod
+    def kmodReadModinfo(filename):
+        """Returns dict<key, list<value>> read from the .modinfo section of a kernel module file,
+           .ko, .ko.xz, .ko.gz and .ko.zst files are supported"""
+
+        if filename.endswith(".xz"):
+            with lzma.open(filename, "rb") as f:
+                data = f.read()
+        elif filename.endswith(".gz"):
+            with gzip.open(filename, "rb") as f:
+                data = f.read()
+        elif filename.endswith(".zst"):
+            try:
+                import zstandard
+                with open(filename, "rb") as f:
+                    data = zstandard.ZstdDecompressor().stream_reader(f).read()
+            except ImportError:
+                data = subprocess.run(["/usr/bin/zstd", "-d", "-c", "-q", filename], stdout=subprocess.PIPE, check=True).stdout
+        else:
+            with open(filename, "rb") as f:
+                data = f.read()
+
+        if data[:4] != b"\x7fELF":
+            raise Exception("%s is not a valid kernel module file" % (filename))
+        endian = "<" if data[5] == 1 else ">"
+        if data[4] == 2:
+            # ELF64
+            shoff = struct.unpack_from(endian + "Q", data, 0x28)[0]
+            shentsize, shnum, shstrndx = struct.unpack_from(endian + "HHH", data, 0x3A)
+            shfmt = endian + "IIQQQQIIQQ"
+        else:
+            # ELF32
+            shoff = struct.unpack_from(endian + "I", data, 0x20)[0]
+            shentsize, shnum, shstrndx = struct.unpack_from(endian + "HHH", data, 0x2E)
+            shfmt = endian + "IIIIIIIIII"
+
+        # section header: name, type, flags, addr, offset, size, link, info, addralign, entsize
+        shList = [struct.unpack_from(shfmt, data, shoff + i * shentsize) for i in range(0, shnum)]
+        strtabOffset = shList[shstrndx][4]
+
+        ret = dict()
+        for sh in shList:
+            nameOffset = strtabOffset + sh[0]
+            if data[nameOffset:data.index(b"\x00", nameOffset)] != b".modinfo":
+                continue
+            for item in data[sh[4]:sh[4] + sh[5]].split(b"\x00"):
+                if b"=" not in item:
+                    continue
+                k, v = item.decode("utf-8", errors="replace").split("=", 1)
+                ret.setdefault(k, []).append(v)
+            break
+        return ret
+
     @staticmethod
     def _getFilesByKmodAliasGetKmodDepsList(ctx, kmodObj):
         if "depends" not in kmodObj.info or kmodObj.info["depends"] == "":
@@ -3169,6 +3077,391 @@ class TempCreateFile:
         os.unlink(self._fn)
 
 
+class MakeConf:
+
+    """
+    Parsed model of make.conf.
+
+    The file is read and parsed once. Only single-line VAR="value" definitions are recognized as
+    variables, all the other lines (comments, blank lines, multi-line definitions, ...) are kept as is,
+    so is the order of the lines.
+
+    Changes are made in memory and written atomically by commit(), the file is not written if
+    nothing has changed. When used as a context manager, commit() is called if no exception is raised.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        with open(filename, "r") as f:
+            self._lineList = f.read().split("\n")          # the last element is "" if the file ends with "\n"
+        self._varDict = None                                # variable name -> line index
+        self._bDirty = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.commit()
+
+    def has(self, varName):
+        return self._findLine(varName) is not None
+
+    def getRaw(self, varName):
+        """Returns variable value without ${} expansion, returns "" when not found"""
+
+        i = self._findLine(varName)
+        if i is None:
+            return ""
+        return self._lineList[i][len(varName) + 2:-1]
+
+    def get(self, varName):
+        """Returns variable value with ${} expanded, returns "" when not found"""
+
+        return self._expand(varName, [])
+
+    def set(self, varName, varValue):
+        """Create or set variable"""
+
+        line = "%s=\"%s\"" % (varName, varValue)
+        i = self._findLine(varName)
+        if i is not None:
+            if self._lineList[i] != line:
+                self._lineList[i] = line
+                self._bDirty = True
+        else:
+            if self._lineList[-1] == "":
+                self._lineList.insert(len(self._lineList) - 1, line)
+            else:
+                self._lineList += [line, ""]
+            self._varDict = None
+            self._bDirty = True
+
+    def setAsValueSet(self, varName, valueList):
+        """Create or set variable, the variable is not changed if it has the same set of values"""
+
+        if self.has(varName) and set(self.getRaw(varName).split(" ")) == set(valueList):
+            return
+        self.set(varName, " ".join(valueList))
+
+    def remove(self, varName):
+        """Remove all the lines that define the variable, including multi-line definitions"""
+
+        lineList = [x for x in self._lineList if not x.startswith(varName + "=")]
+        if len(lineList) != len(self._lineList):
+            self._lineList = lineList
+            self._varDict = None
+            self._bDirty = True
+
+    def isDirty(self):
+        return self._bDirty
+
+    def commit(self):
+        if not self._bDirty:
+            return
+
+        # write to a temporary file first, so that make.conf is never half-written
+        # the symlink is kept if make.conf is a symlink, the real file is replaced
+        realFilename = os.path.realpath(self._filename)
+        tmpFilename = realFilename + ".tmp"
+        with open(tmpFilename, "w") as f:
+            f.write("\n".join(self._lineList))
+        st = os.stat(realFilename)
+        os.chown(tmpFilename, st.st_uid, st.st_gid)
+        os.chmod(tmpFilename, stat.S_IMODE(st.st_mode))
+        os.rename(tmpFilename, realFilename)
+        self._bDirty = False
+
+    def _findLine(self, varName):
+        if self._varDict is None:
+            self._varDict = dict()
+            for i, line in enumerate(self._lineList):
+                m = re.fullmatch("([A-Za-z_][A-Za-z0-9_]*)=\".*\"", line)
+                if m is not None and m.group(1) not in self._varDict:
+                    self._varDict[m.group(1)] = i
+        return self._varDict.get(varName)
+
+    def _expand(self, varName, stack):
+        if varName in stack:
+            raise Exception("recursive variable %s in %s" % (varName, self._filename))
+
+        varVal = self.getRaw(varName)
+        while True:
+            m = re.search("\\${(\\S+?)}", varVal)
+            if m is None:
+                break
+            varVal = varVal.replace(m.group(0), self._expand(m.group(1), stack + [varName]))
+        return varVal
+
+
+class ResourceUsage:
+
+    """
+    Resource usage of a piece of work that may spread over several threads, such as a check run by
+    CheckEngine.
+
+    The usage object of the current work is kept in the context variable ResourceUsage.current.
+    ContextThreadPoolExecutor runs tasks in a copy of the submitter's context and adds their thread
+    cpu time to it. Cpu time of child processes is not included.
+    """
+
+    current = contextvars.ContextVar("ResourceUsage.current", default=None)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.threadCpuTime = 0
+        self.subprocessCount = 0
+
+    def addThreadCpuTime(self, t):
+        with self._lock:
+            self.threadCpuTime += t
+
+    def addSubprocess(self):
+        with self._lock:
+            self.subprocessCount += 1
+
+
+class ContextThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+
+    """
+    ThreadPoolExecutor whose tasks run in a copy of the contextvars context of the submitter, so that
+    the work done by pool threads is accounted to the ResourceUsage of the submitter.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, self._runTask, fn, args, kwargs)
+
+    @staticmethod
+    def _runTask(fn, args, kwargs):
+        usage = ResourceUsage.current.get()
+        if usage is None:
+            return fn(*args, **kwargs)
+        t = time.thread_time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            usage.addThreadCpuTime(time.thread_time() - t)
+
+
+class FileHasher:
+
+    """
+    Calculate file digests, all the file hashing of this program should be done by this class.
+
+    Small files are hashed by hashlib.file_digest() (read in 1MiB blocks on python < 3.11), big files
+    are mmap-ed and given to hashlib in one call, which saves the copy into a read buffer. hashlib
+    releases the GIL when hashing, so hashFileList() and hashDir() hash files by a thread pool.
+
+    If cacheFile is specified, a (path, size, mtime, ctime, inode) -> digest cache is kept in it,
+    files that have not changed since they were last hashed are not read again. Call saveCache() to
+    write it back.
+    """
+
+    blockSize = 1024 * 1024
+    mmapThreshold = 64 * 1024 * 1024
+    dirChunkSize = 4096
+
+    def __init__(self, algorithm="md5", cacheFile=None, maxWorkers=8):
+        self._algorithm = algorithm
+        self._new = getattr(hashlib, algorithm)
+        self._maxWorkers = maxWorkers
+
+        self._cacheFile = cacheFile
+        self._oldCache = dict()
+        self._newCache = dict()
+        if self._cacheFile is not None:
+            self._oldCache = FmUtil.cacheLoad(self._cacheFile)
+            if not isinstance(self._oldCache, dict):
+                self._oldCache = dict()
+
+        self._lock = threading.Lock()
+        self._fileCount = 0
+        self._hitCount = 0
+        self._byteCount = 0
+
+    def hashFile(self, filename):
+        """Returns hex digest, symlinks are followed"""
+
+        with open(filename, "rb") as f:
+            s = os.fstat(f.fileno())
+            key = [s.st_size, s.st_mtime_ns, s.st_ctime_ns, s.st_ino]
+            entry = self._oldCache.get(filename)
+            if entry is not None and entry[:4] == key:
+                digest = entry[4]
+                with self._lock:
+                    self._fileCount += 1
+                    self._hitCount += 1
+            else:
+                digest = self._hashFileObj(f, s.st_size)
+                with self._lock:
+                    self._fileCount += 1
+                    self._byteCount += s.st_size
+
+        if self._cacheFile is not None:
+            with self._lock:
+                self._newCache[filename] = key + [digest]
+        return digest
+
+    def hashFileList(self, filenameList):
+        """Returns list<hex digest> in the same order as filenameList"""
+
+        with ContextThreadPoolExecutor(max_workers=self._maxWorkers) as pool:
+            return list(pool.map(self.hashFile, filenameList))
+
+    def hashDir(self, dirname):
+        """Returns hex digest of the digests of every 4KiB chunk of every file in os.walk() order.
+           It is the signature format stored by the kernel builder, so it must not be changed."""
+
+        filenameList = []
+        for root, dirs, files in os.walk(dirname):
+            for fn in files:
+                filenameList.append(os.path.join(root, fn))
+
+        h = self._new()
+        with ContextThreadPoolExecutor(max_workers=self._maxWorkers) as pool:
+            for buf in pool.map(self._hashFileChunks, filenameList):
+                h.update(buf)
+        return h.hexdigest()
+
+    def getStatistics(self):
+        """Returns (fileCount, cacheHitCount, bytesHashed)"""
+
+        with self._lock:
+            return (self._fileCount, self._hitCount, self._byteCount)
+
+    def saveCache(self, bPrune=False):
+        # with bPrune, only files hashed by this object are recorded, so that entries for removed files are dropped
+        assert self._cacheFile is not None
+        with self._lock:
+            if bPrune:
+                data = dict(self._newCache)
+            else:
+                data = dict(self._oldCache)
+                data.update(self._newCache)
+        FmUtil.cacheSave(self._cacheFile, data)
+
+    def _hashFileObj(self, f, size):
+        if size >= self.mmapThreshold:
+            h = self._new()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                h.update(m)
+            return h.hexdigest()
+
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, self._new).hexdigest()
+
+        h = self._new()
+        while True:
+            buf = f.read(self.blockSize)
+            if len(buf) == 0:
+                break
+            h.update(buf)
+        return h.hexdigest()
+
+    def _hashFileChunks(self, filename):
+        # returns the concatenated digests of every 4KiB chunk, reads are done in big blocks
+        ret = bytearray()
+        with open(filename, "rb") as f:
+            while True:
+                buf = f.read(self.blockSize)
+                if len(buf) == 0:
+                    break
+                mv = memoryview(buf)
+                for i in range(0, len(buf), self.dirChunkSize):
+                    ret += self._new(mv[i:i + self.dirChunkSize]).digest()
+        return ret
+
+
+class RepoPkgIndex:
+
+    """
+    Package directory index of an ebuild repository: category -> list<package>.
+
+    There's one index object for each repository directory in a process, it is revalidated on every
+    access by the mtime of the repository directory and the category directories, a category directory
+    is listed again only when its mtime changes.
+
+    The index objects can be used by multiple threads.
+    """
+
+    _indexDict = dict()             # repoDir -> RepoPkgIndex
+    _indexDictLock = threading.Lock()
+
+    @staticmethod
+    def get(repoDir):
+        repoDir = os.path.normpath(repoDir)
+        with RepoPkgIndex._indexDictLock:
+            obj = RepoPkgIndex._indexDict.get(repoDir)
+            if obj is None:
+                obj = RepoPkgIndex(repoDir)
+                RepoPkgIndex._indexDict[repoDir] = obj
+        obj.refresh()
+        return obj
+
+    def __init__(self, repoDir):
+        self._repoDir = repoDir
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._catDict = dict()          # category -> (mtime, list<package>)
+        self._pkgList = None
+        self._pkgSet = None
+
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+
+    def getCategoryList(self):
+        with self._lock:
+            return sorted(self._catDict.keys())
+
+    def getPkgNameList(self):
+        """returns list<category/package>"""
+
+        with self._lock:
+            return list(self._pkgList)
+
+    def hasPkg(self, pkgName):
+        with self._lock:
+            return pkgName in self._pkgSet
+
+    def _refresh(self):
+        mtime = os.stat(self._repoDir).st_mtime_ns
+        if mtime != self._mtime:
+            catList = []
+            for fbasename in os.listdir(self._repoDir):
+                if FmUtil.repoIsSysFile(fbasename):
+                    continue
+                if not os.path.isdir(os.path.join(self._repoDir, fbasename)):
+                    continue
+                catList.append(fbasename)
+            self._mtime = mtime
+        else:
+            catList = list(self._catDict.keys())
+
+        catDict = dict()
+        for cat in catList:
+            catDir = os.path.join(self._repoDir, cat)
+            try:
+                mtime = os.stat(catDir).st_mtime_ns
+            except FileNotFoundError:
+                self._mtime = None          # the category is removed, re-list the repository directory next time
+                continue
+            item = self._catDict.get(cat)
+            if item is None or item[0] != mtime:
+                item = (mtime, sorted(x for x in os.listdir(catDir) if os.path.isdir(os.path.join(catDir, x))))
+                self._pkgList = None
+            catDict[cat] = item
+        if len(catDict) != len(self._catDict):
+            self._pkgList = None
+        self._catDict = catDict
+
+        if self._pkgList is None:
+            self._pkgList = []
+            for cat in sorted(self._catDict.keys()):
+                self._pkgList += [cat + "/" + x for x in self._catDict[cat][1]]
+            self._pkgSet = set(self._pkgList)
+
+
 class InfoPrinter:
 
     GOOD = '\033[32;01m'
@@ -3205,7 +3498,9 @@ class InfoPrinter:
         else:
             self.printByErrorBuffer += line
 
-    def printError(self, s):
+    def printError(self, s, path=None, pkg=None, bAutoFixable=False):
+        """path, pkg and bAutoFixable are for machine-readable reports, they are not printed"""
+
         line = ""
         line += self.BAD + "*" + self.NORMAL + " "
         line += "\t" * self.indent
@@ -4,6 +4,8 @@
 import os
 import re
 import glob
+import stat
+import time
 import shutil
 import tarfile
 import pylkcutil
@@ -11,6 +13,7 @@ from collections import OrderedDict
 from multiprocessing import Process
 from fm_util import FmUtil
 from fm_util import TempChdir
+from fm_util import FileHasher
 from fm_param import FmConst
 
 
@@ -57,6 +60,12 @@ class FkmInitramfsBuilder:
         # trick: initramfs debug is seldomly needed
         self.trickDebug = False
 
+        self.manifestCacheFile = os.path.join(FmConst.cacheDir, "initramfs-manifest.cache")
+        self.stageTimeList = []             # [(stage-name, seconds)], filled by build()
+
+        self._srcDict = dict()              # file path in initramfs -> source file path
+        self._libUsedDict = dict()          # binary file path -> shared library list
+
     def setMntInfo(self, miType, devPath, mntOpt):
         assert miType in list(self.mntInfoDict.keys())
         self.mntInfoDict[miType] = _MntInfo()
@@ -65,14 +74,71 @@ class FkmInitramfsBuilder:
         self.mntInfoDict[miType].mntOpt = mntOpt
 
     def build(self, targetInitrdFile, targetTarFile):
+        """Returns False if the target files are up to date so they are not regenerated"""
+
         assert "/" not in targetInitrdFile
         assert "/" not in targetTarFile and targetTarFile.endswith(".tar.bz2")
 
-        FmUtil.mkDirAndClear(self.initramfsTmpDir)
+        self.stageTimeList = []
+        self._srcDict = dict()
 
-        # variables
+        # stage 1: populate the initramfs directory
+        t = time.time()
+        self._populate()
+        self.stageTimeList.append(("populate", time.time() - t))
+
+        # stage 2: compare with the manifest of the last build
+        t = time.time()
         targetInitrdFile = os.path.join(self.bootDir, targetInitrdFile)
         targetTarFile = os.path.join(self.bootDir, targetTarFile)
+        manifest = self._getManifest(self.initramfsTmpDir)
+        with open(os.path.join(self.initramfsTmpDir, "startup.rc")) as f:
+            startupRc = f.read()
+        cache = FmUtil.cacheLoad(self.manifestCacheFile)
+        if not isinstance(cache, dict):
+            cache = dict()
+        cache = {k: v for k, v in cache.items() if os.path.exists(k)}
+        bUpToDate = False
+        if targetInitrdFile in cache:
+            old = cache[targetInitrdFile]
+            if old["manifest"] == manifest and old["startup.rc"] == startupRc:
+                if old["initrd-stamp"] == self._getStamp(targetInitrdFile) and old["tar-stamp"] == self._getStamp(targetTarFile):
+                    bUpToDate = True
+        self.stageTimeList.append(("manifest", time.time() - t))
+        if bUpToDate:
+            return False
+
+        # stage 3: build the initramfs file and tar file
+        t = time.time()
+        with TempChdir(self.initramfsTmpDir):
+            # initramfs file
+            cmdStr = "/usr/bin/find . -print0 "
+            cmdStr += "| /bin/cpio --null -H newc -o "
+            cmdStr += "| /usr/bin/xz --format=lzma "            # it seems linux kernel config RD_XZ has bug, so we must use format lzma
+            cmdStr += "> \"%s\" " % (targetInitrdFile)
+            FmUtil.shellCall(cmdStr)
+
+            # tar file
+            with tarfile.open(targetTarFile, "w:bz2") as f:
+                for fn in glob.glob("*"):
+                    f.add(fn)
+        self.stageTimeList.append(("archive", time.time() - t))
+
+        # record manifest
+        cache[targetInitrdFile] = {
+            "manifest": manifest,
+            "startup.rc": startupRc,
+            "initrd-stamp": self._getStamp(targetInitrdFile),
+            "tar-stamp": self._getStamp(targetTarFile),
+        }
+        FmUtil.cacheSave(self.manifestCacheFile, cache)
+
+        return True
+
+    def _populate(self):
+        FmUtil.mkDirAndClear(self.initramfsTmpDir)
+
+        # variables
         rootDir = self.initramfsTmpDir
         etcDir = os.path.join(rootDir, "etc")
 
@@ -402,19 +468,36 @@ class FkmInitramfsBuilder:
                 f.write("find \"%s\" -name \"*.ko\" | xargs basename -a -s \".ko\" | xargs /sbin/modprobe -a" % (dstdir))
                 f.write("\n")
 
-        # build the initramfs file and tar file
-        with TempChdir(rootDir):
-            # initramfs file
-            cmdStr = "/usr/bin/find . -print0 "
-            cmdStr += "| /bin/cpio --null -H newc -o "
-            cmdStr += "| /usr/bin/xz --format=lzma "            # it seems linux kernel config RD_XZ has bug, so we must use format lzma
-            cmdStr += "> \"%s\" " % (targetInitrdFile)
-            FmUtil.shellCall(cmdStr)
+    def _getManifest(self, rootDir):
+        # returns list<[path, type, source-path, digest-or-link-target, mode]>
+        ret = []
+        for root, dirs, files in os.walk(rootDir):
+            dirs.sort()
+            for fn in sorted(dirs + files):
+                fullfn = os.path.join(root, fn)
+                relfn = os.path.relpath(fullfn, rootDir)
+                s = os.lstat(fullfn)
+                if stat.S_ISLNK(s.st_mode):
+                    ret.append([relfn, "sym", None, os.readlink(fullfn), None])
+                elif stat.S_ISDIR(s.st_mode):
+                    ret.append([relfn, "dir", None, None, s.st_mode])
+                elif stat.S_ISREG(s.st_mode):
+                    ret.append([relfn, "obj", self._srcDict.get("/" + relfn), None, s.st_mode])
+                else:
+                    ret.append([relfn, "other", None, None, s.st_mode])
 
-            # tar file
-            with tarfile.open(targetTarFile, "w:bz2") as f:
-                for fn in glob.glob("*"):
-                    f.add(fn)
+        # files are hashed concurrently
+        objList = [x for x in ret if x[1] == "obj"]
+        digestList = FileHasher("sha1").hashFileList([os.path.join(rootDir, x[0]) for x in objList])
+        for item, digest in zip(objList, digestList):
+            item[3] = digest
+        return ret
+
+    def _getStamp(self, filename):
+        if not os.path.exists(filename):
+            return None
+        s = os.stat(filename)
+        return [s.st_size, s.st_mtime_ns]
 
     def _generatePasswd(self, filename):
         with open(filename, "w") as f:
@@ -446,19 +529,25 @@ class FkmInitramfsBuilder:
 
     def _installBin(self, binFilename, rootDir):
         self._copyToInitrd(binFilename, rootDir)
-        for df in FmUtil.libUsed(binFilename):
+        for df in self._libUsed(binFilename):
             self._copyToInitrd(df, rootDir)
 
     def _installBinFromInitDataDir(self, binFilename, rootDir, targetDir):
         srcFilename = os.path.join(FmConst.libInitrdDir, binFilename)
         dstFilename = os.path.join(rootDir, targetDir, binFilename)
 
-        FmUtil.cmdCall("/bin/cp", "-f", srcFilename, dstFilename)
-        FmUtil.cmdCall("/bin/chmod", "755", dstFilename)
+        shutil.copyfile(srcFilename, dstFilename)
+        os.chmod(dstFilename, 0o755)
+        self._srcDict[os.path.join("/", targetDir, binFilename)] = srcFilename
 
-        for df in FmUtil.libUsed(dstFilename):
+        for df in self._libUsed(srcFilename):
             self._copyToInitrd(df, rootDir)
 
+    def _libUsed(self, binFilename):
+        if binFilename not in self._libUsedDict:
+            self._libUsedDict[binFilename] = FmUtil.libUsed(binFilename)
+        return self._libUsedDict[binFilename]
+
     def _installFilesLvm(self, rootDir):
         self._installBinFromInitDataDir("lvm-lv-activate", rootDir, "usr/sbin")
 
@@ -665,7 +754,9 @@ class FkmInitramfsBuilder:
         dstdir = os.path.dirname(dstfile)
         if not os.path.exists(dstdir):
             os.makedirs(dstdir)
-        FmUtil.cmdCall("/bin/cp", "-f", filename, dstfile)
+        shutil.copyfile(filename, dstfile)
+        shutil.copymode(filename, dstfile)
+        self._srcDict[filename] = filename
 
 
 class _MntInfo:
@@ -14,7 +14,10 @@ import urllib.request
 import urllib.error
 from fm_util import FmUtil
 from fm_util import TempChdir
+from fm_util import FileHasher
 from fm_param import FmConst
+from helper_kmod_index import KmodInfoIndex
+from helper_mirror_prober import MirrorProber
 
 
 class FkmBuildTarget:
@@ -259,23 +262,21 @@ class FkmKernelBuilder:
 
     def buildStepExtract(self):
         FmUtil.forceDelete(self.tmpDir)         # FIXME
+        os.makedirs(self.tmpDir)
 
         # extract kernel source
-        os.makedirs(self.ksrcTmpDir)
         fn = self.kcache.getKernelFileByVersion(self.kernelVer)
-        FmUtil.cmdCall("/bin/tar", "-xJf", fn, "-C", self.ksrcTmpDir)
+        self._copyTree(self.kcache.getPristineTree(fn), self.ksrcTmpDir)
 
         # extract kernel firmware
-        os.makedirs(self.firmwareTmpDir)
         fn = self.kcache.getFirmwareFileByVersion(self.firmwareVer)
-        FmUtil.cmdCall("/bin/tar", "-xJf", fn, "-C", self.firmwareTmpDir)
+        self._copyTree(self.kcache.getPristineTree(fn), self.firmwareTmpDir)
         for dn in self.kcache.getExtraFirmwareDirList():
-            FmUtil.shellCall("/bin/cp -rf \"%s\"/* \"%s\"" % (dn, self.firmwareTmpDir))
+            FmUtil.shellCall("/bin/cp -rf --remove-destination \"%s\"/* \"%s\"" % (dn, self.firmwareTmpDir))
 
         # extract wireless regulatory database
-        os.makedirs(self.wirelessRegDbTmpDir)
         fn = self.kcache.getWirelessRegDbFileByVersion(self.wirelessRegDbVer)
-        FmUtil.cmdCall("/bin/tar", "-xJf", fn, "-C", self.wirelessRegDbTmpDir)
+        self._copyTree(self.kcache.getPristineTree(fn), self.wirelessRegDbTmpDir)
 
         # get real source directory
         self.realSrcDir = os.path.join(self.ksrcTmpDir, os.listdir(self.ksrcTmpDir)[0])
@@ -394,13 +395,11 @@ class FkmKernelBuilder:
         # 1. should consider built-in modules by parsing /lib/modules/X.Y.Z/modules.builtin.modinfo
         # 2. currently it seems built-in modules don't need firmware
         firmwareList = []
-        for fullfn in glob.glob(os.path.join("/lib/modules", self.dstTarget.verstr, "**", "*.ko"), recursive=True):
-            # python-kmod bug: can only recognize the last firmware in modinfo
-            # so use the command output of modinfo directly
-            for line in FmUtil.cmdCall("/bin/modinfo", fullfn).split("\n"):
-                m = re.fullmatch("firmware: +(\\S.*)", line)
-                if m is not None:
-                    firmwareList.append((m.group(1), fullfn.replace("/lib/modules/%s/" % (self.dstTarget.verstr), "")))
+        kmodIndex = KmodInfoIndex(os.path.join("/lib/modules", self.dstTarget.verstr))
+        for fullfn in kmodIndex.getModuleList():
+            for fn in kmodIndex.getFirmwareList(fullfn):
+                firmwareList.append((fn, fullfn.replace("/lib/modules/%s/" % (self.dstTarget.verstr), "")))
+        kmodIndex.save()
         FmUtil.ensureDir("/lib/firmware")
         for fn, kn in firmwareList:
             srcFn = os.path.join(self.firmwareTmpDir, fn)
@@ -472,6 +471,11 @@ class FkmKernelBuilder:
         os.unlink(os.path.join(dn, "source"))
         os.unlink(os.path.join(dn, "build"))
 
+    def _copyTree(self, srcDir, dstDir):
+        # the kernel is built in the source directory, so the working copy must not share data with the pristine tree
+        # reflink is used when the filesystem supports it, otherwise it falls back to a normal copy
+        FmUtil.cmdCall("/bin/cp", "-a", "--reflink=auto", srcDir, dstDir)
+
     def _getModulesDir(self):
         return "/lib/modules/%s" % (self.kernelVer)
 
@@ -511,6 +515,7 @@ class FkmKCache:
 
     def __init__(self):
         self.ksyncFile = os.path.join(FmConst.kcacheDir, "ksync.txt")
+        self.pristineDir = os.path.join(FmConst.kcacheDir, "pristine")
 
     def getLatestKernelVersion(self):
         kernelVer = self._readDataFromKsyncFile("kernel")
@@ -570,6 +575,19 @@ class FkmKCache:
         fn = os.path.join(FmConst.kcacheDir, fn)
         return fn
 
+    def getPristineTree(self, tarballFile):
+        """Returns the directory where tarballFile is extracted, it should be treated as read-only.
+           The tarball is extracted only once, the directory is keyed by the digest of the tarball."""
+
+        dirname = os.path.join(self.pristineDir, "%s.%s" % (os.path.basename(tarballFile), _hashTarball(tarballFile)))
+        if not os.path.exists(dirname):
+            tmpDirname = dirname + ".tmp"
+            FmUtil.forceDelete(tmpDirname)
+            os.makedirs(tmpDirname)
+            FmUtil.cmdCall("/bin/tar", "-x", "-I", self._getXzDecompressor(), "-f", tarballFile, "-C", tmpDirname)
+            os.rename(tmpDirname, dirname)
+        return dirname
+
     def getExtraFirmwareDirList(self):
         return glob.glob(os.path.join(FmConst.kcacheDir, "firmware-repo-*"))
 
@@ -588,6 +606,12 @@ class FkmKCache:
         fn = os.path.join(FmConst.kcacheDir, fn)
         return fn
 
+    def _getXzDecompressor(self):
+        # pixz decompresses in parallel, xz only does so for multi-block files (since xz-5.4)
+        if os.path.exists("/usr/bin/pixz"):
+            return "/usr/bin/pixz"
+        return "/usr/bin/xz -T0"
+
     def _readDataFromKsyncFile(self, prefix):
         indexDict = {
             "kernel": 0,
@@ -673,10 +697,10 @@ class FkmKCacheUpdater:
                 FmUtil.forceDelete(mySignFile)
 
         # get mirror
-        mr, retlist = FmUtil.portageGetLinuxKernelMirror(FmConst.portageCfgMakeConf,
-                                                         FmConst.defaultKernelMirror,
-                                                         kernelVersion,
-                                                         [kernelFile, signFile])
+        mr, retlist = MirrorProber().getLinuxKernelMirror(FmConst.portageCfgMakeConf,
+                                                          FmConst.defaultKernelMirror,
+                                                          kernelVersion,
+                                                          [kernelFile, signFile])
         kernelFile = retlist[0]
         signFile = retlist[1]
 
@@ -700,9 +724,9 @@ class FkmKCacheUpdater:
                 FmUtil.forceDelete(mySignFile)
 
         # get mirror
-        mr, retlist = FmUtil.portageGetLinuxFirmwareMirror(FmConst.portageCfgMakeConf,
-                                                           FmConst.defaultKernelMirror,
-                                                           [firmwareFile, signFile])
+        mr, retlist = MirrorProber().getLinuxFirmwareMirror(FmConst.portageCfgMakeConf,
+                                                            FmConst.defaultKernelMirror,
+                                                            [firmwareFile, signFile])
         firmwareFile = retlist[0]
         signFile = retlist[1]
 
@@ -829,6 +853,31 @@ class FkmKCacheUpdater:
             fileList = fileList[:-1]
         return fileList
 
+    def getOldPristineTreeList(self):
+        """pristine trees whose tarball no longer exists, and pristine trees of a tarball that has changed"""
+
+        pristineDir = os.path.join(FmConst.kcacheDir, "pristine")
+        if not os.path.exists(pristineDir):
+            return []
+
+        ret = []
+        tdict = dict()
+        for f in os.listdir(pristineDir):
+            fullfn = os.path.join("pristine", f)
+            if f.endswith(".tmp"):
+                ret.append(fullfn)
+                continue
+            tarballFile = os.path.join(FmConst.kcacheDir, f.rsplit(".", 1)[0])
+            if not os.path.exists(tarballFile):
+                ret.append(fullfn)
+                continue
+            tdict.setdefault(tarballFile, []).append(fullfn)
+        for tarballFile, dirList in tdict.items():
+            if len(dirList) > 1:
+                digest = _hashTarball(tarballFile)
+                ret += [x for x in dirList if not x.endswith("." + digest)]
+        return sorted(ret)
+
     def _findKernelVersion(self, typename):
         try:
             resp = urllib.request.urlopen(self.kernelUrl, timeout=FmUtil.urlopenTimeout(), cafile=certifi.where())
@@ -900,3 +949,12 @@ class FkmKCacheUpdater:
 
 
 _bootDir = "/boot"
+
+
+def _hashTarball(tarballFile):
+    # tarballs are big and rarely change, their digests are cached
+    hasher = FileHasher("md5", cacheFile=os.path.join(FmConst.cacheDir, "kcache-digest.cache"))
+    ret = hasher.hashFile(tarballFile)
+    if hasher.getStatistics()[1] == 0:
+        hasher.saveCache()
+    return ret
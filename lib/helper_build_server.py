@@ -4,10 +4,12 @@
 import os
 import re
 import json
+import select
+import shutil
 import socket
 import struct
 import tempfile
-import subprocess
+import threading
 from OpenSSL import SSL
 from fm_util import FmUtil
 from fm_util import AvahiServiceBrowser
@@ -116,6 +118,10 @@ class BuildServer:
         self.wRsyncPort = None
         self.wCatFilePort = None
 
+        self.tunnelDict = dict()            # remote-port -> _TlsTunnel
+        self.sshTmpDir = None
+        self.sshCfgFile = None
+
     def getHostname(self):
         return self.hostname
 
@@ -152,6 +158,15 @@ class BuildServer:
             raise
 
     def dispose(self):
+        if self.sshTmpDir is not None:
+            # stop the ssh master connection
+            FmUtil.cmdCallWithRetCode("/usr/bin/ssh", "-F", self.sshCfgFile, "-p", str(self.wSshPort), "-O", "exit", self.hostname)
+            shutil.rmtree(self.sshTmpDir)
+            self.sshTmpDir = None
+            self.sshCfgFile = None
+        for tunnel in self.tunnelDict.values():
+            tunnel.dispose()
+        self.tunnelDict = dict()
         self.wSshPort = None
         self.wSshKey = None
         self.wRsyncPort = None
@@ -176,41 +191,39 @@ class BuildServer:
         assert resp["return"]["stage"] == "syncup"
 
         # rsync
-        stunnelCfgFile, newPort, proc = self._createStunnelProcess(resp["return"]["rsync-port"])
-        try:
-            cmd = ""
-            cmd += "/usr/bin/rsync -a -z -hhh --delete --delete-excluded --partial --info=progress2 "
-            for fn in self._ignoredPatternsWhenSyncUp():
-                cmd += "-f '- %s' " % (fn)
-            cmd += "-f '+ /bin' "                                       # /bin may be a symlink or directory
-            cmd += "-f '+ /bin/***' "
-            cmd += "-f '+ /boot/***' "
-            cmd += "-f '+ /etc/***' "
-            cmd += "-f '+ /lib' "                                       # /lib may be a symlink or directory
-            cmd += "-f '+ /lib/***' "
-            cmd += "-f '+ /lib32' "                                     # /lib32 may be a symlink or directory
-            cmd += "-f '+ /lib32/***' "
-            cmd += "-f '+ /lib64' "                                     # /lib64 may be a symlink or directory
-            cmd += "-f '+ /lib64/***' "
-            cmd += "-f '+ /opt/***' "
-            cmd += "-f '+ /sbin' "                                      # /sbin may be a symlink or directory
-            cmd += "-f '+ /sbin/***' "
-            cmd += "-f '+ /usr/***' "
-            cmd += "-f '+ /var' "
-            cmd += "-f '+ /var/cache' "
-            cmd += "-f '+ /var/cache/edb/***' "
-            cmd += "-f '+ /var/cache/portage/***' "
-            cmd += "-f '+ /var/db' "
-            cmd += "-f '+ /var/db/pkg/***' "
-            cmd += "-f '+ /var/lib' "
-            cmd += "-f '+ /var/lib/portage/***' "
-            cmd += "-f '- /**' "
-            cmd += "/ rsync://127.0.0.1:%d/main" % (newPort)
-            FmUtil.shellExec(cmd)
-        finally:
-            proc.terminate()
-            proc.wait()
-            os.unlink(stunnelCfgFile)
+        newPort = self._getTunnelPort(resp["return"]["rsync-port"])
+        cmd = ""
+        cmd += "/usr/bin/rsync -a -z -hhh --delete --delete-excluded --partial --info=progress2 "
+        for fn in self._ignoredPatternsWhenSyncUp():
+            cmd += "-f '- %s' " % (fn)
+        for fn in self._protectedPatternsWhenSyncUp():
+            cmd += "-f 'P %s/***' " % (fn)                           # "P" is a receiver side rule, so "--delete-excluded" doesn't delete it
+            cmd += "-f '- %s' " % (fn)
+        cmd += "-f '+ /bin' "                                       # /bin may be a symlink or directory
+        cmd += "-f '+ /bin/***' "
+        cmd += "-f '+ /boot/***' "
+        cmd += "-f '+ /etc/***' "
+        cmd += "-f '+ /lib' "                                       # /lib may be a symlink or directory
+        cmd += "-f '+ /lib/***' "
+        cmd += "-f '+ /lib32' "                                     # /lib32 may be a symlink or directory
+        cmd += "-f '+ /lib32/***' "
+        cmd += "-f '+ /lib64' "                                     # /lib64 may be a symlink or directory
+        cmd += "-f '+ /lib64/***' "
+        cmd += "-f '+ /opt/***' "
+        cmd += "-f '+ /sbin' "                                      # /sbin may be a symlink or directory
+        cmd += "-f '+ /sbin/***' "
+        cmd += "-f '+ /usr/***' "
+        cmd += "-f '+ /var' "
+        cmd += "-f '+ /var/cache' "
+        cmd += "-f '+ /var/cache/edb/***' "
+        cmd += "-f '+ /var/cache/portage/***' "
+        cmd += "-f '+ /var/db' "
+        cmd += "-f '+ /var/db/pkg/***' "
+        cmd += "-f '+ /var/lib' "
+        cmd += "-f '+ /var/lib/portage/***' "
+        cmd += "-f '- /**' "
+        cmd += "/ rsync://127.0.0.1:%d/main" % (newPort)
+        FmUtil.shellExec(cmd)
 
     def startWorking(self):
         self._sendRequestObj({
@@ -226,175 +239,152 @@ class BuildServer:
         self.wRsyncPort = resp["return"]["rsync-port"]
         self.wCatFilePort = resp["return"]["catfile-port"]
 
+        # write ssh identity file and config file once, all the ssh sessions share one master connection
+        self.sshTmpDir = tempfile.mkdtemp()
+        identityFile = os.path.join(self.sshTmpDir, "identity")
+        with open(identityFile, "w") as f:
+            f.write(self.wSshKey)
+        os.chmod(identityFile, 0o600)
+
+        self.sshCfgFile = os.path.join(self.sshTmpDir, "config")
+        buf = ""
+        buf += "LogLevel QUIET\n"
+        buf += "\n"
+        buf += "KbdInteractiveAuthentication no\n"
+        buf += "PasswordAuthentication no\n"
+        buf += "PubkeyAuthentication yes\n"
+        buf += "PreferredAuthentications publickey\n"
+        buf += "\n"
+        buf += "IdentityFile %s\n" % (identityFile)
+        buf += "UserKnownHostsFile /dev/null\n"
+        buf += "StrictHostKeyChecking no\n"
+        buf += "\n"
+        buf += "ControlMaster auto\n"
+        buf += "ControlPath %s\n" % (os.path.join(self.sshTmpDir, "control"))
+        buf += "ControlPersist yes\n"
+        buf += "\n"
+        buf += "SendEnv LANG LC_*\n"
+        with open(self.sshCfgFile, "w") as f:
+            f.write(buf)
+
     def sshExec(self, cmd):
         assert self.wSshPort is not None
 
-        identityFile = tempfile.mktemp()
-        cfgFile = tempfile.mktemp()
-        try:
-            with open(identityFile, "w") as f:
-                f.write(self.wSshKey)
-            os.chmod(identityFile, 0o600)
-
-            buf = ""
-            buf += "LogLevel QUIET\n"
-            buf += "\n"
-            buf += "KbdInteractiveAuthentication no\n"
-            buf += "PasswordAuthentication no\n"
-            buf += "PubkeyAuthentication yes\n"
-            buf += "PreferredAuthentications publickey\n"
-            buf += "\n"
-            buf += "IdentityFile %s\n" % (identityFile)
-            buf += "UserKnownHostsFile /dev/null\n"
-            buf += "StrictHostKeyChecking no\n"
-            buf += "\n"
-            buf += "SendEnv LANG LC_*\n"
-            with open(cfgFile, "w") as f:
-                f.write(buf)
-
-            # "-t" can get Ctrl+C controls remote process
-            # XXXXX so that we forward signal to remote process, FIXME
-            cmd = "/usr/bin/ssh -t -e none -p %d -F %s %s %s" % (self.wSshPort, cfgFile, self.hostname, cmd)
-            FmUtil.shellExec(cmd)
-        finally:
-            os.unlink(cfgFile)
-            os.unlink(identityFile)
+        # "-t" can get Ctrl+C controls remote process
+        # XXXXX so that we forward signal to remote process, FIXME
+        cmd = "/usr/bin/ssh -t -e none -p %d -F %s %s %s" % (self.wSshPort, self.sshCfgFile, self.hostname, cmd)
+        FmUtil.shellExec(cmd)
 
     def getFile(self, filename):
         assert self.wSshPort is not None
 
-        stunnelCfgFile, newPort, proc = self._createStunnelProcess(self.wCatFilePort)
+        newPort = self._getTunnelPort(self.wCatFilePort)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            try:
-                sock.connect(("127.0.0.1", newPort))
-                sock.sendall(struct.pack("!I", len(filename.encode("utf-8"))))
-                sock.sendall(filename.encode("utf-8"))
-                errCode = struct.unpack("!c", self._sockRecvAll(sock, 1))[0]
-                dataLen = struct.unpack("!Q", self._sockRecvAll(sock, 8))[0]
-                data = self._sockRecvAll(sock, dataLen)
-                if errCode != b'\x00':
-                    raise Exception(data.decode("utf-8"))
-                return data
-            finally:
-                sock.close()
+            sock.connect(("127.0.0.1", newPort))
+            sock.sendall(struct.pack("!I", len(filename.encode("utf-8"))))
+            sock.sendall(filename.encode("utf-8"))
+            errCode = struct.unpack("!c", self._sockRecvAll(sock, 1))[0]
+            dataLen = struct.unpack("!Q", self._sockRecvAll(sock, 8))[0]
+            data = self._sockRecvAll(sock, dataLen)
+            if errCode != b'\x00':
+                raise Exception(data.decode("utf-8"))
+            return data
         finally:
-            proc.terminate()
-            proc.wait()
-            os.unlink(stunnelCfgFile)
+            sock.close()
 
     def syncDownKernel(self):
         assert self.wSshPort is not None
 
-        stunnelCfgFile, newPort, proc = self._createStunnelProcess(self.wRsyncPort)
-        try:
-            cmd = ""
-            cmd += "/usr/bin/rsync -a -z -hhh --delete --info=progress2 "
-            cmd += "-f '+ /boot' "
-            cmd += "-f '+ /boot/config-*' "
-            cmd += "-f '+ /boot/initramfs-*' "
-            cmd += "-f '+ /boot/kernel-*' "
-            cmd += "-f '+ /boot/System.map-*' "
-            cmd += "-f '+ /boot/history/***' "
-            cmd += "-f '+ /lib' "
-            cmd += "-f '+ /lib/modules/***' "
-            cmd += "-f '+ /lib/firmware/***' "
-            cmd += "-f '- /**' "
-            cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
-            FmUtil.shellExec(cmd)
-        finally:
-            proc.terminate()
-            proc.wait()
-            os.unlink(stunnelCfgFile)
+        newPort = self._getTunnelPort(self.wRsyncPort)
+        cmd = ""
+        cmd += "/usr/bin/rsync -a -z -hhh --delete --info=progress2 "
+        cmd += "-f '+ /boot' "
+        cmd += "-f '+ /boot/config-*' "
+        cmd += "-f '+ /boot/initramfs-*' "
+        cmd += "-f '+ /boot/kernel-*' "
+        cmd += "-f '+ /boot/System.map-*' "
+        cmd += "-f '+ /boot/history/***' "
+        cmd += "-f '+ /lib' "
+        cmd += "-f '+ /lib/modules/***' "
+        cmd += "-f '+ /lib/firmware/***' "
+        cmd += "-f '- /**' "
+        cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
+        FmUtil.shellExec(cmd)
 
     def syncDownSystem(self):
         assert self.wSshPort is not None
 
-        stunnelCfgFile, newPort, proc = self._createStunnelProcess(self.wRsyncPort)
-        try:
-            cmd = ""
-            cmd += "/usr/bin/rsync -a -z -hhh --delete --info=progress2 "
-            for fn in self._ignoredPatternsWhenSyncDown():
-                cmd += "-f '- %s' " % (fn)
-            cmd += "-f '+ /bin' "                                       # /bin may be a symlink or directory
-            cmd += "-f '+ /bin/***' "
-            cmd += "-f '+ /etc/***' "
-            cmd += "-f '+ /lib' "                                       # /lib may be a symlink or directory
-            cmd += "-f '+ /lib/***' "
-            cmd += "-f '+ /lib32' "                                     # /lib may be a symlink or directory
-            cmd += "-f '+ /lib32/***' "
-            cmd += "-f '+ /lib64' "                                     # /lib may be a symlink or directory
-            cmd += "-f '+ /lib64/***' "
-            cmd += "-f '+ /opt/***' "
-            cmd += "-f '+ /sbin' "                                      # /sbin may be a symlink or directory
-            cmd += "-f '+ /sbin/***' "
-            cmd += "-f '+ /usr/***' "
-            cmd += "-f '+ /var' "
-            cmd += "-f '+ /var/cache' "
-            cmd += "-f '+ /var/cache/edb/***' "
-            cmd += "-f '+ /var/cache/portage/***' "
-            cmd += "-f '+ /var/db' "
-            cmd += "-f '+ /var/db/pkg/***' "
-            cmd += "-f '+ /var/lib' "
-            cmd += "-f '+ /var/lib/portage/***' "
-            cmd += "-f '- /**' "
-            cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
-            FmUtil.shellExec(cmd)
-        finally:
-            proc.terminate()
-            proc.wait()
-            os.unlink(stunnelCfgFile)
+        newPort = self._getTunnelPort(self.wRsyncPort)
+        cmd = ""
+        cmd += "/usr/bin/rsync -a -z -hhh --delete --info=progress2 "
+        for fn in self._ignoredPatternsWhenSyncDown():
+            cmd += "-f '- %s' " % (fn)
+        cmd += "-f '+ /bin' "                                       # /bin may be a symlink or directory
+        cmd += "-f '+ /bin/***' "
+        cmd += "-f '+ /etc/***' "
+        cmd += "-f '+ /lib' "                                       # /lib may be a symlink or directory
+        cmd += "-f '+ /lib/***' "
+        cmd += "-f '+ /lib32' "                                     # /lib may be a symlink or directory
+        cmd += "-f '+ /lib32/***' "
+        cmd += "-f '+ /lib64' "                                     # /lib may be a symlink or directory
+        cmd += "-f '+ /lib64/***' "
+        cmd += "-f '+ /opt/***' "
+        cmd += "-f '+ /sbin' "                                      # /sbin may be a symlink or directory
+        cmd += "-f '+ /sbin/***' "
+        cmd += "-f '+ /usr/***' "
+        cmd += "-f '+ /var' "
+        cmd += "-f '+ /var/cache' "
+        cmd += "-f '+ /var/cache/edb/***' "
+        cmd += "-f '+ /var/cache/portage/***' "
+        cmd += "-f '+ /var/db' "
+        cmd += "-f '+ /var/db/pkg/***' "
+        cmd += "-f '+ /var/lib' "
+        cmd += "-f '+ /var/lib/portage/***' "
+        cmd += "-f '- /**' "
+        cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
+        FmUtil.shellExec(cmd)
 
     def syncDownDirectory(self, dirname, quiet=False):
         assert self.wSshPort is not None
         assert dirname.startswith("/")
 
         dirname = os.path.realpath(dirname)
-        stunnelCfgFile, newPort, proc = self._createStunnelProcess(self.wRsyncPort)
-        try:
-            cmd = ""
-            cmd += "/usr/bin/rsync -a -z -hhh --delete %s " % ("--quiet" if quiet else "--info=progress2")
-            for fn in self._ignoredPatternsWhenSyncDown():
-                cmd += "-f '- %s' " % (fn)
-            if True:
-                buf = "-f '+ %s/***' " % (dirname)
+        newPort = self._getTunnelPort(self.wRsyncPort)
+        cmd = ""
+        cmd += "/usr/bin/rsync -a -z -hhh --delete %s " % ("--quiet" if quiet else "--info=progress2")
+        for fn in self._ignoredPatternsWhenSyncDown():
+            cmd += "-f '- %s' " % (fn)
+        if True:
+            buf = "-f '+ %s/***' " % (dirname)
+            dirname = os.path.dirname(dirname)
+            while dirname != "/":
+                buf = "-f '+ %s' " % (dirname) + buf
                 dirname = os.path.dirname(dirname)
-                while dirname != "/":
-                    buf = "-f '+ %s' " % (dirname) + buf
-                    dirname = os.path.dirname(dirname)
-                cmd += buf
-            cmd += "-f '- /**' "
-            cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
-            FmUtil.shellExec(cmd)
-        finally:
-            proc.terminate()
-            proc.wait()
-            os.unlink(stunnelCfgFile)
+            cmd += buf
+        cmd += "-f '- /**' "
+        cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
+        FmUtil.shellExec(cmd)
 
     def syncDownWildcardList(self, wildcardList, quiet=False):
         assert self.wSshPort is not None
         assert [x.startswith("/") for x in wildcardList]
 
-        stunnelCfgFile, newPort, proc = self._createStunnelProcess(self.wRsyncPort)
-        try:
-            cmd = ""
-            cmd += "/usr/bin/rsync -a -z -hhh --delete %s " % ("--quiet" if quiet else "--info=progress2")
-            for fn in self._ignoredPatternsWhenSyncDown():
-                cmd += "-f '- %s' " % (fn)
-            for wildcard in wildcardList:
-                buf = "-f '+ %s' " % (wildcard)
-                dirname = os.path.dirname(wildcard)
-                while dirname != "/":
-                    buf = "-f '+ %s' " % (dirname) + buf
-                    dirname = os.path.dirname(dirname)
-                cmd += buf
-            cmd += "-f '- /**' "
-            cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
-            FmUtil.shellExec(cmd)
-        finally:
-            proc.terminate()
-            proc.wait()
-            os.unlink(stunnelCfgFile)
+        newPort = self._getTunnelPort(self.wRsyncPort)
+        cmd = ""
+        cmd += "/usr/bin/rsync -a -z -hhh --delete %s " % ("--quiet" if quiet else "--info=progress2")
+        for fn in self._ignoredPatternsWhenSyncDown():
+            cmd += "-f '- %s' " % (fn)
+        for wildcard in wildcardList:
+            buf = "-f '+ %s' " % (wildcard)
+            dirname = os.path.dirname(wildcard)
+            while dirname != "/":
+                buf = "-f '+ %s' " % (dirname) + buf
+                dirname = os.path.dirname(dirname)
+            cmd += buf
+        cmd += "-f '- /**' "
+        cmd += "rsync://127.0.0.1:%d/main /" % (newPort)
+        FmUtil.shellExec(cmd)
 
     def _ignoredPatternsWhenSyncUp(self):
         return [
@@ -403,37 +393,23 @@ class BuildServer:
             FmConst.myPrivKeyFile,
         ]
 
+    def _protectedPatternsWhenSyncUp(self):
+        # not sent, and not deleted on the build server
+        return [
+            os.path.join(FmConst.kcacheDir, "pristine"),        # extracted tarballs, each side keeps its own
+        ]
+
     def _ignoredPatternsWhenSyncDown(self):
-        return self._ignoredPatternsWhenSyncUp() + [
+        return self._ignoredPatternsWhenSyncUp() + self._protectedPatternsWhenSyncUp() + [
             FmConst.portageCfgMakeConf,
             FmConst.portageMirrorsFile,
             "/etc/resolv.conf",
         ]
 
-    def _createStunnelProcess(self, port):
-        stunnelCfgFile = tempfile.mktemp()
-        newPort = FmUtil.getFreeTcpPort()
-        try:
-            buf = ""
-            buf += "cert = %s\n" % (FmConst.myCertFile)
-            buf += "key = %s\n" % (FmConst.myPrivKeyFile)
-            buf += "\n"
-            buf += "client = yes\n"
-            buf += "foreground = yes\n"
-            buf += "\n"
-            buf += "[rsync]\n"
-            buf += "accept = %d\n" % (newPort)
-            buf += "connect = %s:%d\n" % (self.hostname, port)
-            with open(stunnelCfgFile, "w") as f:
-                f.write(buf)
-
-            proc = subprocess.Popen("/usr/sbin/stunnel %s 2>/dev/null" % (stunnelCfgFile), shell=True)
-            FmUtil.waitTcpService("0.0.0.0", newPort)
-
-            return (stunnelCfgFile, newPort, proc)
-        except:
-            os.unlink(stunnelCfgFile)
-            raise
+    def _getTunnelPort(self, port):
+        if port not in self.tunnelDict:
+            self.tunnelDict[port] = _TlsTunnel(self.hostname, port, FmConst.myCertFile, FmConst.myPrivKeyFile)
+        return self.tunnelDict[port].getLocalPort()
 
     def _sendRequestObj(self, requestObj):
         s = json.dumps(requestObj) + "\n"
@@ -456,3 +432,174 @@ class BuildServer:
                 raise EOFError()
             buf += buf2
         return buf
+
+
+class _TlsTunnel:
+
+    """
+    Forward connections from a local port to a TLS port of the build server.
+
+    It replaces one stunnel process per transfer: the listening socket and the certificate are set up
+    once for the lifetime of the BuildServer object, and the TLS session is resumed by every new
+    connection, so only the first connection does a full handshake.
+    """
+
+    def __init__(self, hostname, port, certFile, keyFile):
+        self.hostname = hostname
+        self.port = port
+
+        self.ctx = SSL.Context(SSL.TLSv1_2_METHOD)
+        self.ctx.use_certificate_file(certFile)
+        self.ctx.use_privatekey_file(keyFile)
+        self.session = None
+        self.lock = threading.Lock()
+
+        self.listenSock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listenSock.bind(("127.0.0.1", 0))
+        self.listenSock.listen(8)
+        self.acceptThread = threading.Thread(target=self._acceptThreadFunc, daemon=True)
+        self.acceptThread.start()
+
+    def getLocalPort(self):
+        return self.listenSock.getsockname()[1]
+
+    def dispose(self):
+        try:
+            self.listenSock.shutdown(socket.SHUT_RDWR)      # wake up accept()
+        except OSError:
+            pass
+        self.listenSock.close()
+        self.acceptThread.join()
+
+    def _acceptThreadFunc(self):
+        while True:
+            try:
+                localSock, addr = self.listenSock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._forwardThreadFunc, args=(localSock,), daemon=True).start()
+
+    def _forwardThreadFunc(self, localSock):
+        remoteSock = None
+        try:
+            remoteSock = socket.create_connection((self.hostname, self.port))
+            conn = self._handshake(remoteSock)
+            self._forward(localSock, remoteSock, conn)
+        except (OSError, EOFError, SSL.Error):
+            pass
+        finally:
+            if remoteSock is not None:
+                remoteSock.close()
+            localSock.close()
+
+    def _handshake(self, remoteSock):
+        # the TLS connection uses memory BIO, socket I/O is done by ourselves
+        conn = SSL.Connection(self.ctx, None)
+        conn.set_connect_state()
+        with self.lock:
+            if self.session is not None:
+                conn.set_session(self.session)
+
+        while True:
+            try:
+                conn.do_handshake()
+                break
+            except SSL.WantReadError:
+                remoteSock.sendall(self._bioReadAll(conn))
+                buf = remoteSock.recv(65536)
+                if len(buf) == 0:
+                    raise EOFError()
+                conn.bio_write(buf)
+        remoteSock.sendall(self._bioReadAll(conn))
+
+        with self.lock:
+            self.session = conn.get_session()
+        return conn
+
+    def _forward(self, localSock, remoteSock, conn):
+        localSock.setblocking(False)
+        remoteSock.setblocking(False)
+
+        # the last handshake flight may be followed by application data in the same recv(), such as the
+        # greeting of a server that speaks first, it is already in the memory BIO and must be drained now
+        toRemote = b''
+        toLocal, remoteEof = self._decryptAll(conn)
+        localEof = False
+        localShut = False
+        remoteShut = False
+        while True:
+            rlist = []
+            wlist = []
+            if not localEof and len(toRemote) < 1024 * 1024:
+                rlist.append(localSock)
+            if not remoteEof and len(toLocal) < 1024 * 1024:
+                rlist.append(remoteSock)
+            if len(toRemote) > 0:
+                wlist.append(remoteSock)
+            if len(toLocal) > 0:
+                wlist.append(localSock)
+            if len(rlist) == 0 and len(wlist) == 0:
+                break
+
+            rlist, wlist, _ = select.select(rlist, wlist, [])
+
+            if localSock in rlist:
+                buf = localSock.recv(65536)
+                if len(buf) > 0:
+                    conn.sendall(buf)
+                else:
+                    localEof = True
+                    conn.shutdown()
+                toRemote += self._bioReadAll(conn)
+
+            if remoteSock in rlist:
+                buf = remoteSock.recv(65536)
+                if len(buf) > 0:
+                    conn.bio_write(buf)
+                    buf, remoteEof = self._decryptAll(conn)
+                    toLocal += buf
+                else:
+                    remoteEof = True
+                toRemote += self._bioReadAll(conn)
+
+            if remoteSock in wlist:
+                try:
+                    toRemote = toRemote[remoteSock.send(toRemote):]
+                except BlockingIOError:
+                    pass
+
+            if localSock in wlist:
+                try:
+                    toLocal = toLocal[localSock.send(toLocal):]
+                except BlockingIOError:
+                    pass
+
+            # pass half-close to the other side after all the data is sent
+            if localEof and len(toRemote) == 0 and not remoteShut:
+                remoteSock.shutdown(socket.SHUT_WR)
+                remoteShut = True
+            if remoteEof and len(toLocal) == 0 and not localShut:
+                localSock.shutdown(socket.SHUT_WR)
+                localShut = True
+            if localShut and remoteShut:
+                break
+
+    def _decryptAll(self, conn):
+        # returns (data, bEof), decrypts all the data in the memory BIO
+        ret = b''
+        while True:
+            try:
+                ret += conn.recv(65536)
+            except SSL.WantReadError:
+                return (ret, False)
+            except SSL.ZeroReturnError:
+                return (ret, True)
+
+    def _bioReadAll(self, conn):
+        ret = b''
+        while True:
+            try:
+                ret += conn.bio_read(65536)
+            except SSL.WantReadError:
+                break
+        return ret
@@ -0,0 +1,369 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import sys
+import json
+import time
+import socket
+import threading
+from fm_util import ResourceUsage
+
+
+class CheckEngine:
+
+    """
+    Run checks with declared dependencies, independent checks are run concurrently.
+
+    A check that mutates the system when auto-fix is enabled is run exclusively: it starts after all
+    the checks added before it have finished, and no other check is started until it finishes.
+    Without auto-fix all the checks are read-only.
+
+    Checks print through CheckEngine.printer, which has the same interface as InfoPrinter. The output
+    of each check is recorded, and replayed through the real InfoPrinter in the order the checks are
+    added, so the text output is the same as running the checks one by one. The output of the first
+    unfinished check goes to the terminal directly.
+
+    When a check fails, no more check is started, the exception of the failed check is re-raised
+    after all the running checks finish. A check that waits for a long time, such as the disk
+    self-tests, can be given a cancelFunc, which is called from the engine thread when another check
+    fails or when the engine is interrupted, so that the check returns early.
+
+    For each check the wall time, the thread cpu time and the number of subprocesses it has started
+    are recorded in a ResourceUsage object, work done by ContextThreadPoolExecutor pools on behalf of
+    the check is included. Cpu time of the subprocesses is not included, the subprocesses of
+    concurrent checks can't be told apart by getrusage(). The results can be written as a JSON or
+    NDJSON report by writeReport().
+    """
+
+    def __init__(self, infoPrinter, maxWorkers=8):
+        self.infoPrinter = infoPrinter
+        self.printer = _CheckPrinter(infoPrinter)
+        self.maxWorkers = maxWorkers                # most checks wait for disk or subprocess, not cpu
+
+        self._itemList = []             # list<("begin", title) or ("end", None) or ("check", CheckResult)>
+        self._checkDict = dict()
+        self._bAutoFix = None
+
+    def beginGroup(self, title):
+        self._itemList.append(("begin", title))
+
+    def endGroup(self):
+        self._itemList.append(("end", None))
+
+    def addCheck(self, name, func, depends=[], bMutating=False, cancelFunc=None):
+        """depends must refer to checks already added, cancelFunc must be thread safe"""
+
+        assert name not in self._checkDict
+        assert all(x in self._checkDict for x in depends)
+
+        check = CheckResult()
+        check.name = name
+        check.func = func
+        check.depends = list(depends)
+        check.bMutating = bMutating
+        check.cancelFunc = cancelFunc
+        self._itemList.append(("check", check))
+        self._checkDict[name] = check
+
+    def getResultList(self):
+        return [x[1] for x in self._itemList if x[0] == "check"]
+
+    def run(self, bAutoFix):
+        _installAuditHook()
+        self._bAutoFix = bAutoFix
+
+        cond = threading.Condition()
+        checkList = self.getResultList()
+        pendingList = list(checkList)
+        runningList = []
+        finishedList = []
+        failedCheck = None
+        bCancelled = False
+        itemPos = 0
+        baseIndent = self.infoPrinter.indent
+
+        def _worker(check):
+            self.printer._local.output = check.output
+            usage = ResourceUsage()
+            ResourceUsage.current.set(usage)            # each thread starts with an empty context
+            t = time.time()
+            t2 = time.thread_time()
+            try:
+                check.func()
+            except BaseException as e:
+                check.error = e
+            usage.addThreadCpuTime(time.thread_time() - t2)
+            check.threadCpuTime = usage.threadCpuTime
+            check.subprocessCount = usage.subprocessCount
+            check.duration = time.time() - t
+            with cond:
+                finishedList.append(check)
+                cond.notify()
+
+        try:
+            while True:
+                # replay output in order, stop at the first unfinished check
+                while itemPos < len(self._itemList) and failedCheck is None:
+                    itemType, item = self._itemList[itemPos]
+                    if itemType == "begin":
+                        self.infoPrinter.printInfo(item)
+                        self.infoPrinter.incIndent()
+                    elif itemType == "end":
+                        self.infoPrinter.decIndent()
+                    else:
+                        if item.output is None:
+                            break
+                        item.output.goLive(self.infoPrinter)
+                        if item.duration is None:
+                            break
+                        if item.error is not None:
+                            failedCheck = item
+                    itemPos += 1
+
+                with cond:
+                    # start ready checks
+                    if failedCheck is None and not bCancelled:
+                        for check in list(pendingList):
+                            if bAutoFix and check.bMutating:
+                                if len(runningList) > 0:
+                                    break
+                                if any(x.duration is None for x in checkList[:checkList.index(check)]):
+                                    break
+                            else:
+                                if len(runningList) >= self.maxWorkers:
+                                    break
+                                if any(bAutoFix and x.bMutating for x in runningList):
+                                    break
+                            if not all(self._checkDict[x].duration is not None and self._checkDict[x].error is None for x in check.depends):
+                                continue
+                            pendingList.remove(check)
+                            runningList.append(check)
+                            check.output = _CheckOutput()
+                            threading.Thread(target=_worker, args=(check,)).start()
+                            if bAutoFix and check.bMutating:
+                                break
+
+                    if len(runningList) == 0 and len(finishedList) == 0:
+                        break
+                    while len(finishedList) == 0:
+                        cond.wait()
+                    for check in finishedList:
+                        runningList.remove(check)
+                        if check.error is not None:
+                            bCancelled = True
+                    finishedList.clear()
+                    cancelList = list(runningList) if bCancelled else []
+
+                # cancel the running checks out of the lock, cancelFunc may take a while
+                for check in cancelList:
+                    self._cancelCheck(check)
+        except BaseException:
+            for check in runningList:
+                self._cancelCheck(check)
+            raise
+        finally:
+            self.infoPrinter.indent = baseIndent
+
+        if failedCheck is None:
+            # a check failed but its output is not reached by replay
+            for check in checkList:
+                if check.error is not None:
+                    failedCheck = check
+                    break
+        if failedCheck is not None:
+            raise failedCheck.error
+        assert len(pendingList) == 0
+
+    def _cancelCheck(self, check):
+        if check.cancelFunc is not None and not check.bCancelled:
+            check.bCancelled = True
+            check.cancelFunc()
+
+    def writeReport(self, filename, reportFormat="json"):
+        """reportFormat is "json" or "ndjson", checks that are not run are also reported"""
+
+        assert reportFormat in ["json", "ndjson"]
+
+        header = {
+            "hostname": socket.gethostname(),
+            "time": time.time(),
+            "auto_fix": self._bAutoFix,
+        }
+        checkList = []
+        for check in self.getResultList():
+            if check.duration is None:
+                status = "not-run"
+            elif check.error is not None:
+                status = "failed"
+            else:
+                status = "ok"
+            findingList = check.getFindingList()
+            checkList.append({
+                "check": check.name,
+                "status": status,
+                "error": str(check.error) if check.error is not None else None,
+                "mutating": check.bMutating,
+                "wall_time": check.duration,
+                "thread_cpu_time": check.threadCpuTime,
+                "subprocess_count": check.subprocessCount,
+                "finding_count": len(findingList),
+                "findings": findingList,
+            })
+
+        with open(filename, "w") as f:
+            if reportFormat == "json":
+                header["checks"] = checkList
+                json.dump(header, f, indent=4)
+                f.write("\n")
+            else:
+                f.write(json.dumps(dict(type="report", **header)) + "\n")
+                for item in checkList:
+                    findingList = item.pop("findings")
+                    f.write(json.dumps(dict(type="check", **item)) + "\n")
+                    for finding in findingList:
+                        f.write(json.dumps(dict(type="finding", **finding)) + "\n")
+
+
+class CheckResult:
+
+    def __init__(self):
+        self.name = None
+        self.func = None
+        self.depends = None
+        self.bMutating = None
+        self.cancelFunc = None
+        self.bCancelled = False
+        self.output = None
+        self.duration = None
+        self.threadCpuTime = None
+        self.subprocessCount = None
+        self.error = None
+
+    def getFindingList(self):
+        """Returns list<dict>, severity is "error" for now"""
+
+        if self.output is None:
+            return []
+        ret = []
+        for entryType, indent, message, detail in self.output.entryList:
+            if entryType == "error":
+                ret.append({
+                    "check": self.name,
+                    "severity": "error",
+                    "message": message,
+                    "path": detail[0],
+                    "package": detail[1],
+                    "auto_fixable": detail[2],
+                })
+        return ret
+
+
+class _CheckOutput:
+
+    def __init__(self):
+        self.entryList = []             # list<(type, indent, message, (path, pkg, bAutoFixable))>
+        self.indent = 0
+        self._lock = threading.Lock()
+        self._live = None
+        self._liveIndent = None
+        self._pbeBuf = None
+
+    def goLive(self, infoPrinter):
+        with self._lock:
+            if self._live is None:
+                self._live = infoPrinter
+                self._liveIndent = infoPrinter.indent
+                for entry in self.entryList:
+                    self._replay(entry)
+
+    def printInfo(self, s):
+        self._add(("info", self.indent, s, None))
+
+    def printError(self, s, path=None, pkg=None, bAutoFixable=False):
+        self._add(("error", self.indent, s, (path, pkg, bAutoFixable)))
+
+    def incIndent(self):
+        self.indent += 1
+
+    def decIndent(self):
+        assert self.indent > 0
+        self.indent -= 1
+
+    def startPrintByError(self):
+        self._pbeBuf = []
+        self._pbeIndent = self.indent
+
+    def endPrintByError(self):
+        assert self.indent == self._pbeIndent
+
+        buf = self._pbeBuf
+        self._pbeBuf = None
+        if any(x[0] == "error" for x in buf):
+            for entry in buf:
+                self._add(entry)
+
+    def _add(self, entry):
+        if self._pbeBuf is not None:
+            self._pbeBuf.append(entry)
+            return
+        with self._lock:
+            self.entryList.append(entry)
+            if self._live is not None:
+                self._replay(entry)
+
+    def _replay(self, entry):
+        self._live.indent = self._liveIndent + entry[1]
+        if entry[0] == "error":
+            self._live.printError(entry[2])
+        else:
+            self._live.printInfo(entry[2])
+        self._live.indent = self._liveIndent
+
+
+class _CheckPrinter:
+
+    """Forwards to the _CheckOutput of the check running in the current thread"""
+
+    def __init__(self, infoPrinter):
+        self._infoPrinter = infoPrinter
+        self._local = threading.local()
+
+    def _get(self):
+        return getattr(self._local, "output", self._infoPrinter)
+
+    def printInfo(self, s):
+        self._get().printInfo(s)
+
+    def printError(self, s, path=None, pkg=None, bAutoFixable=False):
+        self._get().printError(s, path=path, pkg=pkg, bAutoFixable=bAutoFixable)
+
+    def incIndent(self):
+        self._get().incIndent()
+
+    def decIndent(self):
+        self._get().decIndent()
+
+    def startPrintByError(self):
+        self._get().startPrintByError()
+
+    def endPrintByError(self):
+        self._get().endPrintByError()
+
+
+_bAuditHookInstalled = False
+
+
+def _installAuditHook():
+    # audit hooks can not be removed, so it is installed only once
+    global _bAuditHookInstalled
+    if not _bAuditHookInstalled:
+        sys.addaudithook(_auditHook)
+        _bAuditHookInstalled = True
+
+
+def _auditHook(event, args):
+    # subprocess.Popen may also raise "os.posix_spawn" or "os.fork", so they are not counted
+    if event in ["subprocess.Popen", "os.system"]:
+        usage = ResourceUsage.current.get()
+        if usage is not None:
+            usage.addSubprocess()
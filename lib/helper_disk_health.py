@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import re
+import threading
+from fm_util import FmUtil
+from fm_util import ContextThreadPoolExecutor
+
+
+class DiskHealthChecker:
+
+    """
+    Check disk health by smartctl, all the disks are queried concurrently.
+
+    Long self-tests are started on all the disks at once by startSelfTests(), which returns without
+    waiting for them. The caller can do other things while the disks test themselves, then call
+    waitSelfTests() to poll the progress until all the tests end. Tests still running when the caller
+    gives up should be aborted by abortSelfTests(), which can be called from any thread and also makes
+    a running waitSelfTests() return at once.
+
+    The smartctl program and the poll interval are parameters, so that a fake smartctl can be used
+    for testing.
+    """
+
+    def __init__(self, smartctl="/usr/sbin/smartctl", pollInterval=5 * 60, maxWorkers=8):
+        self._smartctl = smartctl
+        self._pollInterval = pollInterval
+        self._maxWorkers = maxWorkers
+        self._lock = threading.Lock()
+        self._abortEvent = threading.Event()
+        self._testList = []
+
+    def checkHealth(self, hddList):
+        """Returns list<bool> in the order of hddList, False means the disk reports a failure"""
+
+        return self._map(self._checkHealth, hddList)
+
+    def startSelfTests(self, hddList):
+        """Returns list<DiskSelfTest> in the order of hddList"""
+
+        testList = self._map(self._startSelfTest, hddList)
+        with self._lock:
+            self._testList += testList
+        return testList
+
+    def hasRunningSelfTest(self):
+        with self._lock:
+            return any(x.status == "running" for x in self._testList)
+
+    def pollSelfTests(self):
+        """Query the progress of all the running self-tests, returns the tests that have ended in this poll"""
+
+        with self._lock:
+            runList = [x for x in self._testList if x.status == "running"]
+        self._map(self._pollSelfTest, runList)
+        return [x for x in runList if x.status != "running"]
+
+    def waitSelfTests(self, endCallback=None, progressCallback=None):
+        """endCallback(test) is called when a test ends, progressCallback(progress) is called when the minimum
+           progress of the running tests increases"""
+
+        lastProgress = 0
+        while self.hasRunningSelfTest():
+            if self._abortEvent.wait(self._pollInterval):
+                break
+            for test in self.pollSelfTests():
+                if endCallback is not None:
+                    endCallback(test)
+            with self._lock:
+                progressList = [x.progress for x in self._testList if x.status == "running"]
+            if len(progressList) > 0 and min(progressList) > lastProgress:
+                lastProgress = min(progressList)
+                if progressCallback is not None:
+                    progressCallback(lastProgress)
+
+    def abortSelfTests(self):
+        self._abortEvent.set()
+        with self._lock:
+            runList = [x for x in self._testList if x.status == "running"]
+            for test in runList:
+                test.status = "aborted"
+        self._map(self._abortSelfTest, runList)
+
+    def _checkHealth(self, hdd):
+        rc, out = FmUtil.cmdCallWithRetCode(self._smartctl, "-H", hdd)
+        return re.search("failure", out, re.I) is None
+
+    def _startSelfTest(self, hdd):
+        test = DiskSelfTest(hdd)
+        rc, out = FmUtil.cmdCallWithRetCode(self._smartctl, "-t", "long", hdd)
+        if rc == 0:
+            m = re.search("Please wait ([0-9]+) minutes for test to complete\\.", out, re.M)
+            if m is not None:
+                test.status = "running"
+                test.minutes = int(m.group(1))
+        elif rc == 4:
+            test.status = "running"
+            test.bAlreadyRunning = True
+        if test.status != "running":
+            FmUtil.cmdCallIgnoreResult(self._smartctl, "-X", hdd)
+        return test
+
+    def _pollSelfTest(self, test):
+        rc, out = FmUtil.cmdCallWithRetCode(self._smartctl, "-l", "selftest", test.hdd)
+        if re.search("# 1\\s+Extended offline\\s+Completed without error\\s+.*", out, re.M) is not None:
+            status, progress = "passed", 100
+        else:
+            m = re.search("# 1\\s+Extended offline\\s+Self-test routine in progress\\s+([0-9]+)%.*", out, re.M)
+            if m is None:
+                status, progress = "failed", test.progress
+            else:
+                status, progress = "running", 100 - int(m.group(1))
+        with self._lock:
+            if test.status == "running":            # the test may be aborted during the poll
+                test.status = status
+                test.progress = progress
+
+    def _abortSelfTest(self, test):
+        FmUtil.cmdCallIgnoreResult(self._smartctl, "-X", test.hdd)
+
+    def _map(self, func, itemList):
+        if len(itemList) == 0:
+            return []
+        with ContextThreadPoolExecutor(max_workers=self._maxWorkers) as pool:
+            return list(pool.map(func, itemList))
+
+
+class DiskSelfTest:
+
+    def __init__(self, hdd):
+        self.hdd = hdd
+        self.status = "start-failed"        # "start-failed", "running", "passed", "failed", "aborted"
+        self.minutes = None                 # estimated time given by the disk, None if unknown
+        self.bAlreadyRunning = False
+        self.progress = 0                   # percentage
@@ -3,8 +3,10 @@
 
 import re
 import requests
+import concurrent.futures
 from fm_util import FmUtil
 from fm_util import AvahiServiceBrowser
+from fm_util import MakeConf
 from fm_param import FmConst
 
 
@@ -25,8 +27,15 @@ class DynCfgModifier:
 
             browser = AvahiServiceBrowser("_mirrors._tcp")
             browser.run()
-            for name, addr, port in browser.get_result_list():
-                for key, value in requests.get("http://%s:%d/api/mirrors" % (addr, port)).json().items():
+            resultList = browser.get_result_list()
+
+            # query all the mirror servers concurrently, unreachable servers are ignored
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(resultList))) as pool:
+                futureList = [pool.submit(self._getLocalMirrorDict, addr, port) for name, addr, port in resultList]
+                mirrorDictList = [x.result() for x in futureList]
+
+            for (name, addr, port), mirrorDict in zip(resultList, mirrorDictList):
+                for key, value in mirrorDict.items():
                     if not value.get("available", False):
                         continue
 
@@ -94,21 +103,21 @@ class DynCfgModifier:
             archMirrors = FmUtil.pmdbGetMirrors("archlinux", "archlinux", countryCode, ["http", "https", "ftp"], 2)
 
         # write to make.conf
-        if True:
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "LOCAL_GENTOO_MIRRORS", localGentooMirror)
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "LOCAL_RSYNC_MIRRORS", localRsyncMirror)
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "LOCAL_KERNEL_MIRRORS", localKernelMirror)
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "LOCAL_ARCHLINUX_MIRRORS", localArchMirror)
-
-            FmUtil.updateMakeConfVarAsValueSet(FmConst.portageCfgMakeConf, "REGIONAL_GENTOO_MIRRORS", gentooMirrors)
-            FmUtil.updateMakeConfVarAsValueSet(FmConst.portageCfgMakeConf, "REGIONAL_RSYNC_MIRRORS", rsyncMirrors)
-            FmUtil.updateMakeConfVarAsValueSet(FmConst.portageCfgMakeConf, "REGIONAL_KERNEL_MIRRORS", kernelMirrors)
-            FmUtil.updateMakeConfVarAsValueSet(FmConst.portageCfgMakeConf, "REGIONAL_ARCHLINUX_MIRRORS", archMirrors)
-
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "GENTOO_MIRRORS", "${LOCAL_GENTOO_MIRRORS} ${REGIONAL_GENTOO_MIRRORS} ${GENTOO_DEFAULT_MIRROR}")
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "RSYNC_MIRRORS", "${LOCAL_RSYNC_MIRRORS} ${REGIONAL_RSYNC_MIRRORS} ${RSYNC_DEFAULT_MIRROR}")
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "KERNEL_MIRRORS", "${LOCAL_KERNEL_MIRRORS} ${REGIONAL_KERNEL_MIRRORS} ${KERNEL_DEFAULT_MIRROR}")
-            FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "ARCHLINUX_MIRRORS", "${LOCAL_ARCHLINUX_MIRRORS} ${REGIONAL_ARCHLINUX_MIRRORS}")
+        with MakeConf(FmConst.portageCfgMakeConf) as makeConf:
+            makeConf.set("LOCAL_GENTOO_MIRRORS", localGentooMirror)
+            makeConf.set("LOCAL_RSYNC_MIRRORS", localRsyncMirror)
+            makeConf.set("LOCAL_KERNEL_MIRRORS", localKernelMirror)
+            makeConf.set("LOCAL_ARCHLINUX_MIRRORS", localArchMirror)
+
+            makeConf.setAsValueSet("REGIONAL_GENTOO_MIRRORS", gentooMirrors)
+            makeConf.setAsValueSet("REGIONAL_RSYNC_MIRRORS", rsyncMirrors)
+            makeConf.setAsValueSet("REGIONAL_KERNEL_MIRRORS", kernelMirrors)
+            makeConf.setAsValueSet("REGIONAL_ARCHLINUX_MIRRORS", archMirrors)
+
+            makeConf.set("GENTOO_MIRRORS", "${LOCAL_GENTOO_MIRRORS} ${REGIONAL_GENTOO_MIRRORS} ${GENTOO_DEFAULT_MIRROR}")
+            makeConf.set("RSYNC_MIRRORS", "${LOCAL_RSYNC_MIRRORS} ${REGIONAL_RSYNC_MIRRORS} ${RSYNC_DEFAULT_MIRROR}")
+            makeConf.set("KERNEL_MIRRORS", "${LOCAL_KERNEL_MIRRORS} ${REGIONAL_KERNEL_MIRRORS} ${KERNEL_DEFAULT_MIRROR}")
+            makeConf.set("ARCHLINUX_MIRRORS", "${LOCAL_ARCHLINUX_MIRRORS} ${REGIONAL_ARCHLINUX_MIRRORS}")
 
         # write to /etc/portage/mirrors
         if len(localPortageMirrorDict) > 0:
@@ -118,11 +127,20 @@ class DynCfgModifier:
         else:
             FmUtil.forceDelete(FmConst.portageMirrorsFile)
 
+    def _getLocalMirrorDict(self, addr, port):
+        try:
+            resp = requests.get("http://%s:%d/api/mirrors" % (addr, port), timeout=FmUtil.urlopenTimeout())
+            resp.raise_for_status()
+            return resp.json()
+        except (requests.RequestException, ValueError):
+            return dict()
+
     def updateDownloadCommand(self):
         fetchCmd = "/usr/bin/wget " + FmUtil.wgetCommonDownloadParam() + " -O \\\"\\${DISTDIR}/\\${FILE}\\\" \\\"\\${URI}\\\""
         resumeCmd = "/usr/bin/wget -c " + FmUtil.wgetCommonDownloadParam() + " -O \\\"\\${DISTDIR}/\\${FILE}\\\" \\\"\\${URI}\\\""
-        FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "FETCHCOMMAND", fetchCmd)
-        FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "RESUMECOMMAND", resumeCmd)
+        with MakeConf(FmConst.portageCfgMakeConf) as makeConf:
+            makeConf.set("FETCHCOMMAND", fetchCmd)
+            makeConf.set("RESUMECOMMAND", resumeCmd)
 
     def updateParallelism(self, hwInfo):
         # gather system information
@@ -146,61 +164,62 @@ class DynCfgModifier:
                 jobcountEmerge = cpuNum
                 loadavg = max(1, cpuNum - 1)
 
-        # check/fix MAKEOPTS variable
-        # for bug 559064 and 592660, we need to add -j and -l, it sucks
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS")
-        if True:
-            m = re.search("\\B--jobs(=([0-9]+))?\\b", value)
-            if m is None:
-                value += " --jobs=%d" % (jobcountMake)
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-            elif m.group(2) is None or int(m.group(2)) != jobcountMake:
-                value = value.replace(m.group(0), "--jobs=%d" % (jobcountMake))
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS")
-        if True:
-            m = re.search("\\B--load-average(=([0-9\\.]+))?\\b", value)
-            if m is None:
-                value += " --load-average=%d" % (loadavg)
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-            elif m.group(2) is None or int(m.group(2)) != loadavg:
-                value = value.replace(m.group(0), "--load-average=%d" % (loadavg))
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS")
-        if True:
-            m = re.search("\\B-j([0-9]+)?\\b", value)
-            if m is None:
-                value += " -j%d" % (jobcountMake)
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-            elif m.group(1) is None or int(m.group(1)) != jobcountMake:
-                value = value.replace(m.group(0), "-j%d" % (jobcountMake))
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS")
-        if True:
-            m = re.search("\\B-l([0-9]+)?\\b", value)
-            if m is None:
-                value += " -l%d" % (loadavg)
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-            elif m.group(1) is None or int(m.group(1)) != loadavg:
-                value = value.replace(m.group(0), "-l%d" % (loadavg))
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "MAKEOPTS", value.lstrip())
-
-        # check/fix EMERGE_DEFAULT_OPTS variable
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS")
-        if True:
-            m = re.search("\\B--jobs(=([0-9]+))?\\b", value)
-            if m is None:
-                value += " --jobs=%d" % (jobcountEmerge)
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS", value.lstrip())
-            elif m.group(2) is None or int(m.group(2)) != jobcountEmerge:
-                value = value.replace(m.group(0), "--jobs=%d" % (jobcountEmerge))
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS", value.lstrip())
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS")
-        if True:
-            m = re.search("\\B--load-average(=([0-9\\.]+))?\\b", value)
-            if m is None:
-                value += " --load-average=%d" % (loadavg)
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS", value.lstrip())
-            elif m.group(2) is None or int(m.group(2)) != loadavg:
-                value = value.replace(m.group(0), "--load-average=%d" % (loadavg))
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS", value.lstrip())
+        with MakeConf(FmConst.portageCfgMakeConf) as makeConf:
+            # check/fix MAKEOPTS variable
+            # for bug 559064 and 592660, we need to add -j and -l, it sucks
+            value = makeConf.get("MAKEOPTS")
+            if True:
+                m = re.search("\\B--jobs(=([0-9]+))?\\b", value)
+                if m is None:
+                    value += " --jobs=%d" % (jobcountMake)
+                    makeConf.set("MAKEOPTS", value.lstrip())
+                elif m.group(2) is None or int(m.group(2)) != jobcountMake:
+                    value = value.replace(m.group(0), "--jobs=%d" % (jobcountMake))
+                    makeConf.set("MAKEOPTS", value.lstrip())
+            value = makeConf.get("MAKEOPTS")
+            if True:
+                m = re.search("\\B--load-average(=([0-9\\.]+))?\\b", value)
+                if m is None:
+                    value += " --load-average=%d" % (loadavg)
+                    makeConf.set("MAKEOPTS", value.lstrip())
+                elif m.group(2) is None or int(m.group(2)) != loadavg:
+                    value = value.replace(m.group(0), "--load-average=%d" % (loadavg))
+                    makeConf.set("MAKEOPTS", value.lstrip())
+            value = makeConf.get("MAKEOPTS")
+            if True:
+                m = re.search("\\B-j([0-9]+)?\\b", value)
+                if m is None:
+                    value += " -j%d" % (jobcountMake)
+                    makeConf.set("MAKEOPTS", value.lstrip())
+                elif m.group(1) is None or int(m.group(1)) != jobcountMake:
+                    value = value.replace(m.group(0), "-j%d" % (jobcountMake))
+                    makeConf.set("MAKEOPTS", value.lstrip())
+            value = makeConf.get("MAKEOPTS")
+            if True:
+                m = re.search("\\B-l([0-9]+)?\\b", value)
+                if m is None:
+                    value += " -l%d" % (loadavg)
+                    makeConf.set("MAKEOPTS", value.lstrip())
+                elif m.group(1) is None or int(m.group(1)) != loadavg:
+                    value = value.replace(m.group(0), "-l%d" % (loadavg))
+                    makeConf.set("MAKEOPTS", value.lstrip())
+
+            # check/fix EMERGE_DEFAULT_OPTS variable
+            value = makeConf.get("EMERGE_DEFAULT_OPTS")
+            if True:
+                m = re.search("\\B--jobs(=([0-9]+))?\\b", value)
+                if m is None:
+                    value += " --jobs=%d" % (jobcountEmerge)
+                    makeConf.set("EMERGE_DEFAULT_OPTS", value.lstrip())
+                elif m.group(2) is None or int(m.group(2)) != jobcountEmerge:
+                    value = value.replace(m.group(0), "--jobs=%d" % (jobcountEmerge))
+                    makeConf.set("EMERGE_DEFAULT_OPTS", value.lstrip())
+            value = makeConf.get("EMERGE_DEFAULT_OPTS")
+            if True:
+                m = re.search("\\B--load-average(=([0-9\\.]+))?\\b", value)
+                if m is None:
+                    value += " --load-average=%d" % (loadavg)
+                    makeConf.set("EMERGE_DEFAULT_OPTS", value.lstrip())
+                elif m.group(2) is None or int(m.group(2)) != loadavg:
+                    value = value.replace(m.group(0), "--load-average=%d" % (loadavg))
+                    makeConf.set("EMERGE_DEFAULT_OPTS", value.lstrip())
@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import json
+import hashlib
+from fm_util import FmUtil
+from fm_util import FileHasher
+from fm_param import FmConst
+
+
+class InputDigestCache:
+
+    """
+    Cache of data generated from a set of input files, such as the file list generated by
+    update-mime-database from /usr/share/mime/packages/*.xml.
+
+    The data is keyed by the digests of the input files, so it is generated again only when an input
+    file is added, removed or changed. Input files are hashed by FileHasher with a digest cache, so
+    input files that have not changed are not read either.
+
+    There's one cache file in FmConst.cacheDir for each name, the data must be JSON serializable.
+    """
+
+    def __init__(self, name, cacheDir=None):
+        if cacheDir is None:
+            cacheDir = FmConst.cacheDir
+        self._cacheFile = os.path.join(cacheDir, "generated-%s.cache" % (name))
+        self._digestCacheFile = os.path.join(cacheDir, "generated-%s-digest.cache" % (name))
+
+    def get(self, inputFileList, generateFunc, extraKey=None):
+        """Returns the data generated by generateFunc(), generateFunc() is called only when the digests of inputFileList
+           or extraKey have changed. extraKey must be JSON serializable."""
+
+        key = self._getKey(inputFileList, extraKey)
+        cache = FmUtil.cacheLoad(self._cacheFile)
+        if isinstance(cache, dict) and cache.get("key") == key:
+            return cache["data"]
+
+        data = generateFunc()
+        FmUtil.cacheSave(self._cacheFile, {"key": key, "data": data})
+        return data
+
+    def _getKey(self, inputFileList, extraKey):
+        inputFileList = sorted(set(inputFileList))
+        hasher = FileHasher("sha1", cacheFile=self._digestCacheFile)
+        digestList = hasher.hashFileList(inputFileList)
+        if hasher.getStatistics()[1] < len(inputFileList):
+            hasher.saveCache(bPrune=True)
+        buf = json.dumps([list(zip(inputFileList, digestList)), extraKey])
+        return hashlib.sha1(buf.encode("utf-8")).hexdigest()
@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+from fm_util import FmUtil
+from fm_util import ContextThreadPoolExecutor
+from fm_param import FmConst
+
+
+class KmodInfoIndex:
+
+    """
+    Index of the modinfo of all the kernel module files in /lib/modules/<version>.
+
+    Module information is read from the .modinfo section by FmUtil.kmodReadModinfo(), modules are
+    read by a thread pool. Only "firmware", "alias", "depends" and "softdep" are recorded.
+
+    The index is stored in FmConst.cacheDir, one file per kernel version.
+    Module files whose mtime and size have not changed since the last refresh are not read again.
+    """
+
+    keyList = ["firmware", "alias", "depends", "softdep"]
+
+    moduleSuffixList = [".ko", ".ko.xz", ".ko.gz", ".ko.zst"]
+
+    def __init__(self, kernelModuleDir, cacheFile=None, maxWorkers=None):
+        self._kernelModuleDir = kernelModuleDir
+        if cacheFile is not None:
+            self._cacheFile = cacheFile
+        else:
+            self._cacheFile = self.getCacheFile(os.path.basename(kernelModuleDir))
+        self._maxWorkers = maxWorkers
+
+        self._modDict = dict()          # relative-path -> [mtime, size, dict<key, list<value>>]
+        self._firmwareDict = None
+        self._bDirty = False
+
+        self.refresh()
+
+    @staticmethod
+    def getCacheFile(kernelVersion):
+        return os.path.join(FmConst.cacheDir, "kmod-info-%s.cache" % (kernelVersion))
+
+    def refresh(self):
+        oldModDict = FmUtil.cacheLoad(self._cacheFile)
+        if not isinstance(oldModDict, dict):
+            oldModDict = dict()
+        if len(self._modDict) > 0:
+            oldModDict = self._modDict
+
+        self._modDict = dict()
+        self._firmwareDict = None
+        todoDict = dict()
+        for root, dirs, files in os.walk(self._kernelModuleDir):
+            relRoot = os.path.relpath(root, self._kernelModuleDir)         # os.path.relpath() is slow, call it once for each directory
+            for fn in files:
+                if not any(fn.endswith(x) for x in self.moduleSuffixList):
+                    continue
+                fullfn = os.path.join(root, fn)
+                relfn = fn if relRoot == "." else os.path.join(relRoot, fn)
+                s = os.stat(fullfn)
+                if relfn in oldModDict and oldModDict[relfn][:2] == [s.st_mtime_ns, s.st_size]:
+                    self._modDict[relfn] = oldModDict[relfn]
+                else:
+                    todoDict[relfn] = [s.st_mtime_ns, s.st_size]
+
+        if len(todoDict) > 0:
+            with ContextThreadPoolExecutor(max_workers=self._maxWorkers) as pool:
+                futureDict = {relfn: pool.submit(self._readModinfo, os.path.join(self._kernelModuleDir, relfn)) for relfn in todoDict}
+                for relfn, future in futureDict.items():
+                    self._modDict[relfn] = todoDict[relfn] + [future.result()]
+            self._bDirty = True
+        if len(self._modDict) != len(oldModDict):
+            self._bDirty = True
+
+    def save(self):
+        if self._bDirty:
+            FmUtil.cacheSave(self._cacheFile, self._modDict)
+            self._bDirty = False
+
+    def getModuleList(self):
+        """Returns list<full-path>"""
+
+        return [os.path.join(self._kernelModuleDir, x) for x in sorted(self._modDict.keys())]
+
+    def getModuleInfo(self, modulePath):
+        """Returns dict<key, list<value>>"""
+
+        return self._modDict[os.path.relpath(modulePath, self._kernelModuleDir)][2]
+
+    def getFirmwareList(self, modulePath):
+        return self.getModuleInfo(modulePath).get("firmware", [])
+
+    def getFirmwareDict(self):
+        """Returns dict<firmware-name, list<full-path>>, which is the firmware requirement manifest of the kernel.
+           Modules are in the same order as getModuleList()."""
+
+        if self._firmwareDict is None:
+            self._firmwareDict = dict()
+            for relfn in sorted(self._modDict.keys()):
+                for firmwareName in self._modDict[relfn][2].get("firmware", []):
+                    self._firmwareDict.setdefault(firmwareName, []).append(os.path.join(self._kernelModuleDir, relfn))
+        return self._firmwareDict
+
+    def _readModinfo(self, fullfn):
+        info = FmUtil.kmodReadModinfo(fullfn)
+        return {k: v for k, v in info.items() if k in self.keyList}
@@ -0,0 +1,265 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import ssl
+import time
+import certifi
+import threading
+import http.client
+import urllib.parse
+import concurrent.futures
+from fm_util import FmUtil
+from fm_util import MakeConf
+from fm_param import FmConst
+
+
+class MirrorProber:
+
+    """
+    Select a mirror that has all the wanted files.
+
+    All the candidate mirrors are probed concurrently, each probe has a bounded timeout. For http(s)
+    mirrors the connect latency is measured, and a small range request is done on the first wanted
+    file to measure the throughput. For other mirrors "wget --spider" is used and only the latency is
+    measured.
+
+    Probe results are recorded in a ranking table stored in FmConst.cacheDir. Old records decay with
+    a half-life, so that mirrors which were fast recently are preferred. Candidates are checked in
+    ranking order, the first candidate that has all the wanted files is selected without waiting for
+    the probes of the candidates after it. Mirrors that have never been probed are checked after the
+    ranked mirrors, in their configured order.
+
+    A missing file doesn't count as a failure of the mirror, only connection errors and timeouts do.
+    """
+
+    halfLife = 7 * 24 * 3600                # seconds
+    historyWeight = 0.7                     # weight of a fresh record when merging a new probe result
+
+    def __init__(self, cacheFile=None, timeout=10, rangeSize=64 * 1024, maxWorkers=16):
+        if cacheFile is not None:
+            self._cacheFile = cacheFile
+        else:
+            self._cacheFile = os.path.join(FmConst.cacheDir, "mirror-ranking.cache")
+        self._timeout = timeout
+        self._rangeSize = rangeSize
+        self._maxWorkers = maxWorkers
+
+        self._lock = threading.Lock()
+        self._rankDict = FmUtil.cacheLoad(self._cacheFile)        # mirror -> {"latency": seconds, "throughput": bytes/second, "failure": ratio, "time": seconds}
+        if not isinstance(self._rankDict, dict):
+            self._rankDict = dict()
+        self._bDirty = False
+
+    def save(self):
+        with self._lock:
+            if self._bDirty:
+                FmUtil.cacheSave(self._cacheFile, self._rankDict)
+                self._bDirty = False
+
+    def getRankedMirrorList(self, mirrorList):
+        """Returns mirrorList sorted by ranking, mirrors that have never been probed are placed last"""
+
+        with self._lock:
+            scoreDict = {mr: self._getScore(mr) for mr in mirrorList}
+        known = sorted([mr for mr in mirrorList if scoreDict[mr] is not None], key=lambda mr: scoreDict[mr])
+        unknown = [mr for mr in mirrorList if scoreDict[mr] is None]
+        return known + unknown
+
+    def probe(self, mirror, urlList):
+        """Returns "ok", "missing" or "error", the result is recorded in the ranking table"""
+
+        ret, latency, throughput = self._probe(urlList)
+        if ret != "missing":
+            self._record(mirror, latency, throughput)
+        return ret
+
+    def selectMirror(self, candidateList):
+        """candidateList is list<(mirror, list<url>)>, one mirror may appear in several candidates
+           Returns the index of the selected candidate, returns None if no candidate has all the files"""
+
+        if len(candidateList) == 0:
+            return None
+
+        # stable sort, so the candidates of one mirror keep their order
+        rankList = self.getRankedMirrorList(list(dict.fromkeys([x[0] for x in candidateList])))
+        indexList = sorted(range(0, len(candidateList)), key=lambda i: rankList.index(candidateList[i][0]))
+
+        ret = None
+        resultDict = dict()                 # candidate-index -> (result, latency, throughput)
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self._maxWorkers)
+        try:
+            futureList = [pool.submit(self._probe, urlList) for mr, urlList in candidateList]
+            deadline = time.monotonic() + self._timeout * (1 + max(len(x[1]) for x in candidateList))
+            for i in indexList:
+                try:
+                    resultDict[i] = futureList[i].result(timeout=max(0, deadline - time.monotonic()))
+                except concurrent.futures.TimeoutError:
+                    resultDict[i] = ("error", None, None)
+                    continue
+                if resultDict[i][0] == "ok":
+                    ret = i
+                    break
+
+            # probes that are not waited for are recorded only if they have finished, late results are dropped
+            for i, future in enumerate(futureList):
+                if i not in resultDict and future.done() and not future.cancelled():
+                    resultDict[i] = future.result()
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        # record each mirror once, a mirror is good if any of its candidates is good
+        mirrorDict = dict()
+        for i in sorted(resultDict):
+            mr = candidateList[i][0]
+            if resultDict[i][0] == "ok":
+                if mr not in mirrorDict or mirrorDict[mr][0] != "ok":
+                    mirrorDict[mr] = resultDict[i]
+            elif resultDict[i][0] == "error":
+                mirrorDict.setdefault(mr, resultDict[i])
+        for mr, item in mirrorDict.items():
+            self._record(mr, item[1], item[2])
+        self.save()
+
+        return ret
+
+    def getGentooHttpMirror(self, makeConf, defaultMirror, filesWanted):
+        mirrorList = MakeConf(makeConf).get("GENTOO_MIRRORS").split()
+        i = self.selectMirror([(mr, ["%s/%s" % (mr, fn) for fn in filesWanted]) for mr in mirrorList])
+        if i is not None:
+            return mirrorList[i]
+        return defaultMirror
+
+    def getLinuxKernelMirror(self, makeConf, defaultMirror, kernelVersion, filesWanted):
+        # we support two mirror file structure:
+        # 1. all files placed under /: a simple structure suitable for local mirrors
+        # 2. /{v3.x,v4.x,...}/*:       an overly complicated structure used by official kernel mirrors
+
+        subdir = None
+        for i in range(3, 9):
+            if kernelVersion.startswith(str(i)):
+                subdir = "v%d.x" % (i)
+        assert subdir is not None
+
+        candidateList = []
+        for mr in MakeConf(makeConf).get("KERNEL_MIRRORS").split():
+            candidateList.append((mr, filesWanted))
+            candidateList.append((mr, ["%s/%s" % (subdir, fn) for fn in filesWanted]))
+
+        i = self.selectMirror([(mr, ["%s/%s" % (mr, fn) for fn in fileList]) for mr, fileList in candidateList])
+        if i is not None:
+            return candidateList[i]
+
+        # use default mirror
+        return (defaultMirror, ["%s/%s" % (subdir, fn) for fn in filesWanted])
+
+    def getLinuxFirmwareMirror(self, makeConf, defaultMirror, filesWanted):
+        mirrorList = MakeConf(makeConf).get("KERNEL_MIRRORS").split()
+        i = self.selectMirror([(mr, ["%s/firmware/%s" % (mr, fn) for fn in filesWanted]) for mr in mirrorList])
+        if i is not None:
+            return (mirrorList[i], ["firmware/%s" % (fn) for fn in filesWanted])
+        return (defaultMirror, ["firmware/%s" % (fn) for fn in filesWanted])
+
+    def _probe(self, urlList):
+        # returns (result, latency, throughput), nothing is recorded
+        latency = None
+        throughput = None
+        for url in urlList:
+            if urllib.parse.urlsplit(url).scheme in ["http", "https"]:
+                ret, t, tp = self._probeHttp(url, throughput is None)
+            else:
+                ret, t, tp = self._probeSpider(url)
+            if ret != "ok":
+                return (ret, None, None)
+            if latency is None:
+                latency = t
+            if tp is not None:
+                throughput = tp
+        return ("ok", latency, throughput)
+
+    def _probeHttp(self, url, bMeasureThroughput):
+        # returns (result, latency, throughput), redirects are followed
+        for i in range(0, 5):
+            u = urllib.parse.urlsplit(url)
+            if u.scheme == "https":
+                conn = http.client.HTTPSConnection(u.hostname, u.port, timeout=self._timeout,
+                                                   context=ssl.create_default_context(cafile=certifi.where()))
+            elif u.scheme == "http":
+                conn = http.client.HTTPConnection(u.hostname, u.port, timeout=self._timeout)
+            else:
+                return self._probeSpider(url)
+
+            try:
+                t1 = time.monotonic()
+                conn.connect()
+                t2 = time.monotonic()
+
+                path = u.path if u.path != "" else "/"
+                if u.query != "":
+                    path += "?" + u.query
+                if bMeasureThroughput:
+                    conn.request("GET", path, headers={"Range": "bytes=0-%d" % (self._rangeSize - 1)})
+                else:
+                    conn.request("HEAD", path)
+                resp = conn.getresponse()
+
+                if resp.status in [301, 302, 303, 307, 308] and resp.getheader("Location") is not None:
+                    url = urllib.parse.urljoin(url, resp.getheader("Location"))
+                    continue
+                if resp.status not in [200, 206]:
+                    return ("missing", t2 - t1, None)
+                if not bMeasureThroughput:
+                    return ("ok", t2 - t1, None)
+
+                size = len(resp.read(self._rangeSize))
+                t3 = time.monotonic()
+                return ("ok", t2 - t1, size / max(t3 - t2, 0.001))
+            except (OSError, http.client.HTTPException):
+                return ("error", None, None)
+            finally:
+                conn.close()
+
+        return ("error", None, None)
+
+    def _probeSpider(self, url):
+        t = time.monotonic()
+        if FmUtil.cmdCallTestSuccess("/usr/bin/wget", "--spider", "-t", "1", "-T", str(self._timeout), url):
+            return ("ok", time.monotonic() - t, None)
+        else:
+            return ("missing", None, None)
+
+    def _record(self, mirror, latency, throughput):
+        now = time.time()
+        with self._lock:
+            old = self._rankDict.get(mirror)
+            if old is None:
+                w = 0
+                old = {"latency": None, "throughput": None, "failure": 0}
+            else:
+                w = self.historyWeight * 0.5 ** (max(0, now - old["time"]) / self.halfLife)
+
+            new = {
+                "latency": old["latency"],
+                "throughput": old["throughput"],
+                "failure": w * old["failure"] + (1 - w) * (1 if latency is None else 0),
+                "time": now,
+            }
+            if latency is not None:
+                new["latency"] = latency if old["latency"] is None else w * old["latency"] + (1 - w) * latency
+            if throughput is not None:
+                new["throughput"] = throughput if old["throughput"] is None else w * old["throughput"] + (1 - w) * throughput
+
+            self._rankDict[mirror] = new
+            self._bDirty = True
+
+    def _getScore(self, mirror):
+        # estimated seconds to fetch 1MiB, lower is better
+        item = self._rankDict.get(mirror)
+        if item is None:
+            return None
+        if item["latency"] is None:
+            return float("inf")
+        score = item["latency"]
+        if item["throughput"] is not None:
+            score += 1024 * 1024 / item["throughput"]
+        return score / max(1 - item["failure"], 0.01)
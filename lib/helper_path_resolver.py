@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+
+
+class PathResolver:
+
+    """
+    Resolve many paths like os.path.realpath(), each path prefix is resolved only once.
+
+    Resolved prefixes are kept in a trie keyed by path component. A symlink component is resolved by
+    walking its target in the same trie, and the symlink's trie node is replaced by the node of the
+    target, so paths through /lib and /lib64 share the resolution of everything below.
+
+    Like os.path.realpath() in non-strict mode, components that don't exist are kept as is. A symlink
+    loop stops being resolved after maxDepth levels, so for paths through a loop the result may differ
+    from os.path.realpath().
+
+    The filesystem is assumed not to change during the lifetime of the object.
+    """
+
+    maxDepth = 40
+
+    def __init__(self):
+        self._root = _Node("/")
+
+    def realPath(self, path):
+        """path must be absolute"""
+
+        assert path.startswith("/")
+        return self._walk(path, 0).realPath
+
+    def realDirPathDict(self, pathSet):
+        """Returns dict<path, realpath of dirname(path) + basename(path)>, each directory is resolved once"""
+
+        dirDict = dict()
+        ret = dict()
+        for path in pathSet:
+            d, b = os.path.split(path)
+            rd = dirDict.get(d)
+            if rd is None:
+                rd = self.realPath(d)
+                dirDict[d] = rd
+            ret[path] = os.path.join(rd, b)
+        return ret
+
+    def _walk(self, path, depth):
+        node = self._root
+        for c in path.split("/"):
+            if c == "" or c == ".":
+                continue
+            if c == "..":
+                # node.realPath contains no symlink, so its parent is also resolved
+                node = self._walk(os.path.dirname(node.realPath), depth)
+                continue
+            child = node.children.get(c)
+            if child is None:
+                child = self._newChild(node, c, depth)
+            node = child
+        return node
+
+    def _newChild(self, node, name, depth):
+        candidate = os.path.join(node.realPath, name)
+        try:
+            target = os.readlink(candidate)
+        except OSError:
+            target = None                   # not a symlink, or not exist
+
+        if target is None or depth >= self.maxDepth:
+            child = _Node(candidate)
+        else:
+            child = self._walk(os.path.join(node.realPath, target), depth + 1)
+        node.children[name] = child
+        return child
+
+
+class _Node:
+
+    __slots__ = ("realPath", "children")
+
+    def __init__(self, realPath):
+        self.realPath = realPath
+        self.children = dict()          # component -> _Node
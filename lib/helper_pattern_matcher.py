@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import re
+import fnmatch
+
+
+class GlobPatternMatcher:
+
+    """
+    Match paths against a large set of fnmatch-style patterns, same semantics as fnmatch.fnmatchcase().
+
+    Patterns without wildcards are stored in a set.
+    Other patterns are grouped by the directory part of their literal prefix (the part before the
+    first wildcard, up to the last "/"), each group is compiled into one combined regular expression.
+    A path is only tested against the groups whose prefix is one of its ancestor directories.
+    """
+
+    def __init__(self, patternSet):
+        self._literalSet = set()
+        self._prefixDict = dict()           # prefix -> compiled regex
+
+        tdict = dict()
+        for pattern in patternSet:
+            m = re.search(r"[\*\?\[]", pattern)
+            if m is None:
+                self._literalSet.add(pattern)
+                continue
+            prefix = pattern[:pattern.rfind("/", 0, m.start()) + 1]
+            tdict.setdefault(prefix, []).append(pattern)
+
+        for prefix, patternList in tdict.items():
+            self._prefixDict[prefix] = re.compile("|".join("(?:%s)" % (fnmatch.translate(x)) for x in sorted(patternList)))
+
+    def match(self, path):
+        if path in self._literalSet:
+            return True
+
+        regex = self._prefixDict.get("")
+        if regex is not None and regex.match(path) is not None:
+            return True
+
+        i = path.find("/")
+        while i >= 0:
+            regex = self._prefixDict.get(path[:i + 1])
+            if regex is not None and regex.match(path) is not None:
+                return True
+            i = path.find("/", i + 1)
+
+        return False
+
+    def filter(self, pathSet):
+        """Returns the paths that match none of the patterns"""
+
+        return set(x for x in pathSet if not self.match(x))
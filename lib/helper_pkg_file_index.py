@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+from fm_util import FmUtil
+from fm_param import FmConst
+
+
+class PkgInstalledFileIndex:
+
+    """
+    Index of all the files installed by portage: path -> (owner-cpv, type, md5, mtime).
+
+    The index is stored in FmConst.cacheDir and is refreshed incrementally, only packages whose
+    /var/db/pkg/<category>/<package> directory has changed since the last refresh are re-parsed.
+
+    For "dir", "fif" and "dev" entries, md5 and mtime are None.
+    For "sym" entries, md5 is None.
+    """
+
+    def __init__(self, dbDir=FmConst.portageDbDir, cacheFile=None):
+        self._dbDir = dbDir
+        if cacheFile is not None:
+            self._cacheFile = cacheFile
+        else:
+            self._cacheFile = os.path.join(FmConst.cacheDir, "installed-files.cache")
+
+        self._pkgDict = dict()          # cpv -> [stamp, [[path, type, md5, mtime], ...]]
+        self._fileDict = dict()         # path -> (cpv, type, md5, mtime)
+        self._bDirty = False
+
+        self.refresh()
+
+    def refresh(self):
+        oldPkgDict = FmUtil.cacheLoad(self._cacheFile)
+        if not isinstance(oldPkgDict, dict):
+            oldPkgDict = dict()
+        if len(self._pkgDict) > 0:
+            oldPkgDict = self._pkgDict
+
+        self._pkgDict = dict()
+        for cpv in FmUtil.getFileList(self._dbDir, 2, "d"):
+            if FmUtil.repoIsSysFile(cpv):
+                continue
+            if cpv.split("/")[1].startswith("-MERGING"):
+                continue
+            stamp = self._getStamp(cpv)
+            if stamp is None:
+                continue
+            if cpv in oldPkgDict and oldPkgDict[cpv][0] == stamp:
+                self._pkgDict[cpv] = oldPkgDict[cpv]
+            else:
+                self._pkgDict[cpv] = [stamp, self._parseContentsFile(os.path.join(self._dbDir, cpv, "CONTENTS"))]
+                self._bDirty = True
+        if len(self._pkgDict) != len(oldPkgDict):
+            self._bDirty = True
+
+        self._fileDict = dict()
+        for cpv in sorted(self._pkgDict.keys()):
+            for path, ftype, md5, mtime in self._pkgDict[cpv][1]:
+                self._fileDict[path] = (cpv, ftype, md5, mtime)
+
+    def save(self):
+        if self._bDirty:
+            FmUtil.cacheSave(self._cacheFile, self._pkgDict)
+            self._bDirty = False
+
+    def getPackageList(self):
+        return sorted(self._pkgDict.keys())
+
+    def getPackageFileList(self, cpv):
+        """Returns list<(path, type, md5, mtime)>, returns [] if the package is not installed"""
+
+        if cpv not in self._pkgDict:
+            return []
+        return [tuple(x) for x in self._pkgDict[cpv][1]]
+
+    def getFileOwner(self, path):
+        """Returns None if the file does not belong to any package"""
+
+        ret = self._fileDict.get(path)
+        return ret[0] if ret is not None else None
+
+    def getFileInfo(self, path):
+        """Returns (owner-cpv, type, md5, mtime), returns None if the file does not belong to any package"""
+
+        return self._fileDict.get(path)
+
+    def hasFile(self, path):
+        return path in self._fileDict
+
+    def getFileSet(self):
+        return set(self._fileDict.keys())
+
+    def __contains__(self, path):
+        return path in self._fileDict
+
+    def __iter__(self):
+        return iter(self._fileDict)
+
+    def __len__(self):
+        return len(self._fileDict)
+
+    def _getStamp(self, cpv):
+        try:
+            s1 = os.stat(os.path.join(self._dbDir, cpv))
+            s2 = os.stat(os.path.join(self._dbDir, cpv, "CONTENTS"))
+        except FileNotFoundError:
+            return None
+        return [s1.st_mtime_ns, s2.st_mtime_ns, s2.st_size]
+
+    def _parseContentsFile(self, filename):
+        # the format of CONTENTS file:
+        #   dir <path>
+        #   obj <path> <md5> <mtime>
+        #   sym <path> -> <target> <mtime>
+        #   fif <path>
+        #   dev <path>
+
+        ret = []
+        with open(filename, "r", encoding="UTF-8", errors="surrogateescape") as f:
+            for line in f.read().split("\n"):
+                if line == "":
+                    continue
+                ftype, rest = line.split(" ", 1)
+                if ftype == "obj":
+                    path, md5, mtime = rest.rsplit(" ", 2)
+                    ret.append([path, ftype, md5, int(mtime)])
+                elif ftype == "sym":
+                    rest, mtime = rest.rsplit(" ", 1)
+                    path = rest.split(" -> ", 1)[0]
+                    ret.append([path, ftype, None, int(mtime)])
+                elif ftype in ["dir", "fif", "dev"]:
+                    ret.append([rest, ftype, None, None])
+                else:
+                    assert False
+        return ret
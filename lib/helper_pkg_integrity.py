@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import time
+from fm_util import FmUtil
+from fm_util import ContextThreadPoolExecutor
+from fm_util import FileHasher
+from fm_param import FmConst
+
+
+class PkgIntegrityVerifier:
+
+    """
+    Calculate MD5 digests for the files recorded in /var/db/pkg/*/*/CONTENTS_2.
+
+    Files are hashed by a thread pool, packages are prefetched in the same order as they are checked,
+    so the caller can still check packages one by one and print error messages in its own order.
+
+    Files are hashed by FileHasher, with its digest cache kept in FmConst.cacheDir.
+    Files that have not changed since the last verification are not read again.
+    """
+
+    def __init__(self, pkgNameVerList, ignoreList=[], prefetchCount=32, maxWorkers=None):
+        self._pkgNameVerList = list(pkgNameVerList)
+        self._pkgIndexDict = {x: i for i, x in enumerate(self._pkgNameVerList)}
+        self._ignoreList = ignoreList
+        self._prefetchCount = prefetchCount
+
+        self._hasher = FileHasher("md5", cacheFile=os.path.join(FmConst.cacheDir, "pkg-md5.cache"))
+
+        self._pool = ContextThreadPoolExecutor(max_workers=maxWorkers)
+        self._pkgDict = dict()              # pkgNameVer -> (contentList, dict<filename, future>)
+        self._nextPrefetchIndex = 0
+
+        self._startTime = time.time()
+
+    def getContentList(self, pkgNameVer):
+        """Returns the parsed CONTENTS_2 file of the package, see FmUtil.portageParseVarDbPkgContentFile()"""
+
+        self._prefetch(pkgNameVer)
+        return self._pkgDict[pkgNameVer][0]
+
+    def getFileMd5(self, pkgNameVer, filename):
+        """Returns None if the file does not exist"""
+
+        self._prefetch(pkgNameVer)
+        return self._pkgDict[pkgNameVer][1][filename].result()
+
+    def releasePackage(self, pkgNameVer):
+        # the caller has done with this package
+        self._pkgDict.pop(pkgNameVer, None)
+
+    def getStatistics(self):
+        """Returns (fileCount, cacheHitCount, bytesHashed, elapsedSeconds)"""
+
+        return self._hasher.getStatistics() + (time.time() - self._startTime,)
+
+    def saveCache(self):
+        # only record files verified in this run, so that entries for removed files are dropped
+        self._hasher.saveCache(bPrune=True)
+
+    def dispose(self):
+        for contentList, futureDict in self._pkgDict.values():
+            for future in futureDict.values():
+                future.cancel()
+        self._pool.shutdown(wait=True)
+        self._pkgDict = dict()
+
+    def _prefetch(self, pkgNameVer):
+        if pkgNameVer not in self._pkgDict:
+            self._submitPackage(pkgNameVer)
+
+        i = self._pkgIndexDict.get(pkgNameVer)
+        if i is None:
+            return
+
+        self._nextPrefetchIndex = max(self._nextPrefetchIndex, i + 1)
+        endIndex = min(i + 1 + self._prefetchCount, len(self._pkgNameVerList))
+        while self._nextPrefetchIndex < endIndex:
+            pkgNameVer2 = self._pkgNameVerList[self._nextPrefetchIndex]
+            if pkgNameVer2 not in self._pkgDict:
+                self._submitPackage(pkgNameVer2)
+            self._nextPrefetchIndex += 1
+
+    def _submitPackage(self, pkgNameVer):
+        contf = os.path.join(FmConst.portageDbDir, pkgNameVer, "CONTENTS_2")
+        if os.path.exists(contf):
+            contentList = FmUtil.portageParseVarDbPkgContentFile(contf)
+        else:
+            contentList = []
+
+        futureDict = dict()
+        for item in contentList:
+            if item[0] != "obj":
+                continue
+            if any(item[1].startswith(p + "/") for p in self._ignoreList):
+                continue
+            if item[1] not in futureDict:
+                futureDict[item[1]] = self._pool.submit(self._hashFile, item[1])
+
+        self._pkgDict[pkgNameVer] = (contentList, futureDict)
+
+    def _hashFile(self, filename):
+        try:
+            return self._hasher.hashFile(filename)
+        except FileNotFoundError:
+            return None
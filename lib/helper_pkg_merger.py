@@ -3,6 +3,8 @@
 
 import os
 import re
+import time
+import hashlib
 import subprocess
 from fm_util import FmUtil
 from fm_param import FmConst
@@ -10,17 +12,31 @@ from fm_param import FmConst
 
 class PkgMerger:
 
+    """
+    USE flag auto-adjustment runs "emerge -p" repeatedly until portage stops asking for USE changes.
+    When the loop converges, the result is recorded in FmConst.cacheDir with a fingerprint of the
+    emerge command, /etc/portage, the installed package database, the world file and the repository
+    timestamps. If the fingerprint is unchanged next time, the pretend runs are skipped entirely.
+    """
+
+    def __init__(self, cacheFile=None):
+        if cacheFile is not None:
+            self._cacheFile = cacheFile
+        else:
+            self._cacheFile = os.path.join(FmConst.cacheDir, "pkg-merger-resolver.cache")
+        self.lastResolveInfo = None             # {"iterations": N, "duration": seconds, "skipped": bool}
+
     def touchPortageTree(self):
         FmUtil.cmdCallIgnoreResult("/usr/bin/emerge", "-s", "non-exist-package")
 
     def fetchPkg(self, cmd, autouse=True):
-        while autouse and self._updateUseFlag("/usr/bin/emerge -p %s" % (cmd)):
-            pass
+        if autouse:
+            self._autoUpdateUseFlag("/usr/bin/emerge -p %s" % (cmd))
         FmUtil.shellExec("/usr/bin/emerge --fetchonly %s" % (cmd))
 
     def emergePkg(self, cmd, autouse=True):
-        while autouse and self._updateUseFlag("/usr/bin/emerge -p %s" % (cmd)):
-            pass
+        if autouse:
+            self._autoUpdateUseFlag("/usr/bin/emerge -p %s" % (cmd))
         FmUtil.shellExec("/usr/bin/emerge %s" % (cmd))
 
     def smartEmergePkg(self, pretendCmd, realCmd, cfgProtect=True, quietFail=False, pkgName=None):
@@ -141,7 +157,80 @@ class PkgMerger:
     def unmergePkg(self, pkgName):
         FmUtil.cmdExec("/usr/bin/emerge", "-C", pkgName)
 
+    def _autoUpdateUseFlag(self, pretendCmd2):
+        cacheDict = FmUtil.cacheLoad(self._cacheFile)
+        if not isinstance(cacheDict, dict):
+            cacheDict = dict()
+
+        # nothing has changed since the last converged run
+        record = cacheDict.get(pretendCmd2)
+        if record is not None and record["fingerprint"] == self._getResolverFingerprint(pretendCmd2):
+            self.lastResolveInfo = {"iterations": 0, "duration": 0, "skipped": True}
+            return
+
+        t = time.time()
+        count = 0
+        while True:
+            count += 1
+            ret = self._updateUseFlag(pretendCmd2)
+            if not ret:
+                break
+        self.lastResolveInfo = {"iterations": count, "duration": time.time() - t, "skipped": False}
+
+        # only record converged result, fingerprint is calculated after 99-autouse is updated
+        if ret is False:
+            cacheDict[pretendCmd2] = {
+                "fingerprint": self._getResolverFingerprint(pretendCmd2),
+                "iterations": count,
+                "duration": self.lastResolveInfo["duration"],
+                "time": time.time(),
+            }
+        elif pretendCmd2 in cacheDict:
+            del cacheDict[pretendCmd2]
+        FmUtil.cacheSave(self._cacheFile, cacheDict)
+
+    def _getResolverFingerprint(self, pretendCmd2):
+        h = hashlib.sha256()
+        h.update(pretendCmd2.encode("utf-8"))
+
+        def _updateStat(path):
+            try:
+                s = os.lstat(path)
+                h.update(("\n%s %d %d" % (path, s.st_mtime_ns, s.st_size)).encode("utf-8", "surrogateescape"))
+            except FileNotFoundError:
+                h.update(("\n%s -" % (path)).encode("utf-8", "surrogateescape"))
+
+        # /etc/portage, make.profile is a symlink into a repository
+        for root, dirs, files in os.walk(FmConst.portageCfgDir):
+            dirs.sort()
+            for fn in sorted(files + [x for x in dirs if os.path.islink(os.path.join(root, x))]):
+                fullfn = os.path.join(root, fn)
+                _updateStat(fullfn)
+                if os.path.islink(fullfn):
+                    h.update(os.readlink(fullfn).encode("utf-8", "surrogateescape"))
+
+        # installed package database, merging or unmerging a package changes the mtime of its category directory
+        _updateStat(FmConst.portageDbDir)
+        if os.path.isdir(FmConst.portageDbDir):
+            for cat in sorted(os.listdir(FmConst.portageDbDir)):
+                _updateStat(os.path.join(FmConst.portageDbDir, cat))
+
+        # world file and repositories
+        _updateStat(os.path.join(FmConst.portageDataDir, "world"))
+        _updateStat(os.path.join(FmConst.portageDataDir, "world_sets"))
+        if os.path.isdir(FmConst.portageDataDir):
+            for fn in sorted(os.listdir(FmConst.portageDataDir)):
+                if fn.startswith("repo-") or fn.startswith("overlay-"):
+                    repoDir = os.path.join(FmConst.portageDataDir, fn)
+                    _updateStat(repoDir)
+                    for x in ["metadata/timestamp.chk", "metadata/timestamp.x", ".git/index"]:
+                        _updateStat(os.path.join(repoDir, x))
+
+        return h.hexdigest()
+
     def _updateUseFlag(self, pretendCmd2):
+        """Returns True if USE flags are changed, False if no change is needed, None if unable to resolve"""
+
         fn = os.path.join(FmConst.portageCfgUseDir, "99-autouse")
         useLine = []
         useMap = dict()
@@ -166,6 +255,8 @@ class PkgMerger:
             useLine.append((tlist[0], tlist[1:]))
 
         if useLine == []:
+            if rc != 0:
+                return                                      # dependency resolution failed for other reasons
             return False
 
         for pkgAtom, useList in FmUtil.portageParseCfgUseFile(FmUtil.readFile(fn)):
@@ -8,12 +8,15 @@ import shutil
 import portage
 import fileinput
 import subprocess
+import uuid
 import configparser
 import urllib.parse
 from datetime import datetime
 from fm_util import FmUtil
 from fm_util import TempChdir
+from fm_util import TempCreateFile
 from fm_param import FmConst
+from helper_repo_iuse_index import RepoIuseIndex
 
 
 class PkgWarehouse:
@@ -21,6 +24,7 @@ class PkgWarehouse:
     def __init__(self):
         self.repoman = EbuildRepositories()
         self.layman = EbuildOverlays()
+        self._iuseIndexDict = dict()            # repo-dir -> RepoIuseIndex
 
     def getPreEnableOverlays(self):
         ret = dict()
@@ -111,6 +115,35 @@ class PkgWarehouse:
                                      self.__rubyCompareDefaultTargetsUseFlag,
                                      self.__rubyCheckMainPackageOfTargetUseFlag)
 
+    def prepareRepoIndexes(self):
+        """RepoIuseIndex parses with a fork based process pool, which is not safe when other threads are running.
+           This function builds the IUSE indexes and the package directory indexes of the repositories and overlays
+           in advance, it should be called before the check threads are started."""
+
+        # errors are reported by the checks that use the indexes
+        def _preparePkgIndex(repoDir):
+            try:
+                FmUtil.repoGetEbuildDirList(repoDir)
+            except Exception:
+                pass
+
+        self._iuseIndexDict = dict()
+        for oname in self.layman.getOverlayList():
+            if self.layman.isOverlayExist(oname):
+                _preparePkgIndex(self.layman.getOverlayDir(oname))
+        for repoName in self.repoman.getRepositoryList():
+            if not self.repoman.isRepoExist(repoName):
+                continue
+            repoDir = self.repoman.getRepoDir(repoName)
+            _preparePkgIndex(repoDir)
+            if RepoIuseIndex.hasMd5Cache(repoDir):
+                try:
+                    iuseIndex = RepoIuseIndex(repoDir)
+                    iuseIndex.save()
+                except Exception:
+                    continue
+                self._iuseIndexDict[repoDir] = iuseIndex
+
     def checkLinguasUseFlags(self):
         self._operateLinguasUseFlags(True, "97", "linguas")
 
@@ -245,13 +278,24 @@ class PkgWarehouse:
         for repoName in self.repoman.getRepositoryList():
             if not self.repoman.isRepoExist(repoName):
                 continue
-            for pkgName in FmUtil.repoGetEbuildDirList(self.repoman.getRepoDir(repoName)):
-                for cpv in portree.dbapi.match(pkgName):
-                    for use in portree.dbapi.aux_get(cpv, ["IUSE"])[0].split():
-                        if use.startswith("l10n_"):
-                            useSet.add(use[len("l10n_"):])
-                        elif use.startswith("+l10n_"):
-                            useSet.add(use[len("+l10n_"):])
+            repoDir = self.repoman.getRepoDir(repoName)
+            if RepoIuseIndex.hasMd5Cache(repoDir):
+                # read IUSE from metadata/md5-cache, it is much faster than aux_get() with a cold portage cache
+                iuseIndex = self._iuseIndexDict.get(repoDir)
+                if iuseIndex is None:
+                    iuseIndex = RepoIuseIndex(repoDir)
+                    iuseIndex.save()
+                for use in iuseIndex.getUseFlagSet():
+                    if use.startswith("l10n_"):
+                        useSet.add(use[len("l10n_"):])
+            else:
+                for pkgName in FmUtil.repoGetEbuildDirList(repoDir):
+                    for cpv in portree.dbapi.match(pkgName):
+                        for use in portree.dbapi.aux_get(cpv, ["IUSE"])[0].split():
+                            if use.startswith("l10n_"):
+                                useSet.add(use[len("l10n_"):])
+                            elif use.startswith("+l10n_"):
+                                useSet.add(use[len("+l10n_"):])
 
         useList = sorted(list(useSet))
         fnContent = "*/*     L10N: %s" % (" ".join(useList))
@@ -505,7 +549,7 @@ class EbuildRepositories:
         # if lastDate is not None:
         #     while curDate > lastDate:
         #         remoteFile = os.path.join("snapshots", "portage-%s.tar.xz" % (curDate.strftime("%Y%m%d")))
-        #         mr = FmUtil.portageGetGentooHttpMirror(FmConst.portageCfgMakeConf, FmConst.defaultGentooMirror, [remoteFile])
+        #         mr = MirrorProber().getGentooHttpMirror(FmConst.portageCfgMakeConf, FmConst.defaultGentooMirror, [remoteFile])
         #         remoteFile = os.path.join(mr, remoteFile)
         #         if FmUtil.wgetSpider(remoteFile):
         #             break
@@ -513,7 +557,7 @@ class EbuildRepositories:
         #         remoteFile = None
         # else:
         #     remoteFile = os.path.join("snapshots", "portage-latest.tar.xz")
-        #     mr = FmUtil.portageGetGentooHttpMirror(FmConst.portageCfgMakeConf, FmConst.defaultGentooMirror, [remoteFile])
+        #     mr = MirrorProber().getGentooHttpMirror(FmConst.portageCfgMakeConf, FmConst.defaultGentooMirror, [remoteFile])
         #     remoteFile = os.path.join(mr, remoteFile)
 
         # # download and replace all files if neccessary
@@ -1180,39 +1224,105 @@ class Ebuild2Dir:
         exec(open(scfile).read())
 
     def getCruftFilterPatternSet(self, pkgAtom):
-        ebuild2File = self._ebuild2File(pkgAtom)
-        if not os.path.exists(ebuild2File):
-            return set()
+        return self.getCruftFilterPatternDict([pkgAtom])[pkgAtom]
 
-        prepCmd = "%s pkg_cruft_filter() { return; }; . \"%s\";" % (self._prepCmd(), ebuild2File)
-        out = FmUtil.cmdCall("/bin/bash", "-c", "%s pkg_cruft_filter" % (prepCmd))
+    def getCruftFilterPatternDict(self, pkgAtomList):
+        """Returns dict<pkgAtom, patternSet>
+           pkg_cruft_filter() of all the packages are evaluated in one bash process,
+           results are cached by the hash of ebuild2 file and the hash of make.defaults files"""
 
-        patternSet = set()
-        for x in out.split("\n"):
-            if x != "":
+        cacheFile = os.path.join(FmConst.cacheDir, "ebuild2-cruft-filter.cache")
+        profileHash = self._makeDefaultsHash()
+
+        cache = FmUtil.cacheLoad(cacheFile)
+        if not isinstance(cache, dict) or cache.get("profile") != profileHash:
+            cache = {"profile": profileHash, "packages": dict()}
+
+        ret = dict()
+        todoDict = dict()
+        for pkgAtom in pkgAtomList:
+            ebuild2File = self._ebuild2File(pkgAtom)
+            if not os.path.exists(ebuild2File):
+                ret[pkgAtom] = []
+                continue
+            scriptHash = FmUtil.hashFile(ebuild2File)
+            item = cache["packages"].get(pkgAtom)
+            if item is not None and item[0] == scriptHash:
+                ret[pkgAtom] = item[1]
+            else:
+                todoDict[pkgAtom] = scriptHash
+
+        if len(todoDict) > 0:
+            for pkgAtom, outList in self._execCruftFilterBatch("pkg_cruft_filter", "", list(todoDict.keys())).items():
+                ret[pkgAtom] = outList
+                cache["packages"][pkgAtom] = [todoDict[pkgAtom], outList]
+            cache["packages"] = {k: v for k, v in cache["packages"].items() if os.path.exists(self._ebuild2File(k))}
+            FmUtil.cacheSave(cacheFile, cache)
+
+        for pkgAtom in ret:
+            patternSet = set()
+            for x in ret[pkgAtom]:
                 patternSet.add(x)
                 patternSet.add(os.path.realpath(x))
-
-        return patternSet
+            ret[pkgAtom] = patternSet
+        return ret
 
     def getUserCruftFilterPatternSet(self, userName, homeDir, pkgAtom):
-        ebuild2File = self._ebuild2File(pkgAtom)
-        if not os.path.exists(ebuild2File):
-            return set()
+        return self.getUserCruftFilterPatternDict(userName, homeDir, [pkgAtom])[pkgAtom]
 
-        prepCmd = "%s pkg_cruft_filter_user() { return; }; . \"%s\";" % (self._prepCmd(), ebuild2File)
-        proc = subprocess.Popen(['/bin/bash', '-c', "%s pkg_cruft_filter_user %s" % (prepCmd, userName)], universal_newlines=True, stdout=subprocess.PIPE)
-        out = proc.communicate()[0]
-        if proc.returncode != 0:
-            raise Exception("Executing pkg_cruft_filter_user() failed for %s" % (pkgAtom))
+    def getUserCruftFilterPatternDict(self, userName, homeDir, pkgAtomList):
+        """Returns dict<pkgAtom, patternSet>
+           pkg_cruft_filter_user() of all the packages are evaluated in one bash process"""
 
-        patternSet = set()
-        for x in out.split("\n"):
-            if x != "":
+        pkgAtomList2 = [x for x in pkgAtomList if os.path.exists(self._ebuild2File(x))]
+        outDict = self._execCruftFilterBatch("pkg_cruft_filter_user", userName, pkgAtomList2)
+
+        ret = dict()
+        for pkgAtom in pkgAtomList:
+            patternSet = set()
+            for x in outDict.get(pkgAtom, []):
                 patternSet.add(os.path.join(homeDir, x))
                 patternSet.add(os.path.realpath(os.path.join(homeDir, x)))
+            ret[pkgAtom] = patternSet
+        return ret
 
-        return patternSet
+    def _execCruftFilterBatch(self, funcName, funcArgs, pkgAtomList):
+        # make.defaults files are sourced only once, each ebuild2 file is sourced and executed in a sub-shell
+        # so that they don't affect each other, a marker line with the exit code is printed after each package
+        marker = "---- %s ----" % (uuid.uuid4().hex)
+        script = self._prepCmd() + "\n"
+        for pkgAtom in pkgAtomList:
+            script += "( %s() { return; }; . \"%s\"; %s %s ); __rc=$?; echo; echo \"%s $__rc\"\n" % (funcName, self._ebuild2File(pkgAtom), funcName, funcArgs, marker)
+
+        # the script is too big to be a command line argument, and the ebuild2 files must not read it from stdin
+        with TempCreateFile() as scriptFile:
+            with open(scriptFile, "w") as f:
+                f.write(script)
+            proc = subprocess.run(["/bin/bash", scriptFile], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, universal_newlines=True)
+        if proc.returncode != 0:
+            raise Exception("Executing %s() failed" % (funcName))
+
+        ret = dict()
+        i = 0
+        outList = []
+        for line in proc.stdout.split("\n"):
+            if line.startswith(marker + " "):
+                if line[len(marker) + 1:] != "0":
+                    raise Exception("Executing %s() failed for %s" % (funcName, pkgAtomList[i]))
+                ret[pkgAtomList[i]] = outList
+                i += 1
+                outList = []
+            elif line != "":
+                outList.append(line)
+        assert i == len(pkgAtomList)
+
+        return ret
+
+    def _makeDefaultsHash(self):
+        buf = ""
+        for fn in FmUtil.portageGetMakeConfList():
+            buf += "%s %s\n" % (fn, FmUtil.hashFile(fn))
+        return FmUtil.md5hash(buf)
 
     def _prepCmd(self):
         ret = ""
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import concurrent.futures
+from fm_util import FmUtil
+from fm_param import FmConst
+
+
+class RepoIuseIndex:
+
+    """
+    Index of the IUSE of all the ebuilds in a repository, read from the repository's metadata/md5-cache.
+
+    Cache files are parsed by a fork based process pool, so the index should not be created or refreshed
+    when other threads are running.
+    The index is stored in FmConst.cacheDir, one file per repository.
+    Cache files whose mtime and size have not changed since the last refresh are not parsed again.
+    """
+
+    def __init__(self, repoDir, cacheFile=None, maxWorkers=None):
+        self._repoDir = repoDir
+        self._md5CacheDir = self.getMd5CacheDir(repoDir)
+        if cacheFile is not None:
+            self._cacheFile = cacheFile
+        else:
+            self._cacheFile = os.path.join(FmConst.cacheDir, "repo-iuse-%s.cache" % (os.path.basename(repoDir)))
+        self._maxWorkers = maxWorkers
+
+        self._cpvDict = dict()          # cpv -> [mtime, size, list<iuse>]
+        self._bDirty = False
+
+        self.refresh()
+
+    @staticmethod
+    def getMd5CacheDir(repoDir):
+        return os.path.join(repoDir, "metadata", "md5-cache")
+
+    @staticmethod
+    def hasMd5Cache(repoDir):
+        return os.path.isdir(RepoIuseIndex.getMd5CacheDir(repoDir))
+
+    def refresh(self):
+        oldCpvDict = FmUtil.cacheLoad(self._cacheFile)
+        if not isinstance(oldCpvDict, dict):
+            oldCpvDict = dict()
+        if len(self._cpvDict) > 0:
+            oldCpvDict = self._cpvDict
+
+        self._cpvDict = dict()
+        todoDict = dict()               # category -> list<cpv>
+        statDict = dict()               # cpv -> [mtime, size]
+        for cat in os.listdir(self._md5CacheDir):
+            catDir = os.path.join(self._md5CacheDir, cat)
+            if not os.path.isdir(catDir):
+                continue
+            with os.scandir(catDir) as it:
+                for entry in it:
+                    cpv = cat + "/" + entry.name
+                    s = entry.stat()
+                    if cpv in oldCpvDict and oldCpvDict[cpv][:2] == [s.st_mtime_ns, s.st_size]:
+                        self._cpvDict[cpv] = oldCpvDict[cpv]
+                    else:
+                        statDict[cpv] = [s.st_mtime_ns, s.st_size]
+                        todoDict.setdefault(cat, []).append(cpv)
+
+        if len(todoDict) > 0:
+            # one job per category, a cache file is too small to be a job
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self._maxWorkers) as pool:
+                futureList = [pool.submit(_parseMd5CacheFiles, self._md5CacheDir, x) for x in todoDict.values()]
+                for future in futureList:
+                    for cpv, iuseList in future.result().items():
+                        self._cpvDict[cpv] = statDict[cpv] + [iuseList]
+            self._bDirty = True
+        if len(self._cpvDict) != len(oldCpvDict):
+            self._bDirty = True
+
+    def save(self):
+        if self._bDirty:
+            FmUtil.cacheSave(self._cacheFile, self._cpvDict)
+            self._bDirty = False
+
+    def getCpvList(self):
+        return sorted(self._cpvDict.keys())
+
+    def getIuseList(self, cpv):
+        """Returns list<iuse>, iuse may have "+" or "-" prefix"""
+
+        return self._cpvDict[cpv][2]
+
+    def getUseFlagSet(self):
+        """Returns the IUSE of all the ebuilds, without "+" or "-" prefix"""
+
+        ret = set()
+        for item in self._cpvDict.values():
+            ret.update(item[2])
+        return set(x.lstrip("+-") for x in ret)
+
+
+def _parseMd5CacheFiles(md5CacheDir, cpvList):
+    # runs in worker process
+    ret = dict()
+    for cpv in cpvList:
+        iuseList = []
+        with open(os.path.join(md5CacheDir, cpv), "r", encoding="UTF-8", errors="replace") as f:
+            for line in f.read().split("\n"):
+                if line.startswith("IUSE="):
+                    iuseList = line[len("IUSE="):].split()
+                    break
+        ret[cpv] = iuseList
+    return ret
@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import time
+import threading
+import subprocess
+from fm_util import FmUtil
+
+
+class TaskGraph:
+
+    """
+    Run tasks with declared dependencies, independent tasks are run concurrently.
+
+    Each task belongs to a resource class ("network", "disk" or "cpu"), the number of concurrently
+    running tasks in each resource class is limited.
+
+    A task function is called with a TaskOutput object. In parallel mode the output of a task is
+    buffered and printed with a "[task-name]" prefix when the task finishes, so that the output of
+    concurrent tasks is not interleaved. In sequential mode tasks are run in the order they are added,
+    and their output goes to the terminal directly.
+
+    When a task fails, no more task is started, the exception of the first failed task is re-raised
+    after all the running tasks finish.
+    """
+
+    def __init__(self, infoPrinter, bParallel=True, resourceLimitDict=None):
+        self.infoPrinter = infoPrinter
+        self.bParallel = bParallel
+        if resourceLimitDict is not None:
+            self.resourceLimitDict = resourceLimitDict
+        else:
+            self.resourceLimitDict = {
+                "network": 4,
+                "disk": 1,
+                "cpu": os.cpu_count(),
+            }
+
+        self._taskList = []
+        self._taskDict = dict()
+        self._wallTime = None
+
+    def addTask(self, name, title, func, depends=[], resource="cpu"):
+        """title can be a callable, it is evaluated when the task starts
+           depends that refer to tasks not added are ignored"""
+
+        assert name not in self._taskDict
+        assert resource in self.resourceLimitDict
+
+        task = _Task()
+        task.name = name
+        task.title = title
+        task.func = func
+        task.depends = [x for x in depends if x in self._taskDict]
+        task.resource = resource
+        self._taskList.append(task)
+        self._taskDict[name] = task
+
+    def hasTask(self, name):
+        return name in self._taskDict
+
+    def run(self):
+        t = time.time()
+        try:
+            if self.bParallel:
+                self._runParallel()
+            else:
+                self._runSequential()
+        finally:
+            self._wallTime = time.time() - t
+
+    def getCriticalPath(self):
+        """Returns (seconds, list<task-name>), only finished tasks are considered"""
+
+        pathDict = dict()           # name -> (seconds, path)
+        for task in self._taskList:
+            if task.duration is None:
+                continue
+            best = (0, [])
+            for d in task.depends:
+                if d in pathDict and pathDict[d][0] > best[0]:
+                    best = pathDict[d]
+            pathDict[task.name] = (best[0] + task.duration, best[1] + [task.name])
+
+        if len(pathDict) == 0:
+            return (0, [])
+        return max(pathDict.values(), key=lambda x: x[0])
+
+    def printTimings(self):
+        seconds, path = self.getCriticalPath()
+        self.infoPrinter.printInfo(">> Task timings:")
+        for task in self._taskList:
+            if task.duration is not None:
+                print("%s: %.1fs" % (task.name, task.duration))
+        print("Wall time: %.1fs" % (self._wallTime))
+        print("Critical path: %.1fs (%s)" % (seconds, " -> ".join(path)))
+        print("")
+
+    def _runSequential(self):
+        for task in self._taskList:
+            assert all(self._taskDict[x].duration is not None for x in task.depends)
+            task.output = TaskOutput(self.infoPrinter, False)
+            self.infoPrinter.printInfo(">> %s..." % (self._getTitle(task)))
+            t = time.time()
+            task.func(task.output)
+            task.duration = time.time() - t
+            print("")
+
+    def _runParallel(self):
+        cond = threading.Condition()
+        pendingList = list(self._taskList)
+        runningDict = dict()            # resource -> count
+        finishedList = []
+        firstError = None
+
+        def _worker(task):
+            t = time.time()
+            try:
+                task.func(task.output)
+            except BaseException as e:
+                task.error = e
+            task.duration = time.time() - t
+            with cond:
+                finishedList.append(task)
+                cond.notify()
+
+        while True:
+            with cond:
+                # start ready tasks
+                if firstError is None:
+                    for task in list(pendingList):
+                        if not all(self._taskDict[x].duration is not None and self._taskDict[x].error is None for x in task.depends):
+                            continue
+                        if runningDict.get(task.resource, 0) >= self.resourceLimitDict[task.resource]:
+                            continue
+                        pendingList.remove(task)
+                        runningDict[task.resource] = runningDict.get(task.resource, 0) + 1
+                        task.output = TaskOutput(self.infoPrinter, True)
+                        task.title = self._getTitle(task)
+                        threading.Thread(target=_worker, args=(task,)).start()
+
+                if sum(runningDict.values()) == 0 and len(finishedList) == 0:
+                    break
+                while len(finishedList) == 0:
+                    cond.wait()
+                tlist = list(finishedList)
+                finishedList.clear()
+                for task in tlist:
+                    runningDict[task.resource] -= 1
+
+            # print output of finished tasks
+            for task in tlist:
+                if task.error is None:
+                    self.infoPrinter.printInfo(">> %s... (%.1fs)" % (task.title, task.duration))
+                else:
+                    self.infoPrinter.printError(">> %s... failed" % (task.title))
+                for line in task.output.getLines():
+                    print("[%s] %s" % (task.name, line))
+                print("")
+                if task.error is not None and firstError is None:
+                    firstError = task.error
+
+        if firstError is not None:
+            raise firstError
+        assert len(pendingList) == 0
+
+    def _getTitle(self, task):
+        if callable(task.title):
+            return task.title()
+        return task.title
+
+
+class TaskOutput:
+
+    def __init__(self, infoPrinter, bBuffered):
+        self.infoPrinter = infoPrinter
+        self.bBuffered = bBuffered
+        self._buf = ""
+
+    def printInfo(self, s):
+        if self.bBuffered:
+            self._buf += ">> %s\n" % (s)
+        else:
+            self.infoPrinter.printInfo(">> %s" % (s))
+
+    def shellExec(self, cmd):
+        if self.bBuffered:
+            ret = subprocess.run(cmd, shell=True, universal_newlines=True,
+                                 stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            self._buf += ret.stdout
+            if ret.returncode > 128:
+                time.sleep(1.0)
+            ret.check_returncode()
+        else:
+            FmUtil.shellExec(cmd)
+
+    def getLines(self):
+        ret = []
+        for line in self._buf.split("\n"):
+            line = line.rstrip()
+            if line != "":
+                ret.append(line)
+        return ret
+
+
+class _Task:
+
+    def __init__(self):
+        self.name = None
+        self.title = None
+        self.func = None
+        self.depends = None
+        self.resource = None
+        self.output = None
+        self.duration = None
+        self.error = None
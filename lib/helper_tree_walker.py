@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import queue
+import threading
+from fm_util import ContextThreadPoolExecutor
+
+
+class TreeWalker:
+
+    """
+    Walk a directory tree with os.scandir(), sub-directories are walked by a thread pool.
+
+    walk() yields os.DirEntry objects as soon as their parent directory is listed, the order is not
+    defined. The lstat() result of each entry is fetched in the worker thread and cached in the
+    DirEntry object, so entry.stat(follow_symlinks=False) costs nothing in the caller.
+
+    Each worker walks its sub-tree depth-first, and gives sub-directories to the pool when there are
+    idle workers, so that a big sub-tree doesn't keep the other workers idle.
+
+    Symlinks are not followed. Like os.walk(), directories that can't be listed are ignored.
+
+    Entries whose path is in prunePathList are neither yielded nor descended into, like the -prune
+    expression of find. When bStat is False the lstat() result is not prefetched, entry.is_dir() still
+    costs nothing on most filesystems.
+    """
+
+    def __init__(self, topDir, maxWorkers=8, prunePathList=[], bStat=True):
+        self._topDir = topDir
+        self._maxWorkers = maxWorkers
+        self._pruneSet = frozenset(prunePathList)
+        self._bStat = bStat
+
+    def walk(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stopEvent = threading.Event()
+        self._submitted = 0
+        self._finished = 0
+
+        self._pool = ContextThreadPoolExecutor(max_workers=self._maxWorkers)
+        try:
+            self._submit(self._topDir)
+            while True:
+                batch = self._queue.get()
+                if batch is None:
+                    with self._lock:
+                        self._finished += 1
+                        if self._finished == self._submitted:
+                            break
+                    continue
+                yield from batch
+        finally:
+            self._stopEvent.set()
+            self._pool.shutdown(wait=True)
+
+    def _submit(self, dirPath):
+        with self._lock:
+            self._submitted += 1
+        self._pool.submit(self._worker, dirPath)
+
+    def _isPoolIdle(self):
+        with self._lock:
+            return self._submitted - self._finished < self._maxWorkers
+
+    def _worker(self, dirPath):
+        try:
+            stack = [dirPath]
+            while len(stack) > 0 and not self._stopEvent.is_set():
+                batch = []
+                try:
+                    with os.scandir(stack.pop()) as it:
+                        for entry in it:
+                            if entry.path in self._pruneSet:
+                                continue
+                            if self._bStat:
+                                try:
+                                    entry.stat(follow_symlinks=False)
+                                except OSError:
+                                    continue                        # entry is removed
+                            batch.append(entry)
+                except OSError:
+                    continue
+
+                for entry in batch:
+                    try:
+                        bDir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if bDir:
+                        if len(stack) > 0 and self._isPoolIdle():
+                            self._submit(entry.path)
+                        else:
+                            stack.append(entry.path)
+                self._queue.put(batch)
+        finally:
+            self._queue.put(None)
@@ -7,23 +7,32 @@ import pwd
 import grp
 import glob
 import stat
-import time
 import ntplib
+import threading
 import struct
 import shutil
-import fnmatch
 import portage
 import filecmp
 import strict_pgs
 import strict_fsh
 from fm_util import FmUtil
 from fm_util import TmpMount
+from fm_util import MakeConf
 from fm_param import FmConst
 from helper_pkg_warehouse import PkgWarehouse
 from helper_pkg_warehouse import Ebuild2Dir
 from helper_pkg_warehouse import RepositoryCheckError
 from helper_pkg_warehouse import OverlayCheckError
 from helper_pkg_warehouse import Ebuild2CheckError
+from helper_pkg_integrity import PkgIntegrityVerifier
+from helper_pkg_file_index import PkgInstalledFileIndex
+from helper_kmod_index import KmodInfoIndex
+from helper_pattern_matcher import GlobPatternMatcher
+from helper_check_engine import CheckEngine
+from helper_disk_health import DiskHealthChecker
+from helper_tree_walker import TreeWalker
+from helper_path_resolver import PathResolver
+from helper_input_digest_cache import InputDigestCache
 from sys_storage_manager import FmStorageLayoutBiosSimple
 from sys_storage_manager import FmStorageLayoutBiosLvm
 from sys_storage_manager import FmStorageLayoutEfiSimple
@@ -48,8 +57,17 @@ class FmSysChecker:
         self.param = param
         self.infoPrinter = self.param.infoPrinter
         self.pkgwh = PkgWarehouse()
+        self.pkgVerifier = None
+        self.fileIndex = None
+        self.fileIndexLock = threading.Lock()
+        self.diskHealthChecker = None
         self.bAutoFix = False
 
+        self.pkgMd5IgnoreList = [
+            '/etc',
+            '/var',
+        ]
+
     def doPostCheck(self):
         # do Power On Self Test check
         self._checkMachineInfo()
@@ -61,128 +79,114 @@ class FmSysChecker:
         self._checkRepositories(bFullCheck=False)
         self._checkOverlays(bFullCheck=False)
 
-    def doSysCheck(self, bAutoFix, deepCheck):
+    def doSysCheck(self, bAutoFix, deepCheck, reportFile=None, reportFormat="json"):
         self.bAutoFix = bAutoFix
 
-        self.infoPrinter.printInfo(">> Check hardware...")
-        self.infoPrinter.incIndent()
-        self._checkHardware(deepCheck)
-        self.infoPrinter.decIndent()
-
-        self.infoPrinter.printInfo(">> Check storage layout...")
-        self.infoPrinter.incIndent()
-        self._checkItemStorageLayout()
-        self._checkItemFileSystemLayout()
-        self.infoPrinter.decIndent()
-
-        self.infoPrinter.printInfo(">> Check operating system...")
-        self.infoPrinter.incIndent()
-        try:
-            self.infoPrinter.printInfo("- Check system files...")
-            self.infoPrinter.incIndent()
-            try:
-                self._checkMachineInfo()
-                self._checkPureSystemFiles()
-                self._checkHostsFile()
-                self._checkPamCfgFiles()
-                self._checkLmSensorsCfgFiles()
-                self._checkEtcUdevRuleFiles()
-                self._checkServiceFiles()
-                # self._checkFirmware()
-                self._checkHomeDir()
-            finally:
-                self.infoPrinter.decIndent()
-
-            self.infoPrinter.printInfo("- Check %s directory..." % (FmConst.portageDataDir))
-            self.infoPrinter.incIndent()
-            try:
-                self._checkPortageDataDir()
-            finally:
-                self.infoPrinter.decIndent()
-
-            self.infoPrinter.printInfo("- Check %s directory..." % (FmConst.portageCacheDir))
-            self.infoPrinter.incIndent()
-            try:
-                self._checkPortageCacheDir()
-            finally:
-                self.infoPrinter.decIndent()
-
-            self.infoPrinter.printInfo("- Check %s directory..." % (FmConst.portageCfgDir))
-            self.infoPrinter.incIndent()
-            try:
-                self._checkPortageCfgMakeProfile()
-                self._checkPortageCfgDir()
-                self._checkPortageMakeConf()
-                self._checkPortageCfgReposDir()
-                self._checkPortageCfgMaskDir()
-                self._checkPortageCfgUnmaskDir()
-                self._checkPortageCfgUseDir()
-                self._checkPortageCfgAcceptKeywordDir()
-                self._checkPortageCfgLicDir()
-                self._checkPortageCfgEnvDir()
-                self._checkPortageCfgProvidedFile()
-                self._checkKernelMaskDir()
-                self._checkKernelUseDir()
-                self._checkCfgDispatchConfFile()
-            finally:
-                self.infoPrinter.decIndent()
-
-            self.infoPrinter.printInfo("- Check system configuration...")
-            self.infoPrinter.incIndent()
-            try:
-                self._checkSystemLocale()
-                # self._checkSystemServices()       # FIXME: seems not that simple
-                self._checkSystemTime()
-            finally:
-                self.infoPrinter.decIndent()
-        finally:
-            self.infoPrinter.decIndent()
-
-        self.infoPrinter.printInfo(">> Check package repositoryies & overlays...")
-        self.infoPrinter.incIndent()
-        try:
-            self._checkPkgWarehouse()
-            self._checkRepositories()
-            self._checkOverlays()
-            self._checkEbuild2Dir()
-        finally:
-            self.infoPrinter.decIndent()
+        # checks that have "bMutating=True" modify the system when auto-fix is enabled
+        engine = CheckEngine(self.param.infoPrinter)
 
-        self.infoPrinter.printInfo(">> Check users and groups...")
-        self.infoPrinter.incIndent()
-        try:
-            self._checkUsersAndGroups()
-        finally:
-            self.infoPrinter.decIndent()
+        engine.beginGroup(">> Check hardware...")
+        engine.addCheck("hardware", lambda: self._checkHardware(deepCheck))
+        engine.endGroup()
 
-        self.infoPrinter.printInfo(">> Do per-package check...")
-        self.infoPrinter.incIndent()
-        try:
-            for pkgNameVer in sorted(FmUtil.getFileList(FmConst.portageDbDir, 2, "d")):
-                if FmUtil.repoIsSysFile(pkgNameVer):
-                    continue
-                if pkgNameVer.split("/")[1].startswith("-MERGING"):
-                    continue
-                self.infoPrinter.startPrintByError()
-                self.infoPrinter.printInfo("- Package %s:" % (pkgNameVer))
-                self.infoPrinter.incIndent()
-                try:
-                    self._checkPackageContentFile(pkgNameVer)
-                    self._checkPackageFileScope(pkgNameVer)
-                    self._checkPakcageMd5(pkgNameVer)
-                    self._checkPkgEbuild2(pkgNameVer)
-                finally:
-                    self.infoPrinter.decIndent()
-                    self.infoPrinter.endPrintByError()
-        finally:
-            self.infoPrinter.decIndent()
+        engine.beginGroup(">> Check storage layout...")
+        engine.addCheck("storage-layout", self._checkItemStorageLayout, bMutating=True)
+        engine.addCheck("file-system-layout", self._checkItemFileSystemLayout, depends=["storage-layout"], bMutating=True)
+        engine.endGroup()
 
-        self.infoPrinter.printInfo(">> Find system cruft files...")
-        self.infoPrinter.incIndent()
+        engine.beginGroup(">> Check operating system...")
+        if True:
+            engine.beginGroup("- Check system files...")
+            engine.addCheck("machine-info", self._checkMachineInfo)
+            engine.addCheck("pure-system-files", self._checkPureSystemFiles, bMutating=True)
+            engine.addCheck("hosts-file", self._checkHostsFile, bMutating=True)
+            engine.addCheck("pam-cfg-files", self._checkPamCfgFiles)
+            engine.addCheck("lm-sensors-cfg-files", self._checkLmSensorsCfgFiles)
+            engine.addCheck("etc-udev-rule-files", self._checkEtcUdevRuleFiles)
+            engine.addCheck("service-files", self._checkServiceFiles)
+            engine.addCheck("firmware", self._checkFirmware)
+            engine.addCheck("home-dir", self._checkHomeDir, bMutating=True)
+            engine.endGroup()
+
+            engine.beginGroup("- Check %s directory..." % (FmConst.portageDataDir))
+            engine.addCheck("portage-data-dir", self._checkPortageDataDir, bMutating=True)
+            engine.endGroup()
+
+            engine.beginGroup("- Check %s directory..." % (FmConst.portageCacheDir))
+            engine.addCheck("portage-cache-dir", self._checkPortageCacheDir, bMutating=True)
+            engine.endGroup()
+
+            # these checks share symlink fixing state, so they are run one by one
+            engine.beginGroup("- Check %s directory..." % (FmConst.portageCfgDir))
+            last = None
+            for name, func, bMutating in [
+                ("portage-cfg-make-profile", self._checkPortageCfgMakeProfile, False),
+                ("portage-cfg-dir", self._checkPortageCfgDir, True),
+                ("portage-make-conf", self._checkPortageMakeConf, True),
+                ("portage-cfg-repos-dir", self._checkPortageCfgReposDir, True),
+                ("portage-cfg-mask-dir", self._checkPortageCfgMaskDir, True),
+                ("portage-cfg-unmask-dir", self._checkPortageCfgUnmaskDir, True),
+                ("portage-cfg-use-dir", self._checkPortageCfgUseDir, True),
+                ("portage-cfg-accept-keyword-dir", self._checkPortageCfgAcceptKeywordDir, True),
+                ("portage-cfg-lic-dir", self._checkPortageCfgLicDir, True),
+                ("portage-cfg-env-dir", self._checkPortageCfgEnvDir, True),
+                ("portage-cfg-provided-file", self._checkPortageCfgProvidedFile, True),
+                ("kernel-mask-dir", self._checkKernelMaskDir, True),
+                ("kernel-use-dir", self._checkKernelUseDir, True),
+                ("cfg-dispatch-conf-file", self._checkCfgDispatchConfFile, True),
+            ]:
+                engine.addCheck(name, func, depends=([last] if last is not None else []), bMutating=bMutating)
+                last = name
+            engine.endGroup()
+
+            engine.beginGroup("- Check system configuration...")
+            engine.addCheck("system-locale", self._checkSystemLocale, bMutating=True)
+            # engine.addCheck("system-services", self._checkSystemServices)       # FIXME: seems not that simple
+            engine.addCheck("system-time", self._checkSystemTime)
+            engine.endGroup()
+        engine.endGroup()
+
+        # the portage dbapi and the ebuild2 check scripts exec()-ed in process are not thread safe, so the checks using
+        # them are chained: portage-cfg-use-dir -> pkg-warehouse -> repositories -> overlays -> ebuild2-dir -> packages
+        engine.beginGroup(">> Check package repositoryies & overlays...")
+        engine.addCheck("pkg-warehouse", self._checkPkgWarehouse, depends=["portage-cfg-repos-dir", "portage-cfg-use-dir"], bMutating=True)
+        engine.addCheck("repositories", self._checkRepositories, depends=["pkg-warehouse"], bMutating=True)
+        engine.addCheck("overlays", self._checkOverlays, depends=["repositories"], bMutating=True)
+        engine.addCheck("ebuild2-dir", self._checkEbuild2Dir, depends=["overlays"])
+        engine.endGroup()
+
+        engine.beginGroup(">> Check users and groups...")
+        engine.addCheck("users-and-groups", self._checkUsersAndGroups, bMutating=True)
+        engine.endGroup()
+
+        engine.beginGroup(">> Do per-package check...")
+        engine.addCheck("packages", self._checkPackages, depends=["ebuild2-dir"], bMutating=True)
+        engine.endGroup()
+
+        engine.beginGroup(">> Find system cruft files...")
+        engine.addCheck("system-cruft", self._checkItemSystemCruft)
+        engine.endGroup()
+
+        if deepCheck:
+            # the self-tests started by the hardware check run while the other checks run
+            engine.beginGroup(">> Wait for hardware self-tests...")
+            engine.addCheck("hardware-self-test", self._checkHardwareSelfTest, depends=["hardware"], cancelFunc=self._cancelHardwareSelfTest)
+            engine.endGroup()
+
+        # must be done before the engine starts its threads
+        self.pkgwh.prepareRepoIndexes()
+
+        self.infoPrinter = engine.printer
         try:
-            self._checkItemSystemCruft()
+            engine.run(bAutoFix)
         finally:
-            self.infoPrinter.decIndent()
+            self.infoPrinter = self.param.infoPrinter
+            if self.diskHealthChecker is not None:
+                self.diskHealthChecker.abortSelfTests()
+                self.diskHealthChecker = None
+            if reportFile is not None:
+                engine.writeReport(reportFile, reportFormat)
+        return engine.getResultList()
 
     def _checkHardware(self, deepCheck):
         tlist = FmUtil.getDevPathListForFixedHdd()
@@ -190,65 +194,48 @@ class FmSysChecker:
             self.infoPrinter.printError("No hard disk?!")
             return
 
+        self.diskHealthChecker = DiskHealthChecker()
+
         # hardware check
         if not deepCheck:
-            for hdd in tlist:
+            for hdd, bOk in zip(tlist, self.diskHealthChecker.checkHealth(tlist)):
                 self.infoPrinter.printInfo("- Doing basic hardware check for %s(%s)" % (hdd, FmUtil.getBlkDevModel(hdd)))
                 self.infoPrinter.incIndent()
-                rc, out = FmUtil.cmdCallWithRetCode("/usr/sbin/smartctl", "-H", hdd)
-                if re.search("failure", out, re.I) is not None:
-                    self.infoPrinter.printError("HDD health check failed! Run \"smartctl -H %s\" to do future inspection!" % (hdd))
+                if not bOk:
+                    self.infoPrinter.printError("HDD health check failed! Run \"smartctl -H %s\" to do future inspection!" % (hdd), path=hdd)
                 self.infoPrinter.decIndent()
         else:
-            self.infoPrinter.printInfo("- Starting extensive hardware test for %s(%s)" % (hdd, FmUtil.getBlkDevModel(hdd)))
+            # long self-tests are started on all the disks, they are waited by _checkHardwareSelfTest()
+            self.infoPrinter.printInfo("- Starting extensive hardware test...")
             self.infoPrinter.incIndent()
-            tlist2 = list(tlist)
-            for hdd in tlist:
-                try:
-                    rc, out = FmUtil.cmdCallWithRetCode("/usr/sbin/smartctl", "-t", "long", hdd)
-                    if rc == 0:
-                        m = re.search("Please wait ([0-9]+) minutes for test to complete\\.", out, re.M)
-                        if m is None:
-                            raise Exception("")
-                        self.infoPrinter.printInfo("Test on %s(%s) started, %s minutes needed." % (hdd, FmUtil.getBlkDevModel(hdd), m.group(1)))
-                    elif rc == 4:
-                        self.infoPrinter.printInfo("Test on %s(%s) started. Why it is already in progress?" % (hdd, FmUtil.getBlkDevModel(hdd)))
-                    else:
-                        raise Exception("")
-                except:
-                    self.infoPrinter.printError("Failed to start test on %s(%s)!" % (hdd, FmUtil.getBlkDevModel(hdd)))
-                    FmUtil.cmdCallIgnoreResult("/usr/sbin/smartctl", "-X", hdd)
-                    tlist2.remove(hdd)
+            for test in self.diskHealthChecker.startSelfTests(tlist):
+                if test.status != "running":
+                    self.infoPrinter.printError("Failed to start test on %s(%s)!" % (test.hdd, FmUtil.getBlkDevModel(test.hdd)), path=test.hdd)
+                elif test.bAlreadyRunning:
+                    self.infoPrinter.printInfo("Test on %s(%s) started. Why it is already in progress?" % (test.hdd, FmUtil.getBlkDevModel(test.hdd)))
+                else:
+                    self.infoPrinter.printInfo("Test on %s(%s) started, %d minutes needed." % (test.hdd, FmUtil.getBlkDevModel(test.hdd), test.minutes))
             self.infoPrinter.decIndent()
 
-            try:
-                self.infoPrinter.printInfo("- Waiting...")
-                self.infoPrinter.incIndent()
-                last_progress = 0
-                while tlist2 != []:
-                    time.sleep(60 * 5)
-                    min_progress = None
-                    for hdd in list(tlist2):
-                        out = FmUtil.cmdCall("/usr/sbin/smartctl", "-l", "selftest", hdd)
-                        if re.search("# 1\\s+Extended offline\\s+Completed without error\\s+.*", out, re.M) is not None:
-                            self.infoPrinter.printInfo("Test on %s finished." % (hdd))
-                            tlist2.remove(hdd)
-                            continue
-                        m = re.search("# 1\\s+Extended offline\\s+Self-test routine in progress\\s+([0-9]+)%.*", out, re.M)
-                        if m is None:
-                            self.infoPrinter.printInfo("Test on %s failed. Run \"smartctl -l selftest %s\" to do future inspection." % (hdd, hdd))
-                            tlist2.remove(hdd)
-                            continue
-                        if min_progress is None:
-                            min_progress = 100
-                        min_progress = min(min_progress, 100 - int(m.group(1)))
-                    if min_progress is not None and min_progress > last_progress:
-                        self.infoPrinter.printInfo("Test progress: %d%%" % (min_progress))
-                        last_progress = min_progress
-                self.infoPrinter.decIndent()
-            finally:
-                for hdd in tlist2:
-                    FmUtil.cmdCallIgnoreResult("/usr/sbin/smartctl", "-X", hdd)
+    def _checkHardwareSelfTest(self):
+        if self.diskHealthChecker is None or not self.diskHealthChecker.hasRunningSelfTest():
+            return
+
+        def _testEnd(test):
+            if test.status == "passed":
+                self.infoPrinter.printInfo("Test on %s finished." % (test.hdd))
+            else:
+                self.infoPrinter.printError("Test on %s failed. Run \"smartctl -l selftest %s\" to do future inspection." % (test.hdd, test.hdd), path=test.hdd)
+
+        self.infoPrinter.printInfo("- Waiting...")
+        self.infoPrinter.incIndent()
+        self.diskHealthChecker.waitSelfTests(_testEnd, lambda progress: self.infoPrinter.printInfo("Test progress: %d%%" % (progress)))
+        self.infoPrinter.decIndent()
+
+    def _cancelHardwareSelfTest(self):
+        diskHealthChecker = self.diskHealthChecker
+        if diskHealthChecker is not None:
+            diskHealthChecker.abortSelfTests()
 
     def _checkItemStorageLayout(self):
         tlist = FmUtil.getDevPathListForFixedHdd()
@@ -421,13 +408,13 @@ class FmSysChecker:
         with TmpMount(layout.getRootDev()) as mp:
             # check /
             if os.stat("/").st_mode != 0o40755:
-                self.infoPrinter.printError("Incorrect mode for \"/\" directory.")
+                self.infoPrinter.printError("Incorrect mode for \"/\" directory.", path="/")
 
             # check /boot
             if layout.isReady() and layout.getType() == "efi":
                 ret = os.listdir(os.path.join(mp.mountpoint, "boot"))
                 if not (ret == [] or ret == [".keep"]):
-                    self.infoPrinter.printError("The original \"/boot\" directory should be empty.")
+                    self.infoPrinter.printError("The original \"/boot\" directory should be empty.", path="/boot")
 
             # check /etc/fstab
             # FIXME
@@ -435,12 +422,12 @@ class FmSysChecker:
                 with open(os.path.join(mp.mountpoint, "etc", "fstab"), "r") as f:
                     for line in f.read().split("\n"):
                         if not line.startswith("#") and line.strip() != "":
-                            self.infoPrinter.printError("/etc/fstab should not exist.")
+                            self.infoPrinter.printError("/etc/fstab should not exist.", path="/etc/fstab")
 
             # check /etc/sysctl.conf
             # FIXME
             if os.path.exists(os.path.join(mp.mountpoint, "etc", "sysctl.conf")):
-                self.infoPrinter.printError("/etc/sysctl.conf should not exist.")
+                self.infoPrinter.printError("/etc/sysctl.conf should not exist.", path="/etc/sysctl.conf")
 
             # check /dev
             ret = set()
@@ -453,7 +440,7 @@ class FmSysChecker:
                     for fn in ret:
                         FmUtil.forceDelete(os.path.join(mp.mountpoint, "dev", fn))
                 else:
-                    self.infoPrinter.printError("The original \"/dev\" directory should contain only \"console\", \"null\" and \"tty\".")
+                    self.infoPrinter.printError("The original \"/dev\" directory should contain only \"console\", \"null\" and \"tty\".", path="/dev", bAutoFixable=True)
             # if FmUtil.getMajorMinor(os.path.join(mp.mountpoint, "dev", "console")) != (5, 1):
             #     raise Exception("/dev/console should have major number 5 and minor number 1")
             # if FmUtil.getMajorMinor(os.path.join(mp.mountpoint, "dev", "null")) != (1, 3):
@@ -464,17 +451,17 @@ class FmSysChecker:
             # check /usr/local
             # FIXME
             if os.path.exists(os.path.join(mp.mountpoint, "usr", "local")):
-                self.infoPrinter.printError("/usr/local should not existv")
+                self.infoPrinter.printError("/usr/local should not existv", path="/usr/local")
 
             # check /srv
             # FIXME
             if os.path.exists(os.path.join(mp.mountpoint, "srv")):
-                self.infoPrinter.printError("/srv should not exist.")
+                self.infoPrinter.printError("/srv should not exist.", path="/srv")
 
             # check /tmp
             ret = os.listdir(os.path.join(mp.mountpoint, "tmp"))
             if not (ret == [] or ret == [".keep"]):
-                self.infoPrinter.printError("The original \"/tmp\" directory should be empty.")
+                self.infoPrinter.printError("The original \"/tmp\" directory should be empty.", path="/tmp")
 
             # check all files for:
             # 1. broken link
@@ -495,19 +482,19 @@ class FmSysChecker:
                         else:
                             m = os.stat(fulldn).st_mode
                             if not (m & stat.S_IRUSR):
-                                self.infoPrinter.printError("Directory \"%s\" is not readable by owner." % (showdn))
+                                self.infoPrinter.printError("Directory \"%s\" is not readable by owner." % (showdn), path=showdn)
                             if not (m & stat.S_IWUSR):
-                                self.infoPrinter.printError("Directory \"%s\" is not writeable by owner." % (showdn))
+                                self.infoPrinter.printError("Directory \"%s\" is not writeable by owner." % (showdn), path=showdn)
                             if not (m & stat.S_IRGRP) and (m & stat.S_IWGRP):
-                                self.infoPrinter.printError("Directory \"%s\" is not readable but writable by group." % (showdn))
+                                self.infoPrinter.printError("Directory \"%s\" is not readable but writable by group." % (showdn), path=showdn)
                             if not (m & stat.S_IROTH) and (m & stat.S_IWOTH):
-                                self.infoPrinter.printError("Directory \"%s\" is not readable but writable by other." % (showdn))
+                                self.infoPrinter.printError("Directory \"%s\" is not readable but writable by other." % (showdn), path=showdn)
                             if not (m & stat.S_IRGRP) and ((m & stat.S_IROTH) or (m & stat.S_IWOTH)):
-                                self.infoPrinter.printError("Directory \"%s\" is not readable by group but readable/writable by other." % (showdn))
+                                self.infoPrinter.printError("Directory \"%s\" is not readable by group but readable/writable by other." % (showdn), path=showdn)
                             if not (m & stat.S_IWGRP) and (m & stat.S_IWOTH):
-                                self.infoPrinter.printError("Directory \"%s\" is not writable by group but writable by other." % (showdn))
+                                self.infoPrinter.printError("Directory \"%s\" is not writable by group but writable by other." % (showdn), path=showdn)
                             if m & stat.S_ISUID:
-                                self.infoPrinter.printError("Directory \"%s\" should not have SUID bit set." % (showdn))
+                                self.infoPrinter.printError("Directory \"%s\" should not have SUID bit set." % (showdn), path=showdn)
                             if m & stat.S_ISGID:
                                 # if showdn.startswith("/var/lib/portage"):
                                 #     pass        # FIXME, portage set SGID for these directories?
@@ -532,18 +519,18 @@ class FmSysChecker:
                         else:
                             m = os.stat(fullfn).st_mode
                             if not (m & stat.S_IRUSR):
-                                self.infoPrinter.printError("File \"%s\" is not readable by owner." % (showfn))
+                                self.infoPrinter.printError("File \"%s\" is not readable by owner." % (showfn), path=showfn)
                             # if not (m & stat.S_IWUSR):
                             #     FIXME: strange that many file has this problem
                             #     self.infoPrinter.printError("File \"%s\" is not writeable by owner." % (showfn))
                             if not (m & stat.S_IRGRP) and (m & stat.S_IWGRP):
-                                self.infoPrinter.printError("File \"%s\" is not readable but writable by group." % (showfn))
+                                self.infoPrinter.printError("File \"%s\" is not readable but writable by group." % (showfn), path=showfn)
                             if not (m & stat.S_IROTH) and (m & stat.S_IWOTH):
-                                self.infoPrinter.printError("File \"%s\" is not readable but writable by other." % (showfn))
+                                self.infoPrinter.printError("File \"%s\" is not readable but writable by other." % (showfn), path=showfn)
                             if not (m & stat.S_IRGRP) and ((m & stat.S_IROTH) or (m & stat.S_IWOTH)):
-                                self.infoPrinter.printError("File \"%s\" is not readable by group but readable/writable by other." % (showfn))
+                                self.infoPrinter.printError("File \"%s\" is not readable by group but readable/writable by other." % (showfn), path=showfn)
                             if not (m & stat.S_IWGRP) and (m & stat.S_IWOTH):
-                                self.infoPrinter.printError("File \"%s\" is not writable by group but writable by other." % (showfn))
+                                self.infoPrinter.printError("File \"%s\" is not writable by group but writable by other." % (showfn), path=showfn)
                             if (m & stat.S_ISUID):
                                 bad = False
                                 if not (m & stat.S_IXUSR):
@@ -553,7 +540,7 @@ class FmSysChecker:
                                 if not (m & stat.S_IXOTH) and ((m & stat.S_IROTH) or (m & stat.S_IWOTH)):
                                     bad = True
                                 if bad:
-                                    self.infoPrinter.printError("File \"%s\" is not a good executable, but has SUID bit set." % (showfn))
+                                    self.infoPrinter.printError("File \"%s\" is not a good executable, but has SUID bit set." % (showfn), path=showfn)
                             if m & stat.S_ISGID:
                                 # self.infoPrinter.printError("File \"%s\" should not have SGID bit set." % (showfn))
                                 pass            # FIXME
@@ -570,7 +557,7 @@ class FmSysChecker:
                 with open("/etc/hosts", "w") as f:
                     f.write(content)
             else:
-                self.infoPrinter.printError("File /etc/hosts has invalid content.")
+                self.infoPrinter.printError("File /etc/hosts has invalid content.", path="/etc/hosts", bAutoFixable=True)
 
     def _checkPamCfgFiles(self):
         # FIXME: change to INSTALL_MASK?
@@ -593,11 +580,11 @@ class FmSysChecker:
                         continue
                     mod = modArgs.split(" ")[0]
                     if not os.path.exists("/lib64/security/" + mod):
-                        self.infoPrinter.printError("Non-exist module \"%s\" in PAM config file \"%s\"." % (mod, fullfn))
+                        self.infoPrinter.printError("Non-exist module \"%s\" in PAM config file \"%s\"." % (mod, fullfn), path=fullfn)
                     if mod in modBlackList:
-                        self.infoPrinter.printError("Prohibited module \"%s\" in PAM config file \"%s\"." % (mod, fullfn))
+                        self.infoPrinter.printError("Prohibited module \"%s\" in PAM config file \"%s\"." % (mod, fullfn), path=fullfn)
                     if modIntf.replace("-", "") not in FmUtil.pamGetModuleTypesProvided(mod):
-                        self.infoPrinter.printError("Module \"%s\" is not suitable for %s in PAM config file \"%s\"." % (mod, modIntf, fullfn))
+                        self.infoPrinter.printError("Module \"%s\" is not suitable for %s in PAM config file \"%s\"." % (mod, modIntf, fullfn), path=fullfn)
 
             # check order
             # FIXME
@@ -606,31 +593,31 @@ class FmSysChecker:
                 for ctrlFlag, modArgs in items:
                     if ctrlFlag == "include":
                         if not (ctrlFlagCur is None or ctrlFlagCur == "include"):
-                            self.infoPrinter.printError("Inappropriate \"include\" control flag order in PAM config file \"%s\"." % (fullfn))
+                            self.infoPrinter.printError("Inappropriate \"include\" control flag order in PAM config file \"%s\"." % (fullfn), path=fullfn)
                     if ctrlFlag != "optional" and ctrlFlagCur == "optional":
-                        self.infoPrinter.printError("Inappropriate \"optional\" control flag order in PAM config file \"%s\"." % (fullfn))
+                        self.infoPrinter.printError("Inappropriate \"optional\" control flag order in PAM config file \"%s\"." % (fullfn), path=fullfn)
                     ctrlFlagCur = ctrlFlag
 
     def _checkLmSensorsCfgFiles(self):
         fn = "/etc/modules-load.d/lm_sensors.conf"
         if not os.path.exists(fn):
-            self.infoPrinter.printError("You should use \"sensors-detect\" command from package \"sys-apps/lm-sensors\" to generate \"%s\"." % (fn))
+            self.infoPrinter.printError("You should use \"sensors-detect\" command from package \"sys-apps/lm-sensors\" to generate \"%s\"." % (fn), path=fn)
 
     def _checkEtcUdevRuleFiles(self):
         # check /etc/udev/hwdb.d
         hwdbDir = "/etc/udev/hwdb.d"
         if not os.path.exists(hwdbDir):
-            self.infoPrinter.printError("\"%s\" does not exist." % (hwdbDir))
+            self.infoPrinter.printError("\"%s\" does not exist." % (hwdbDir), path=hwdbDir)
         else:
             for fn in os.listdir(hwdbDir):
                 if fn.startswith("."):
                     continue
-                self.infoPrinter.printError("\"%s\" should not exist." % (os.path.join(hwdbDir, fn)))
+                self.infoPrinter.printError("\"%s\" should not exist." % (os.path.join(hwdbDir, fn)), path=os.path.join(hwdbDir, fn))
 
         # check /etc/udev/rules.d
         rulesDir = "/etc/udev/rules.d"
         if not os.path.exists(rulesDir):
-            self.infoPrinter.printError("\"%s\" does not exist." % (rulesDir))
+            self.infoPrinter.printError("\"%s\" does not exist." % (rulesDir), path=rulesDir)
         else:
             for fn in os.listdir(rulesDir):
                 fullfn = os.path.join(rulesDir, fn)
@@ -651,10 +638,10 @@ class FmSysChecker:
                                 firstLineTagName = m.group(1)
                             break
                     if firstLineNo == -1:
-                        self.infoPrinter.printError("No valid line in \"%s\"." % (fullfn))
+                        self.infoPrinter.printError("No valid line in \"%s\"." % (fullfn), path=fullfn)
                         continue
                     if firstLineTagName is None:
-                        self.infoPrinter.printError("Line %d is invalid in \"%s\"." % (firstLineNo + 1, fullfn))
+                        self.infoPrinter.printError("Line %d is invalid in \"%s\"." % (firstLineNo + 1, fullfn), path=fullfn)
                         continue
 
                     # find and check last line
@@ -666,7 +653,7 @@ class FmSysChecker:
                                 lastLineNo = i
                             break
                     if lastLineNo == -1:
-                        self.infoPrinter.printError("No valid end line in \"%s\"." % (fullfn))
+                        self.infoPrinter.printError("No valid end line in \"%s\"." % (fullfn), path=fullfn)
                         continue
 
                     # check middle lines
@@ -675,10 +662,10 @@ class FmSysChecker:
                         line = lineList[i]
                         if line != "" and not line.startswith("#"):
                             if re.fullmatch(pat, line) is None:
-                                self.infoPrinter.printError("Line %d is invalid in \"%s\"." % (i + 1, fullfn))
+                                self.infoPrinter.printError("Line %d is invalid in \"%s\"." % (i + 1, fullfn), path=fullfn)
                                 break
                 else:
-                    self.infoPrinter.printError("\"%s\" should not exist." % (fullfn))
+                    self.infoPrinter.printError("\"%s\" should not exist." % (fullfn), path=fullfn)
 
     def _checkServiceFiles(self):
         mustEnableServiceList = [
@@ -696,28 +683,27 @@ class FmSysChecker:
                 self.infoPrinter.printError("\"%s\" is not enabled." % (s))
 
     def _checkFirmware(self):
-        processedList = []
+        # the firmware requirement manifest of each kernel is kept by KmodInfoIndex, only changed modules are read again
+        if not os.path.exists("/lib/modules"):
+            return
+
+        processedSet = set()
         for ver in sorted(os.listdir("/lib/modules"), reverse=True):
-            verDir = os.path.join("/lib/modules", ver)
-            for fullfn in glob.glob(os.path.join(verDir, "**", "*.ko"), recursive=True):
-                # python-kmod bug: can only recognize the last firmware in modinfo
-                # so use the command output of modinfo directly
-                for line in FmUtil.cmdCall("/bin/modinfo", fullfn).split("\n"):
-                    m = re.fullmatch("firmware: +(\\S.*)", line)
-                    if m is None:
-                        continue
-                    firmwareName = m.group(1)
-                    if firmwareName in processedList:
-                        continue
-                    if not os.path.exists(os.path.join("/lib/firmware", firmwareName)):
-                        self.infoPrinter.printError("Firmware \"%s\" does not exist. (required by \"%s\")" % (firmwareName, fullfn))
-                    processedList.append(firmwareName)
+            kmodIndex = KmodInfoIndex(os.path.join("/lib/modules", ver))
+            for firmwareName, moduleList in kmodIndex.getFirmwareDict().items():
+                if firmwareName in processedSet:
+                    continue
+                processedSet.add(firmwareName)
+                # kernel can load compressed firmware files
+                if not any(os.path.exists(os.path.join("/lib/firmware", firmwareName + x)) for x in ["", ".xz", ".zst"]):
+                    self.infoPrinter.printError("Firmware \"%s\" does not exist. (required by \"%s\")" % (firmwareName, moduleList[0]), path=os.path.join("/lib/firmware", firmwareName))
+            kmodIndex.save()
 
     def _checkHomeDir(self):
         """Check /home"""
 
         if not os.path.exists("/home"):
-            self.infoPrinter.printError("\"/home\" does not exist.")
+            self.infoPrinter.printError("\"/home\" does not exist.", path="/home")
         else:
             for fn in os.listdir("/home"):
                 if fn == ".keep":
@@ -728,11 +714,11 @@ class FmSysChecker:
                     if self.bAutoFix:
                         os.chmod(fullfn, 0o40700)
                     else:
-                        self.infoPrinter.printError("Invalid permission for directory \"%s\"." % (fullfn))
+                        self.infoPrinter.printError("Invalid permission for directory \"%s\"." % (fullfn), path=fullfn, bAutoFixable=True)
                 if pwd.getpwuid(s.st_uid).pw_name != fn:
-                    self.infoPrinter.printError("Invalid owner for directory \"%s\"." % (fullfn))
+                    self.infoPrinter.printError("Invalid owner for directory \"%s\"." % (fullfn), path=fullfn)
                 if grp.getgrgid(s.st_gid).gr_name != fn:
-                    self.infoPrinter.printError("Invalid owner group for directory \"%s\"." % (fullfn))
+                    self.infoPrinter.printError("Invalid owner group for directory \"%s\"." % (fullfn), path=fullfn)
 
     def _checkPortageDataDir(self):
         """Check /var/lib/portage"""
@@ -817,80 +803,81 @@ class FmSysChecker:
     def _checkPortageMakeConf(self):
         """Check make.conf"""
 
-        # check CHOST variable
-        if True:
-            chost = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "CHOST")
-            if chost != "":
-                raise FmCheckException("variable CHOST should not exist in %s" % (FmConst.portageCfgMakeConf))
-
-        # check/fix ACCEPT_LICENSE variable
-        if FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "ACCEPT_LICENSE") != "*":
-            if self.bAutoFix:
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "ACCEPT_LICENSE", "*")
-            else:
-                raise FmCheckException("invalid value of variable ACCEPT_LICENSE in %s" % (FmConst.portageCfgMakeConf))
-
-        # check/fix DISTDIR variable
-        if FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "DISTDIR") != FmConst.distDir:
-            if self.bAutoFix:
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "DISTDIR", FmConst.distDir)
-            else:
-                raise FmCheckException("invalid value of variable DISTDIR in %s" % (FmConst.portageCfgMakeConf))
+        with MakeConf(FmConst.portageCfgMakeConf) as makeConf:
+            # check CHOST variable
+            if True:
+                chost = makeConf.get("CHOST")
+                if chost != "":
+                    raise FmCheckException("variable CHOST should not exist in %s" % (FmConst.portageCfgMakeConf))
 
-        # check ACCEPT_KEYWORDS variable
-        if True:
-            keywordList = ["~%s" % (x) for x in self.pkgwh.getKeywordList()]
-            tlist = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "ACCEPT_KEYWORDS").split(" ")
-            if set(tlist) != set(keywordList):
+            # check/fix ACCEPT_LICENSE variable
+            if makeConf.get("ACCEPT_LICENSE") != "*":
                 if self.bAutoFix:
-                    FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "ACCEPT_KEYWORDS", " ".join(keywordList))
+                    makeConf.set("ACCEPT_LICENSE", "*")
                 else:
-                    raise Exception("invalid value of variable ACCEPT_KEYWORDS in %s" % (FmConst.portageCfgMakeConf))
+                    raise FmCheckException("invalid value of variable ACCEPT_LICENSE in %s" % (FmConst.portageCfgMakeConf))
 
-        # check/fix EMERGE_DEFAULT_OPTS variable
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS")
-        if re.search("--quiet-build\\b", value) is None:
-            if self.bAutoFix:
-                value += " --quiet-build"
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS", value.lstrip())
-            else:
-                raise FmCheckException("variable EMERGE_DEFAULT_OPTS in %s should contain --quiet-build argument" % (FmConst.portageCfgMakeConf))
-        value = FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS")
-        if True:
-            m = re.search("--backtrack(=([0-9]+))?\\b", value)
-            if m is None:
+            # check/fix DISTDIR variable
+            if makeConf.get("DISTDIR") != FmConst.distDir:
                 if self.bAutoFix:
-                    value += " --backtrack=%d" % (30)
-                    FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS", value.lstrip())
+                    makeConf.set("DISTDIR", FmConst.distDir)
                 else:
-                    raise FmCheckException("variable EMERGE_DEFAULT_OPTS in %s should contain --backtrack argument" % (FmConst.portageCfgMakeConf))
-            elif m.group(2) is None or int(m.group(2)) < 30:
+                    raise FmCheckException("invalid value of variable DISTDIR in %s" % (FmConst.portageCfgMakeConf))
+
+            # check ACCEPT_KEYWORDS variable
+            if True:
+                keywordList = ["~%s" % (x) for x in self.pkgwh.getKeywordList()]
+                tlist = makeConf.get("ACCEPT_KEYWORDS").split(" ")
+                if set(tlist) != set(keywordList):
+                    if self.bAutoFix:
+                        makeConf.set("ACCEPT_KEYWORDS", " ".join(keywordList))
+                    else:
+                        raise Exception("invalid value of variable ACCEPT_KEYWORDS in %s" % (FmConst.portageCfgMakeConf))
+
+            # check/fix EMERGE_DEFAULT_OPTS variable
+            value = makeConf.get("EMERGE_DEFAULT_OPTS")
+            if re.search("--quiet-build\\b", value) is None:
                 if self.bAutoFix:
-                    value = value.replace(m.group(0), "--backtrack=%d" % (30))
-                    FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "EMERGE_DEFAULT_OPTS", value)
+                    value += " --quiet-build"
+                    makeConf.set("EMERGE_DEFAULT_OPTS", value.lstrip())
                 else:
-                    raise FmCheckException("variable EMERGE_DEFAULT_OPTS in %s has an inappropriate --backtrack argument" % (FmConst.portageCfgMakeConf))
+                    raise FmCheckException("variable EMERGE_DEFAULT_OPTS in %s should contain --quiet-build argument" % (FmConst.portageCfgMakeConf))
+            value = makeConf.get("EMERGE_DEFAULT_OPTS")
+            if True:
+                m = re.search("--backtrack(=([0-9]+))?\\b", value)
+                if m is None:
+                    if self.bAutoFix:
+                        value += " --backtrack=%d" % (30)
+                        makeConf.set("EMERGE_DEFAULT_OPTS", value.lstrip())
+                    else:
+                        raise FmCheckException("variable EMERGE_DEFAULT_OPTS in %s should contain --backtrack argument" % (FmConst.portageCfgMakeConf))
+                elif m.group(2) is None or int(m.group(2)) < 30:
+                    if self.bAutoFix:
+                        value = value.replace(m.group(0), "--backtrack=%d" % (30))
+                        makeConf.set("EMERGE_DEFAULT_OPTS", value)
+                    else:
+                        raise FmCheckException("variable EMERGE_DEFAULT_OPTS in %s has an inappropriate --backtrack argument" % (FmConst.portageCfgMakeConf))
 
-        # check/fix GENTOO_DEFAULT_MIRROR variable
-        if FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "GENTOO_DEFAULT_MIRROR") != FmConst.defaultGentooMirror:
-            if self.bAutoFix:
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "GENTOO_DEFAULT_MIRROR", FmConst.defaultGentooMirror)
-            else:
-                raise FmCheckException("variable GENTOO_DEFAULT_MIRROR in %s does not exist or has invalid value" % (FmConst.portageCfgMakeConf))
+            # check/fix GENTOO_DEFAULT_MIRROR variable
+            if makeConf.get("GENTOO_DEFAULT_MIRROR") != FmConst.defaultGentooMirror:
+                if self.bAutoFix:
+                    makeConf.set("GENTOO_DEFAULT_MIRROR", FmConst.defaultGentooMirror)
+                else:
+                    raise FmCheckException("variable GENTOO_DEFAULT_MIRROR in %s does not exist or has invalid value" % (FmConst.portageCfgMakeConf))
 
-        # check/fix RSYNC_DEFAULT_MIRROR variable
-        if FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "RSYNC_DEFAULT_MIRROR") != FmConst.defaultRsyncMirror:
-            if self.bAutoFix:
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "RSYNC_DEFAULT_MIRROR", FmConst.defaultRsyncMirror)
-            else:
-                raise FmCheckException("variable RSYNC_DEFAULT_MIRROR in %s does not exist or has invalid value" % (FmConst.portageCfgMakeConf))
+            # check/fix RSYNC_DEFAULT_MIRROR variable
+            if makeConf.get("RSYNC_DEFAULT_MIRROR") != FmConst.defaultRsyncMirror:
+                if self.bAutoFix:
+                    makeConf.set("RSYNC_DEFAULT_MIRROR", FmConst.defaultRsyncMirror)
+                else:
+                    raise FmCheckException("variable RSYNC_DEFAULT_MIRROR in %s does not exist or has invalid value" % (FmConst.portageCfgMakeConf))
 
-        # check/fix KERNEL_DEFAULT_MIRROR variable
-        if FmUtil.getMakeConfVar(FmConst.portageCfgMakeConf, "KERNEL_DEFAULT_MIRROR") != FmConst.defaultKernelMirror:
-            if self.bAutoFix:
-                FmUtil.setMakeConfVar(FmConst.portageCfgMakeConf, "KERNEL_DEFAULT_MIRROR", FmConst.defaultKernelMirror)
-            else:
-                raise FmCheckException("variable KERNEL_DEFAULT_MIRROR in %s does not exist or has invalid value" % (FmConst.portageCfgMakeConf))
+            # check/fix KERNEL_DEFAULT_MIRROR variable
+            if makeConf.get("KERNEL_DEFAULT_MIRROR") != FmConst.defaultKernelMirror:
+                if self.bAutoFix:
+                    makeConf.set("KERNEL_DEFAULT_MIRROR", FmConst.defaultKernelMirror)
+                else:
+                    raise FmCheckException("variable KERNEL_DEFAULT_MIRROR in %s does not exist or has invalid value" % (FmConst.portageCfgMakeConf))
 
     def _checkPortageCfgDir(self):
         """Check /etc/portage directory"""
@@ -1179,7 +1166,7 @@ class FmSysChecker:
             if self.bAutoFix:
                 FmUtil.cmdCallIgnoreResult("/usr/bin/eselect", "news", "read", "all")
             else:
-                self.infoPrinter.printError("There are unread portage news items, please use \"eselect news read all\".")
+                self.infoPrinter.printError("There are unread portage news items, please use \"eselect news read all\".", bAutoFixable=True)
 
     def _checkRepositories(self, bFullCheck=True):
         """Check repositories"""
@@ -1190,7 +1177,7 @@ class FmSysChecker:
                 if self.bAutoFix:
                     self.pkgwh.repoman.createRepository(repoName)
                 else:
-                    self.infoPrinter.printError("Repository \"%s\" does not exist" % (repoName))
+                    self.infoPrinter.printError("Repository \"%s\" does not exist" % (repoName), bAutoFixable=True)
 
         # check all repositories
         for repoName in self.pkgwh.repoman.getRepositoryList():
@@ -1307,7 +1294,7 @@ class FmSysChecker:
         # check if /etc/locale.conf exists
         if not os.path.exists(fn):
             if not self.bAutoFix:
-                self.infoPrinter.printError("Locale is not configured.")
+                self.infoPrinter.printError("Locale is not configured.", path=fn, bAutoFixable=True)
             else:
                 with open(fn, "w") as f:
                     f.write(content + "\n")
@@ -1317,7 +1304,7 @@ class FmSysChecker:
         lines = FmUtil.readListFile(fn)
         if len(lines) != 1 or lines[0] != content:
             if not self.bAutoFix:
-                self.infoPrinter.printError("System locale should be configured as \"C.utf8\".")
+                self.infoPrinter.printError("System locale should be configured as \"C.utf8\".", path=fn, bAutoFixable=True)
             else:
                 with open(fn, "w") as f:
                     f.write(content + "\n")
@@ -1333,16 +1320,16 @@ class FmSysChecker:
         # check timezone configuration
         while True:
             if not os.path.exists("/etc/timezone") or not os.path.exists("/etc/localtime"):
-                self.infoPrinter.printError("Timezone is not properly configured.")
+                self.infoPrinter.printError("Timezone is not properly configured.", path="/etc/timezone")
                 break
             tz = None
             with open("/etc/timezone", "r") as f:
                 tz = os.path.join("/usr/share/zoneinfo", f.read().rstrip("\n"))
             if not os.path.exists(tz):
-                self.infoPrinter.printError("Timezone is not properly configured.")
+                self.infoPrinter.printError("Timezone is not properly configured.", path="/etc/timezone")
                 break
             if not filecmp.cmp("/etc/localtime", tz):
-                self.infoPrinter.printError("Timezone is not properly configured.")
+                self.infoPrinter.printError("Timezone is not properly configured.", path="/etc/localtime")
                 break
             break
 
@@ -1362,15 +1349,49 @@ class FmSysChecker:
         except Exception as e:
             self.infoPrinter.printError("Error occured when checking system time, %s." % (str(e)))
 
+    def _checkPackages(self):
+        pkgNameVerList = []
+        for pkgNameVer in sorted(FmUtil.getFileList(FmConst.portageDbDir, 2, "d")):
+            if FmUtil.repoIsSysFile(pkgNameVer):
+                continue
+            if pkgNameVer.split("/")[1].startswith("-MERGING"):
+                continue
+            pkgNameVerList.append(pkgNameVer)
+
+        self.pkgVerifier = PkgIntegrityVerifier(pkgNameVerList, self.pkgMd5IgnoreList)
+        try:
+            for pkgNameVer in pkgNameVerList:
+                self.infoPrinter.startPrintByError()
+                self.infoPrinter.printInfo("- Package %s:" % (pkgNameVer))
+                self.infoPrinter.incIndent()
+                try:
+                    self._checkPackageContentFile(pkgNameVer)
+                    self._checkPackageFileScope(pkgNameVer)
+                    self._checkPakcageMd5(pkgNameVer)
+                    self._checkPkgEbuild2(pkgNameVer)
+                finally:
+                    self.infoPrinter.decIndent()
+                    self.infoPrinter.endPrintByError()
+                self.pkgVerifier.releasePackage(pkgNameVer)
+            self.pkgVerifier.saveCache()
+
+            fileCount, hitCount, byteCount, elapsed = self.pkgVerifier.getStatistics()
+            hitRate = hitCount * 100 / fileCount if fileCount > 0 else 0
+            speed = byteCount / 1024 / 1024 / elapsed if elapsed > 0 else 0
+            self.infoPrinter.printInfo("- %d files verified, %.1f%% from cache, %.1fMiB hashed at %.1fMiB/s." % (fileCount, hitRate, byteCount / 1024 / 1024, speed))
+        finally:
+            self.pkgVerifier.dispose()
+            self.pkgVerifier = None
+
     def _checkPackageContentFile(self, pkgNameVer):
         contf = os.path.join(FmConst.portageDbDir, pkgNameVer, "CONTENTS_2")
         if not os.path.exists(contf):
             if self.bAutoFix:
                 FmUtil.cmdCallIgnoreResult("/usr/bin/emerge", "-1", "=%s" % (pkgNameVer))
                 if not os.path.exists(contf):
-                    self.infoPrinter.printError("Content file %s is missing, auto-fix failed." % (contf))
+                    self.infoPrinter.printError("Content file %s is missing, auto-fix failed." % (contf), path=contf, pkg=pkgNameVer)
             else:
-                self.infoPrinter.printError("Content file %s is missing." % (contf))
+                self.infoPrinter.printError("Content file %s is missing." % (contf), path=contf, pkg=pkgNameVer, bAutoFixable=True)
 
     def _checkPackageFileScope(self, pkgNameVer):
         # There're some directories and files I think should not belong to any package, but others don't think so...
@@ -1384,11 +1405,7 @@ class FmSysChecker:
         ]
 
         # get file list for this package
-        cmdStr = r"/bin/cat /var/db/pkg/%s/CONTENTS " % (pkgNameVer)
-        cmdStr += r'| /bin/sed -e "s:^obj \(.*\) [[:xdigit:]]\+ [[:digit:]]\+$:\1:" '
-        cmdStr += r'| /bin/sed -e "s:^sym \(.*\) -> .* .*$:\1:" '
-        cmdStr += r'| /bin/sed -e "s:^dir \(.*\)$:\1:" '
-        ret = FmUtil.shellCall(cmdStr).split("\n")
+        ret = [x[0] for x in self._getInstalledFileIndex().getPackageFileList(pkgNameVer)]
 
         # check
         for fn in ret:
@@ -1396,26 +1413,21 @@ class FmSysChecker:
                 # FIXME: don't know why, I can't remove /var after remove /var/* for some packages using patch_post script
                 if d == "/var":
                     if fn.startswith(d + "/"):
-                        self.infoPrinter.printError("\"%s\" should not be installed by package manager. (add to \"/usr/lib/tmpfiles.d/*.conf\"?)" % (fn))
+                        self.infoPrinter.printError("\"%s\" should not be installed by package manager. (add to \"/usr/lib/tmpfiles.d/*.conf\"?)" % (fn), path=fn, pkg=pkgNameVer)
                 else:
                     if fn == d or fn.startswith(d + "/"):
-                        self.infoPrinter.printError("\"%s\" should not be installed by package manager. (add to \"/usr/lib/tmpfiles.d/*.conf\"?)" % (fn))
+                        self.infoPrinter.printError("\"%s\" should not be installed by package manager. (add to \"/usr/lib/tmpfiles.d/*.conf\"?)" % (fn), path=fn, pkg=pkgNameVer)
 
     def _checkPakcageMd5(self, pkgNameVer):
-        ignoreList = [
-            '/etc',
-            '/var',
-        ]
-
         contf = os.path.join(FmConst.portageDbDir, pkgNameVer, "CONTENTS_2")
         if not os.path.exists(contf):
             # FIXME
-            self.infoPrinter.printError("CONTENTS_2 file for %s is missing." % (pkgNameVer))
+            self.infoPrinter.printError("CONTENTS_2 file for %s is missing." % (pkgNameVer), pkg=pkgNameVer)
             return
 
-        for item in FmUtil.portageParseVarDbPkgContentFile(contf):
+        for item in self.pkgVerifier.getContentList(pkgNameVer):
             bIgnore = False
-            for p in ignoreList:
+            for p in self.pkgMd5IgnoreList:
                 if item[1].startswith(p + "/"):
                     bIgnore = True
             if bIgnore:
@@ -1423,40 +1435,40 @@ class FmSysChecker:
 
             if item[0] == "dir":
                 if not os.path.exists(item[1]):
-                    self.infoPrinter.printError("Directory %s is missing." % (item[1]))
+                    self.infoPrinter.printError("Directory %s is missing." % (item[1]), path=item[1], pkg=pkgNameVer)
                 else:
                     s = os.stat(item[1])
                     if s.st_uid != item[3]:
-                        self.infoPrinter.printError("Directory %s failes for uid verification." % (item[1]))
+                        self.infoPrinter.printError("Directory %s failes for uid verification." % (item[1]), path=item[1], pkg=pkgNameVer)
                     if s.st_gid != item[4]:
-                        self.infoPrinter.printError("Directory %s failes for gid verification." % (item[1]))
+                        self.infoPrinter.printError("Directory %s failes for gid verification." % (item[1]), path=item[1], pkg=pkgNameVer)
             elif item[0] == "obj":
                 if not os.path.exists(item[1]):
-                    self.infoPrinter.printError("File %s is missing" % (item[1]))
+                    self.infoPrinter.printError("File %s is missing" % (item[1]), path=item[1], pkg=pkgNameVer)
                 else:
-                    if not FmUtil.verifyFileMd5(item[1], item[2]):
-                        self.infoPrinter.printError("File %s fails for MD5 verification." % (item[1]))
+                    if self.pkgVerifier.getFileMd5(pkgNameVer, item[1]) != item[2]:
+                        self.infoPrinter.printError("File %s fails for MD5 verification." % (item[1]), path=item[1], pkg=pkgNameVer)
                     s = os.stat(item[1])
                     if s.st_mode != item[3]:
-                        self.infoPrinter.printError("File %s failes for permission verification." % (item[1]))
+                        self.infoPrinter.printError("File %s failes for permission verification." % (item[1]), path=item[1], pkg=pkgNameVer)
                     if s.st_uid != item[4]:
-                        self.infoPrinter.printError("File %s failes for uid verification." % (item[1]))
+                        self.infoPrinter.printError("File %s failes for uid verification." % (item[1]), path=item[1], pkg=pkgNameVer)
                     if s.st_gid != item[5]:
-                        self.infoPrinter.printError("File %s failes for gid verification." % (item[1]))
+                        self.infoPrinter.printError("File %s failes for gid verification." % (item[1]), path=item[1], pkg=pkgNameVer)
             elif item[0] == "sym":
                 if not os.path.islink(item[1]):
-                    self.infoPrinter.printError("Symlink %s is missing." % (item[1]))
+                    self.infoPrinter.printError("Symlink %s is missing." % (item[1]), path=item[1], pkg=pkgNameVer)
                 else:
                     if os.readlink(item[1]) != item[2]:
-                        self.infoPrinter.printError("Symlink %s fails for target verification." % (item[1]))
+                        self.infoPrinter.printError("Symlink %s fails for target verification." % (item[1]), path=item[1], pkg=pkgNameVer)
                     if not os.path.exists(item[1]):
-                        self.infoPrinter.printError("Symlink %s is broken." % (item[1]))
+                        self.infoPrinter.printError("Symlink %s is broken." % (item[1]), path=item[1], pkg=pkgNameVer)
                     else:
                         s = os.stat(item[1])
                         if s.st_uid != item[3]:
-                            self.infoPrinter.printError("Symlink %s failes for uid verification." % (item[1]))
+                            self.infoPrinter.printError("Symlink %s failes for uid verification." % (item[1]), path=item[1], pkg=pkgNameVer)
                         if s.st_gid != item[4]:
-                            self.infoPrinter.printError("Symlink %s failes for gid verification." % (item[1]))
+                            self.infoPrinter.printError("Symlink %s failes for gid verification." % (item[1]), path=item[1], pkg=pkgNameVer)
             else:
                 assert False
 
@@ -1467,12 +1479,20 @@ class FmSysChecker:
             try:
                 e2dir.execPkgCheckScript(fbasename)
             except Ebuild2CheckError as e:
-                self.infoPrinter.printError(e.message)
+                self.infoPrinter.printError(e.message, pkg=pkgNameVer)
 
     def _checkItemSystemCruft(self):
-        obj = _CruftFinder(self.param)
+        obj = _CruftFinder(self.param, self._getInstalledFileIndex())
         for cf in obj.findCruft():
-            self.infoPrinter.printError("Cruft file found: %s" % (cf))
+            self.infoPrinter.printError("Cruft file found: %s" % (cf), path=cf)
+
+    def _getInstalledFileIndex(self):
+        # shared by concurrent checks
+        with self.fileIndexLock:
+            if self.fileIndex is None:
+                self.fileIndex = PkgInstalledFileIndex()
+                self.fileIndex.save()
+            return self.fileIndex
 
     def __checkAndFixEtcDir(self, etcDir):
         if not os.path.exists(etcDir):
@@ -1652,8 +1672,10 @@ class _DiskPartitionTableCheckerFailure(Exception):
 
 class _CruftFinder:
 
-    def __init__(self, param):
+    def __init__(self, param, fileIndex, rootDir="/"):
         self.param = param
+        self.fileIndex = fileIndex
+        self.rootDir = rootDir
 
         self.ignoreList = [
             '/dev',
@@ -1680,36 +1702,36 @@ class _CruftFinder:
             '/tmp',
             '/usr/share/mime',
             '/var/tmp',
+            FmConst.cacheDir,
         ]
 
     def findCruft(self):
-        systemFileSet = self._getSystemFileSet()
-
-        portageFileSet = FmUtil.portageGetInstalledFileSet()
+        portageFileSet = self.fileIndex.getFileSet()
 
         portageFileSet = self._expandPortageFileSet(portageFileSet)
 
-        cruftFileSet = systemFileSet - portageFileSet
+        # system files are compared while being walked, the whole system file list is never kept in memory
+        cruftFileSet = {x for x in self._walkSystemFiles() if x not in portageFileSet}
         cruftFileSet |= self._getSharedMimeInfoCruftFileSet(portageFileSet)
         cruftFileSet = self._filterTrashDir(cruftFileSet)
         cruftFileSet = self._filterPycache(cruftFileSet)
         cruftFileSet = self._filterIconThemeCache(cruftFileSet, portageFileSet)
         cruftFileSet = self._filterDotKeep(cruftFileSet)
 
-        vartree = portage.db[portage.root]['vartree']
-        for cp in vartree.dbapi.cp_all():
-            cruftFileSet = self._pkgCruftFilter(cruftFileSet, cp)
+        cpList = sorted(set(portage.versions.cpv_getkey(x) for x in self.fileIndex.getPackageList()))
+        patternSet = set()
+        for cp, patternSet2 in Ebuild2Dir().getCruftFilterPatternDict(cpList).items():
+            patternSet |= patternSet2
+        cruftFileSet = self._pkgCruftFilter(cruftFileSet, patternSet)
 
         return sorted(list(cruftFileSet))
 
-    def _getSystemFileSet(self):
-        cmdStr = "/usr/bin/find / '(' -false "
-        for f in self.ignoreList:
-            cmdStr += "-or -path \"%s\" " % (f)
-        cmdStr += "')' -prune -or -print0"
-
-        ret = FmUtil.shellCall(cmdStr)
-        return set(ret.split("\x00"))
+    def _walkSystemFiles(self):
+        # yields what "find $rootDir -path $ignore -prune -or -print" prints
+        prunePathList = [os.path.join(self.rootDir, f[1:]) for f in self.ignoreList]
+        yield self.rootDir
+        for entry in TreeWalker(self.rootDir, prunePathList=prunePathList, bStat=False).walk():
+            yield entry.path
 
     def _expandPortageFileSet(self, fileSet):
         # deal with *.py
@@ -1722,8 +1744,7 @@ class _CruftFinder:
 
         # deal with directory symlink
         nret = set()
-        for f in ret:
-            f2 = os.path.join(os.path.realpath(os.path.dirname(f)), os.path.basename(f))
+        for f, f2 in PathResolver().realDirPathDict(ret).items():
             if f2 != f:
                 nret.add(f2)
         ret |= nret
@@ -1731,24 +1752,24 @@ class _CruftFinder:
         return ret
 
     def _getSharedMimeInfoCruftFileSet(self, portageFileSet):
-        if not os.path.exists("/usr/share/mime"):
+        mimeDir = os.path.join(self.rootDir, "usr", "share", "mime")
+        if not os.path.exists(mimeDir):
             return set()
 
         if not os.path.exists("/usr/bin/update-mime-database"):
             raise Exception("executable /usr/bin/update-mime-database is not installed")
 
         # get file set in /usr/share/mime
-        mimeSet = set(FmUtil.cmdCall("/usr/bin/find", "/usr/share/mime", "-print0").split("\x00"))
-
-        # create a a temporary mime directory and get its file set
-        newMimeDir = os.path.join(self.param.tmpDir, "mime")
-        os.mkdir(newMimeDir)
-        FmUtil.cmdCall("/bin/cp", "-r", "/usr/share/mime/packages", newMimeDir)
-        FmUtil.cmdCall("/usr/bin/update-mime-database", newMimeDir)
-        shutil.rmtree(os.path.join(newMimeDir, "packages"))
+        mimeSet = set(FmUtil.cmdCall("/usr/bin/find", mimeDir, "-print0").split("\x00"))
+        mimeSet.discard("")
 
-        newMimeSet = set(FmUtil.cmdCall("/usr/bin/find", newMimeDir, "-print0").split("\x00"))
-        newMimeSet = {x.replace(newMimeDir, "/usr/share/mime") for x in newMimeSet}
+        # get the file set generated by update-mime-database, it is regenerated only when the source files or the program change
+        packagesDir = os.path.join(mimeDir, "packages")
+        inputFileList = [os.path.join(packagesDir, x) for x in os.listdir(packagesDir)]
+        inputFileList = [x for x in inputFileList if os.path.isfile(x)]
+        inputFileList.append("/usr/bin/update-mime-database")
+        relList = InputDigestCache("mime").get(inputFileList, lambda: self._generateMimeFileList(mimeDir))
+        newMimeSet = {os.path.normpath(os.path.join(mimeDir, x)) for x in relList}
 
         # get cruft file list
         retSet = mimeSet
@@ -1756,6 +1777,21 @@ class _CruftFinder:
         retSet -= portageFileSet
         return retSet
 
+    def _generateMimeFileList(self, mimeDir):
+        # create a temporary mime directory, returns its file list, paths are relative to the mime directory
+        newMimeDir = os.path.join(self.param.tmpDir, "mime")
+        FmUtil.forceDelete(newMimeDir)
+        os.mkdir(newMimeDir)
+        try:
+            FmUtil.cmdCall("/bin/cp", "-r", os.path.join(mimeDir, "packages"), newMimeDir)
+            FmUtil.cmdCall("/usr/bin/update-mime-database", newMimeDir)
+            shutil.rmtree(os.path.join(newMimeDir, "packages"))
+
+            ret = FmUtil.cmdCall("/usr/bin/find", newMimeDir, "-print0").split("\x00")
+            return sorted(os.path.relpath(x, newMimeDir) for x in ret if x != "")
+        finally:
+            FmUtil.forceDelete(newMimeDir)
+
     def _filterTrashDir(self, cruftFileSet):
         retSet = set()
         for x in cruftFileSet:
@@ -1801,19 +1837,11 @@ class _CruftFinder:
                     x = os.path.dirname(x)
         return cruftFileSet - sFileSet
 
-    def _pkgCruftFilter(self, cruftFileSet, pkgName):
-        patternSet = Ebuild2Dir().getCruftFilterPatternSet(pkgName)
-
+    def _pkgCruftFilter(self, cruftFileSet, patternSet):
         if len(patternSet) == 0:
             return cruftFileSet
 
-        retSet = set()
-        for x in cruftFileSet:
-            if any(fnmatch.fnmatchcase(x, pattern) for pattern in patternSet):
-                continue
-            retSet.add(x)
-
-        return retSet
+        return GlobPatternMatcher(patternSet).filter(cruftFileSet)
 
     def _listDirs(self, dirname):
         ret = []
@@ -352,6 +352,8 @@ class FmStorageManager:
         self.swapSize = self.swapSizeInGb * 1024 * 1024 * 1024
         self.swapPartiSizeStr = "%dGiB" % (self.swapSizeInGb)
 
+        self._topology = None
+
     def getStorageLayout(self):
         if self.param.runMode == "prepare":
             return FmStorageLayoutEmpty()
@@ -362,9 +364,9 @@ class FmStorageManager:
         assert rootDev is not None
         if bootDev is not None:
             try:
-                lvmInfo = FmUtil.getBlkDevLvmInfo(rootDev)
+                lvmInfo = self._getTopology().getBlkDevLvmInfo(rootDev)
                 if lvmInfo is not None:
-                    tlist = FmUtil.lvmGetSlaveDevPathList(lvmInfo[0])
+                    tlist = self._getTopology().lvmGetSlaveDevPathList(lvmInfo[0])
                     if any(re.fullmatch("/dev/bcache[0-9]+", x) is not None for x in tlist):
                         ret = self._getEfiBcacheLvmLayout(bootDev)
                     else:
@@ -375,7 +377,7 @@ class FmStorageManager:
                 return FmStorageLayoutNonStandard(True, None, bootDev, rootDev, e.layoutName, e.message)
         else:
             try:
-                if FmUtil.getBlkDevLvmInfo(rootDev) is not None:
+                if self._getTopology().getBlkDevLvmInfo(rootDev) is not None:
                     ret = self._getBiosLvmLayout()
                 else:
                     ret = self._getBiosSimpleLayout(rootDev)
@@ -383,8 +385,8 @@ class FmStorageManager:
                 if e.layoutName == FmStorageLayoutBiosLvm.name:
                     # get harddisk for lvm volume group
                     diskSet = set()
-                    lvmInfo = FmUtil.getBlkDevLvmInfo(rootDev)
-                    for slaveDev in FmUtil.lvmGetSlaveDevPathList(lvmInfo[0]):
+                    lvmInfo = self._getTopology().getBlkDevLvmInfo(rootDev)
+                    for slaveDev in self._getTopology().lvmGetSlaveDevPathList(lvmInfo[0]):
                         if FmUtil.devPathIsDiskOrPartition(slaveDev):
                             diskSet.add(slaveDev)
                         else:
@@ -623,7 +625,7 @@ class FmStorageManager:
                 FmUtil.cmdCall("/sbin/lvm", "lvcreate", "-L", self.swapPartiSizeStr, "-n", "swap", "hdd")
                 layout.lvmSwapLv = "swap"
             serviceName = FmUtil.path2SwapServiceName(layout.lvmSwapLv)
-            if FmUtil.getBlkDevSize("/dev/mapper/hdd.swap") < self.swapSize:
+            if self._getTopology().getBlkDevSize("/dev/mapper/hdd.swap") < self.swapSize:
                 self._disableSwapService(layout.lvmSwapLv, serviceName)
                 FmUtil.cmdCall("/sbin/lvm", "lvremove", "/dev/mapper/hdd.swap")
                 FmUtil.cmdCall("/sbin/lvm", "lvcreate", "-L", self.swapPartiSizeStr, "-n", "swap", "hdd")
@@ -632,7 +634,7 @@ class FmStorageManager:
             return
 
         if isinstance(layout, (FmStorageLayoutEfiBcacheLvm)):
-            if FmUtil.getBlkDevSize(layout.ssdSwapParti) < self.swapSize:
+            if self._getTopology().getBlkDevSize(layout.ssdSwapParti) < self.swapSize:
                 raise Exception("swap partition is too smalls")
             serviceName = FmUtil.path2SwapServiceName(layout.ssdSwapParti)
             self._createSwapService(layout.ssdSwapParti, serviceName)
@@ -694,7 +696,7 @@ class FmStorageManager:
         # ret.hddRootParti
         ret.hddRootParti = rootDev
         if True:
-            fs = FmUtil.getBlkDevFsType(ret.hddRootParti)
+            fs = self._getTopology().getBlkDevFsType(ret.hddRootParti)
             if fs != "ext4":
                 raise _FmHddLayoutError(FmStorageLayoutEfiSimple, "root partition file system is \"%s\", not \"ext4\"" % (fs))
 
@@ -714,33 +716,31 @@ class FmStorageManager:
         ret.bootHdd = FmUtil.devPathPartitionToDisk(bootDev)
 
         # ret.lvmVg
-        if not FmUtil.cmdCallTestSuccess("/sbin/lvm", "vgdisplay", "hdd"):
+        if not self._getTopology().lvmVgExists("hdd"):
             raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "volume group \"hdd\" does not exist")
         ret.lvmVg = "hdd"
 
         # ret.lvmPvHddList
-        out = FmUtil.cmdCall("/sbin/lvm", "pvdisplay", "-c")
-        for m in re.finditer("(/dev/\\S+):hdd:.*", out, re.M):
-            hdd, partId = FmUtil.devPathPartitionToDiskAndPartitionId(m.group(1))
-            if FmUtil.getBlkDevPartitionTableType(hdd) != "gpt":
+        for pvDev in self._getTopology().lvmGetPvList("hdd"):
+            hdd, partId = FmUtil.devPathPartitionToDiskAndPartitionId(pvDev)
+            if self._getTopology().getBlkDevPartitionTableType(hdd) != "gpt":
                 raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "partition type of %s is not \"gpt\"" % (hdd))
             if partId != 2:
                 raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "physical volume partition of %s is not %s" % (hdd, FmUtil.devPathDiskToPartition(hdd, 2)))
-            if FmUtil.getBlkDevSize(FmUtil.devPathDiskToPartition(hdd, 1)) != self.espPartiSize:
+            if self._getTopology().getBlkDevSize(FmUtil.devPathDiskToPartition(hdd, 1)) != self.espPartiSize:
                 raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "%s has an invalid size" % (FmUtil.devPathDiskToPartition(hdd, 1)))
             if os.path.exists(FmUtil.devPathDiskToPartition(hdd, 3)):
                 raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "redundant partition exists on %s" % (hdd))
             ret.lvmPvHddList.append(hdd)
 
-        out = FmUtil.cmdCall("/sbin/lvm", "lvdisplay", "-c")
         if True:
             # ret.lvmRootLv
-            if re.search("/dev/hdd/root:hdd:.*", out, re.M) is not None:
+            if self._getTopology().lvmLvExists("hdd", "root"):
                 ret.lvmRootLv = "root"
                 if os.path.exists("/dev/mapper/hdd.root"):
-                    fs = FmUtil.getBlkDevFsType("/dev/mapper/hdd.root")
+                    fs = self._getTopology().getBlkDevFsType("/dev/mapper/hdd.root")
                 elif os.path.exists("/dev/mapper/hdd-root"):                # compatible with old lvm version
-                    fs = FmUtil.getBlkDevFsType("/dev/mapper/hdd-root")
+                    fs = self._getTopology().getBlkDevFsType("/dev/mapper/hdd-root")
                 else:
                     assert False
                 if fs != "ext4":
@@ -749,13 +749,13 @@ class FmStorageManager:
                 raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "logical volume \"/dev/mapper/hdd.root\" does not exist")
 
             # ret.lvmSwapLv
-            if re.search("/dev/hdd/swap:hdd:.*", out, re.M) is not None:
+            if self._getTopology().lvmLvExists("hdd", "swap"):
                 ret.lvmSwapLv = "swap"
                 if os.path.exists("/dev/mapper/hdd.swap"):
-                    if FmUtil.getBlkDevFsType("/dev/mapper/hdd.swap") != "swap":
+                    if self._getTopology().getBlkDevFsType("/dev/mapper/hdd.swap") != "swap":
                         raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "/dev/mapper/hdd.swap has an invalid file system")
                 elif os.path.exists("/dev/mapper/hdd-swap"):                    # compatible with old lvm version
-                    if FmUtil.getBlkDevFsType("/dev/mapper/hdd-swap") != "swap":
+                    if self._getTopology().getBlkDevFsType("/dev/mapper/hdd-swap") != "swap":
                         raise _FmHddLayoutError(FmStorageLayoutEfiLvm, "/dev/mapper/hdd.swap has an invalid file system")
                 else:
                     assert False
@@ -768,16 +768,15 @@ class FmStorageManager:
         ret = FmStorageLayoutEfiBcacheLvm()
 
         # ret.lvmVg
-        if not FmUtil.cmdCallTestSuccess("/sbin/lvm", "vgdisplay", "hdd"):
+        if not self._getTopology().lvmVgExists("hdd"):
             raise _FmHddLayoutError(FmStorageLayoutEfiBcacheLvm, "volume group \"hdd\" does not exist")
         ret.lvmVg = "hdd"
 
         # ret.lvmPvHddDict
-        out = FmUtil.cmdCall("/sbin/lvm", "pvdisplay", "-c")
-        for m in re.finditer("(/dev/\\S+):hdd:.*", out, re.M):
-            if re.fullmatch("/dev/bcache[0-9]+", m.group(1)) is None:
+        for pvDev in self._getTopology().lvmGetPvList("hdd"):
+            if re.fullmatch("/dev/bcache[0-9]+", pvDev) is None:
                 raise _FmHddLayoutError(FmStorageLayoutEfiBcacheLvm, "volume group \"hdd\" has non-bcache physical volume")
-            bcacheDev = m.group(1)
+            bcacheDev = pvDev
             tlist = FmUtil.bcacheGetSlaveDevPathList(bcacheDev)
             hddDev, partId = FmUtil.devPathPartitionToDiskAndPartitionId(tlist[-1])
             if partId != 2:
@@ -787,13 +786,12 @@ class FmStorageManager:
             ret.lvmPvHddDict[hddDev] = bcacheDev
 
         # ret.lvmRootLv
-        out = FmUtil.cmdCall("/sbin/lvm", "lvdisplay", "-c")
-        if re.search("/dev/hdd/root:hdd:.*", out, re.M) is not None:
+        if self._getTopology().lvmLvExists("hdd", "root"):
             ret.lvmRootLv = "root"
             if os.path.exists("/dev/mapper/hdd.root"):
-                fs = FmUtil.getBlkDevFsType("/dev/mapper/hdd.root")
+                fs = self._getTopology().getBlkDevFsType("/dev/mapper/hdd.root")
             elif os.path.exists("/dev/mapper/hdd-root"):                    # compatible with old lvm version
-                fs = FmUtil.getBlkDevFsType("/dev/mapper/hdd-root")
+                fs = self._getTopology().getBlkDevFsType("/dev/mapper/hdd-root")
             else:
                 assert False
             if fs != "ext4":
@@ -808,14 +806,14 @@ class FmStorageManager:
             ret.ssdEspParti = FmUtil.devPathDiskToPartition(ret.ssd, 1)
             if ret.ssdEspParti != bootDev:
                 raise _FmHddLayoutError(FmStorageLayoutEfiBcacheLvm, "SSD is not boot device")
-            if FmUtil.getBlkDevSize(ret.ssdEspParti) != self.espPartiSize:
+            if self._getTopology().getBlkDevSize(ret.ssdEspParti) != self.espPartiSize:
                 raise _FmHddLayoutError(FmStorageLayoutEfiBcacheLvm, "%s has an invalid size" % (ret.ssdEspParti))
 
             # ret.ssdSwapParti
             ret.ssdSwapParti = FmUtil.devPathDiskToPartition(ret.ssd, 2)
             if not os.path.exists(ret.ssdSwapParti):
                 raise _FmHddLayoutError(FmStorageLayoutEfiBcacheLvm, "SSD has no swap partition")
-            if FmUtil.getBlkDevFsType(ret.ssdSwapParti) != "swap":
+            if self._getTopology().getBlkDevFsType(ret.ssdSwapParti) != "swap":
                 raise _FmHddLayoutError(FmStorageLayoutEfiBcacheLvm, "swap device %s has an invalid file system" % (ret.ssdSwapParti))
 
             # ret.ssdCacheParti
@@ -850,12 +848,12 @@ class FmStorageManager:
 
         # ret.hdd
         ret.hdd = FmUtil.devPathPartitionToDisk(rootDev)
-        if FmUtil.getBlkDevPartitionTableType(ret.hdd) != "dos":
+        if self._getTopology().getBlkDevPartitionTableType(ret.hdd) != "dos":
             raise _FmHddLayoutError(FmStorageLayoutBiosSimple, "partition type of %s is not \"dos\"" % (ret.hdd))
 
         # ret.hddRootParti
         ret.hddRootParti = rootDev
-        fs = FmUtil.getBlkDevFsType(ret.hddRootParti)
+        fs = self._getTopology().getBlkDevFsType(ret.hddRootParti)
         if fs != "ext4":
             raise _FmHddLayoutError(FmStorageLayoutBiosSimple, "root partition file system is \"%s\", not \"ext4\"" % (fs))
 
@@ -869,29 +867,27 @@ class FmStorageManager:
         ret = FmStorageLayoutBiosLvm()
 
         # ret.lvmVg
-        if not FmUtil.cmdCallTestSuccess("/sbin/lvm", "vgdisplay", "hdd"):
+        if not self._getTopology().lvmVgExists("hdd"):
             raise _FmHddLayoutError(FmStorageLayoutBiosLvm, "volume group \"hdd\" does not exist")
         ret.lvmVg = "hdd"
 
         # ret.lvmPvHddList
-        out = FmUtil.cmdCall("/sbin/lvm", "pvdisplay", "-c")
-        for m in re.finditer("(/dev/\\S+):hdd:.*", out, re.M):
-            hdd = FmUtil.devPathPartitionToDisk(m.group(1))
-            if FmUtil.getBlkDevPartitionTableType(hdd) != "dos":
+        for pvDev in self._getTopology().lvmGetPvList("hdd"):
+            hdd = FmUtil.devPathPartitionToDisk(pvDev)
+            if self._getTopology().getBlkDevPartitionTableType(hdd) != "dos":
                 raise _FmHddLayoutError(FmStorageLayoutBiosLvm, "partition type of %s is not \"dos\"" % (hdd))
             if os.path.exists(FmUtil.devPathDiskToPartition(hdd, 2)):
                 raise _FmHddLayoutError(FmStorageLayoutBiosLvm, "redundant partition exists on %s" % (hdd))
             ret.lvmPvHddList.append(hdd)
 
-        out = FmUtil.cmdCall("/sbin/lvm", "lvdisplay", "-c")
         if True:
             # ret.lvmRootLv
-            if re.search("/dev/hdd/root:hdd:.*", out, re.M) is not None:
+            if self._getTopology().lvmLvExists("hdd", "root"):
                 ret.lvmRootLv = "root"
                 if os.path.exists("/dev/mapper/hdd.root"):
-                    fs = FmUtil.getBlkDevFsType("/dev/mapper/hdd.root")
+                    fs = self._getTopology().getBlkDevFsType("/dev/mapper/hdd.root")
                 elif os.path.exists("/dev/mapper/hdd-root"):                # compatible with old lvm version
-                    fs = FmUtil.getBlkDevFsType("/dev/mapper/hdd-root")
+                    fs = self._getTopology().getBlkDevFsType("/dev/mapper/hdd-root")
                 else:
                     assert False
                 if fs != "ext4":
@@ -900,13 +896,13 @@ class FmStorageManager:
                 raise _FmHddLayoutError(FmStorageLayoutBiosLvm, "logical volume \"/dev/mapper/hdd.root\" does not exist")
 
             # ret.lvmSwapLv
-            if re.search("/dev/hdd/swap:hdd:.*", out, re.M) is not None:
+            if self._getTopology().lvmLvExists("hdd", "swap"):
                 ret.lvmSwapLv = "swap"
                 if os.path.exists("/dev/mapper/hdd.swap"):
-                    if FmUtil.getBlkDevFsType("/dev/mapper/hdd.swap") != "swap":
+                    if self._getTopology().getBlkDevFsType("/dev/mapper/hdd.swap") != "swap":
                         raise _FmHddLayoutError(FmStorageLayoutBiosLvm, "/dev/mapper/hdd.swap has an invalid file system")
                 elif os.path.exists("/dev/mapper/hdd-swap"):                # compatible with old lvm version
-                    if FmUtil.getBlkDevFsType("/dev/mapper/hdd-swap") != "swap":
+                    if self._getTopology().getBlkDevFsType("/dev/mapper/hdd-swap") != "swap":
                         raise _FmHddLayoutError(FmStorageLayoutBiosLvm, "/dev/mapper/hdd.swap has an invalid file system")
                 else:
                     assert False
@@ -923,6 +919,11 @@ class FmStorageManager:
 
         return ret
 
+    def _getTopology(self):
+        if self._topology is None or self._topology.isOutdated():
+            self._topology = _BlkDevTopology()
+        return self._topology
+
     def _addHddBiosLvm(self, layout, devpath):
         if devpath in layout.lvmPvHddList:
             raise Exception("the specified device is already managed")
@@ -1209,4 +1210,151 @@ class _FmHddLayoutError(Exception):
         self.message = message
 
 
+class _BlkDevTopology:
+
+    """
+    Snapshot of block device information, built from one scan of /sys/class/block and the udev database,
+    one "lvm pvs" call and one "lvm lvs" call. It answers the same queries as FmUtil.getBlkDevSize(),
+    FmUtil.getBlkDevUuid(), FmUtil.getBlkDevFsType(), FmUtil.getBlkDevPartitionTableType(),
+    FmUtil.getBlkDevLvmInfo() and FmUtil.lvmGetSlaveDevPathList(), and replaces "lvm vgdisplay",
+    "lvm pvdisplay" and "lvm lvdisplay" calls.
+
+    The snapshot is outdated when /sys/kernel/uevent_seqnum changes.
+    Devices not found in the snapshot, or not probed by udev, fall back to the FmUtil functions.
+    """
+
+    def __init__(self):
+        self._seqnum = self._getSeqnum()
+        self._devDict = dict()          # name -> (size, udev-property-dict or None, dm-name or None)
+        self._pvList = None             # [(pv-name, vg-name)]
+        self._lvList = None             # [(vg-name, lv-name)]
+
+        for name in os.listdir("/sys/class/block"):
+            sysDir = os.path.join("/sys/class/block", name)
+            try:
+                with open(os.path.join(sysDir, "size")) as f:
+                    size = int(f.read()) * 512
+                with open(os.path.join(sysDir, "dev")) as f:
+                    devno = f.read().strip()
+            except (FileNotFoundError, ValueError):
+                continue
+            try:
+                with open(os.path.join(sysDir, "dm", "name")) as f:
+                    dmName = f.read().strip()
+            except FileNotFoundError:
+                dmName = None
+            self._devDict[name] = (size, self._readUdevData(devno), dmName)
+
+    def isOutdated(self):
+        return self._getSeqnum() != self._seqnum
+
+    def getBlkDevSize(self, devPath):
+        name = self._devPathToName(devPath)
+        if name is None:
+            return FmUtil.getBlkDevSize(devPath)
+        return self._devDict[name][0]
+
+    def getBlkDevUuid(self, devPath):
+        props = self._getUdevProps(devPath)
+        if props is None or "ID_FS_UUID" not in props:
+            return FmUtil.getBlkDevUuid(devPath)
+        return props["ID_FS_UUID"]
+
+    def getBlkDevFsType(self, devPath):
+        props = self._getUdevProps(devPath)
+        if props is None or "ID_FS_TYPE" not in props:
+            return FmUtil.getBlkDevFsType(devPath)
+        return props["ID_FS_TYPE"].lower()
+
+    def getBlkDevPartitionTableType(self, devPath):
+        if not FmUtil.devPathIsDiskOrPartition(devPath):
+            devPath = FmUtil.devPathPartitionToDisk(devPath)
+
+        props = self._getUdevProps(devPath)
+        if props is None or "ID_PART_TABLE_TYPE" not in props:
+            return FmUtil.getBlkDevPartitionTableType(devPath)
+        return props["ID_PART_TABLE_TYPE"]
+
+    def getBlkDevLvmInfo(self, devPath):
+        """Returns (vg-name, lv-name), returns None if the device is not lvm"""
+
+        name = self._devPathToName(devPath)
+        if name is None:
+            return FmUtil.getBlkDevLvmInfo(devPath)
+        dmName = self._devDict[name][2]
+        if dmName is None:
+            return None
+        ret = dmName.split(".")
+        if len(ret) == 2:
+            return ret
+        ret = dmName.split("-")                 # compatible with old lvm version
+        if len(ret) == 2:
+            return ret
+        return FmUtil.getBlkDevLvmInfo(devPath)
+
+    def lvmVgExists(self, vgName):
+        return any(x[1] == vgName for x in self._getPvList())
+
+    def lvmGetPvList(self, vgName):
+        """Returns the physical volumes of the volume group, missing physical volumes are ignored"""
+
+        return [x[0] for x in self._getPvList() if x[1] == vgName and x[0].startswith("/dev/")]
+
+    def lvmLvExists(self, vgName, lvName):
+        if self._lvList is None:
+            self._lvList = self._lvmReport("lvs", "vg_name,lv_name")
+        return (vgName, lvName) in self._lvList
+
+    def lvmGetSlaveDevPathList(self, vgName):
+        ret = []
+        for pvName, vgName2 in self._getPvList():
+            if vgName2 != vgName:
+                continue
+            if pvName == "[unknown]":
+                raise Exception("volume group %s not fully loaded" % (vgName))
+            ret.append(pvName)
+        return ret
+
+    def _getPvList(self):
+        if self._pvList is None:
+            self._pvList = self._lvmReport("pvs", "pv_name,vg_name")
+        return self._pvList
+
+    def _lvmReport(self, command, fields):
+        ret = []
+        out = FmUtil.cmdCall("/sbin/lvm", command, "--noheadings", "--separator", ":", "-o", fields)
+        for line in out.split("\n"):
+            line = line.strip()
+            if line != "":
+                ret.append(tuple(line.split(":", 1)))
+        return ret
+
+    def _devPathToName(self, devPath):
+        # /dev/mapper/* are symlinks to /dev/dm-*
+        name = os.path.basename(os.path.realpath(devPath))
+        return name if name in self._devDict else None
+
+    def _getUdevProps(self, devPath):
+        name = self._devPathToName(devPath)
+        if name is None:
+            return None
+        return self._devDict[name][1]
+
+    def _readUdevData(self, devno):
+        ret = dict()
+        try:
+            with open("/run/udev/data/b%s" % (devno)) as f:
+                for line in f.read().split("\n"):
+                    if line.startswith("E:"):
+                        k, v = line[2:].split("=", 1)
+                        ret[k] = v
+        except FileNotFoundError:
+            return None
+        return ret
+
+    def _getSeqnum(self):
+        with open("/sys/kernel/uevent_seqnum") as f:
+            return int(f.read())
+
+
 _swapFilename = "/var/swap.dat"
@@ -17,6 +17,7 @@ from helper_boot_initramfs import FkmInitramfsBuilder
 from helper_build_server import BuildServerSelector
 from helper_pkg_warehouse import PkgWarehouse
 from helper_dyncfg import DynCfgModifier
+from helper_task_graph import TaskGraph
 
 
 class FmSysUpdater:
@@ -66,137 +67,16 @@ class FmSysUpdater:
             buildServer.startWorking()
             print("")
 
-        # do sync
+        # do sync and fetch
+        # tasks are run concurrently when there's no build server
+        graph = TaskGraph(self.infoPrinter, bParallel=(buildServer is None))
         if bSync or (not bSync and not bFetch and not bBuild):
-            # update cache
-            self.infoPrinter.printInfo(">> Getting system component version...")
-            self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-kcache", FmConst.kcacheDir)
-            print("")
-
-            # sync repository directories
-            for repoName in pkgwh.repoman.getRepositoryList():
-                if pkgwh.repoman.isRepoExist(repoName):
-                    repoDir = pkgwh.repoman.getRepoDir(repoName)
-                    self.infoPrinter.printInfo(">> Synchronizing repository \"%s\"..." % (repoName))
-                    self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-repo %s" % (repoName), repoDir)
-                    print("")
-
-            # sync ebuild2 directory
-            if True:
-                self.infoPrinter.printInfo(">> Synchronizing ebuild2 directory...")
-                self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-ebuild2", FmConst.ebuild2Dir)
-                print("")
-
-            # sync overlay directories
-            for oname in pkgwh.layman.getOverlayList():
-                self.infoPrinter.printInfo(">> Synchronizing overlay \"%s\"..." % (oname))
-                self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-overlay %s" % (oname), pkgwh.layman.getOverlayFilesDir(oname))
-                print("")
-
-            # add pre-enabled overlays
-            for oname, ourl in pkgwh.getPreEnableOverlays().items():
-                if not pkgwh.layman.isOverlayExist(oname):
-                    self.infoPrinter.printInfo(">> Installing overlay \"%s\"..." % (oname))
-                    argstr = "add-trusted-overlay %s \'%s\'" % (oname, ourl)
-                    if buildServer is None:
-                        FmUtil.shellExec(self.opSync + " " + argstr)
-                    else:
-                        buildServer.sshExec(self.opSync + " " + argstr)
-                        buildServer.syncDownWildcardList([
-                            os.path.join(pkgwh.layman.getOverlayFilesDir(oname), "***"),
-                            pkgwh.layman.getOverlayDir(oname),
-                            pkgwh.layman.getOverlayCfgReposFile(oname),
-                        ], quiet=True)
-                    print("")
-
-            # add pre-enabled overlays by pre-enabled package
-            for oname, data in pkgwh.getPreEnablePackages().items():
-                if not pkgwh.layman.isOverlayExist(oname):
-                    self.infoPrinter.printInfo(">> Installing overlay \"%s\"..." % (oname))
-                    argstr = "add-transient-overlay %s \'%s\'" % (oname, data[0])
-                    if buildServer is None:
-                        FmUtil.shellExec(self.opSync + " " + argstr)
-                    else:
-                        buildServer.sshExec(self.opSync + " " + argstr)
-                        buildServer.syncDownWildcardList([
-                            os.path.join(pkgwh.layman.getOverlayFilesDir(oname), "***"),
-                            pkgwh.layman.getOverlayDir(oname),
-                            pkgwh.layman.getOverlayCfgReposFile(oname),
-                        ], quiet=True)
-                    print("")
-
-            # add pre-enabled packages
-            for oname, data in pkgwh.getPreEnablePackages().items():
-                tlist = [x for x in data[1] if not pkgwh.layman.isOverlayPackageEnabled(oname, x)]
-                if tlist != []:
-                    self.infoPrinter.printInfo(">> Enabling packages in overlay \"%s\"..." % (oname))
-                    argstr = "enable-overlay-package %s %s" % (oname, " ".join(["\'%s\'" % (x) for x in tlist]))
-                    self._exec(buildServer, self.opSync, argstr)
-                    print("")
-            if buildServer is not None:
-                buildServer.syncDownDirectory(os.path.join(FmConst.portageDataDir, "overlay-*"), quiet=True)
-
-            # refresh package related stuff
-            self._execAndSyncDownQuietly(buildServer, self.opSync, "refresh-package-related-stuff", FmConst.portageCfgDir)
-
-            # eliminate "Performing Global Updates"
-            self._execAndSyncDownQuietly(buildServer, self.opSync, "touch-portage-tree", FmConst.portageDbDir)     # FIXME
-
-        # do fetch
+            self._addSyncTasks(graph, buildServer, pkgwh)
         if bFetch or (not bSync and not bFetch and not bBuild):
-            # update kernel in kcache
-            if True:
-                v = kcache.getLatestKernelVersion()
-                fn = os.path.basename(kcache.getKernelFileByVersion(v))
-                self.infoPrinter.printInfo(">> Fetching %s..." % (fn))
-                self._execAndSyncDownQuietly(buildServer, self.opFetch, "kernel \'%s\'" % (v), FmConst.kcacheDir)
-                print("")
-
-            # update firmware in kcache
-            if True:
-                v = kcache.getLatestFirmwareVersion()
-                fn = os.path.basename(kcache.getFirmwareFileByVersion(v))
-                self.infoPrinter.printInfo(">> Fetching %s..." % (fn))
-                self._execAndSyncDownQuietly(buildServer, self.opFetch, "firmware \'%s\'" % (v), FmConst.kcacheDir)
-                print("")
-
-            # update extra firmware in kcache
-            for name in ["ath6k", "ath10k"]:
-                self.infoPrinter.printInfo(">> Fetching %s firmware..." % (name))
-                self._execAndSyncDownQuietly(buildServer, self.opFetch, "extra-firmware \'%s\'" % (name), FmConst.kcacheDir)
-                print("")
-
-            # update wireless-regulatory-database in kcache
-            if True:
-                v = kcache.getLatestWirelessRegDbVersion()
-                fn = os.path.basename(kcache.getWirelessRegDbFileByVersion(v))
-                self.infoPrinter.printInfo(">> Fetching %s..." % (fn))
-                self._execAndSyncDownQuietly(buildServer, self.opFetch, "wireless-regdb \'%s\'" % (v), FmConst.kcacheDir)
-                print("")
-
-            # update tbs-driver in kcache
-            if "tbs" in kcache.getKernelUseFlags():
-                self.infoPrinter.printInfo(">> Fetching TBS driver...")
-                self._execAndSyncDownQuietly(buildServer, self.opFetch, "tbs-driver", FmConst.kcacheDir)
-                print("")
-
-            # update vbox-driver in kcache
-            if "vbox" in kcache.getKernelUseFlags():
-                self.infoPrinter.printInfo(">> Fetching VirtualBox driver...")
-                self._execAndSyncDownQuietly(buildServer, self.opFetch, "vbox-driver", FmConst.kcacheDir)
-                print("")
-
-            # update distfiles
-            self.infoPrinter.printInfo(">> Fetching %s..." % (FmConst.distDir))
-            if buildServer is not None:
-                try:
-                    buildServer.sshExec(self.opFetch + " distfiles")
-                finally:
-                    self.infoPrinter.printInfo(">> Synchronizing down %s..." % (FmConst.distDir))
-                    buildServer.syncDownDirectory(FmConst.distDir)
-                    print("")
-            else:
-                FmUtil.shellExec(self.opFetch + " distfiles")
+            self._addFetchTasks(graph, buildServer, kcache)
+        graph.run()
+        if buildServer is None:
+            graph.printTimings()
 
         # do build
         if bBuild or (not bSync and not bFetch and not bBuild):
@@ -271,6 +151,146 @@ class FmSysUpdater:
         if buildServer is not None:
             buildServer.dispose()
 
+    def _addSyncTasks(self, graph, buildServer, pkgwh):
+        syncTaskList = []
+
+        # update cache
+        graph.addTask("sync-kcache", "Getting system component version",
+                      lambda out: self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-kcache", FmConst.kcacheDir, out),
+                      resource="network")
+        syncTaskList.append("sync-kcache")
+
+        # sync repository directories
+        repoTaskList = []
+        for repoName in pkgwh.repoman.getRepositoryList():
+            if pkgwh.repoman.isRepoExist(repoName):
+                repoDir = pkgwh.repoman.getRepoDir(repoName)
+                graph.addTask("sync-repo-%s" % (repoName), "Synchronizing repository \"%s\"" % (repoName),
+                              lambda out, repoName=repoName, repoDir=repoDir: self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-repo %s" % (repoName), repoDir, out),
+                              resource="network")
+                repoTaskList.append("sync-repo-%s" % (repoName))
+        syncTaskList += repoTaskList
+
+        # sync ebuild2 directory
+        graph.addTask("sync-ebuild2", "Synchronizing ebuild2 directory",
+                      lambda out: self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-ebuild2", FmConst.ebuild2Dir, out),
+                      resource="network")
+        syncTaskList.append("sync-ebuild2")
+
+        # sync overlay directories
+        # syncing a trusted overlay removes the packages duplicated in the repositories, so the repositories must be synced first
+        for oname in pkgwh.layman.getOverlayList():
+            graph.addTask("sync-overlay-%s" % (oname), "Synchronizing overlay \"%s\"" % (oname),
+                          lambda out, oname=oname: self._execAndSyncDownQuietly(buildServer, self.opSync, "sync-overlay %s" % (oname), pkgwh.layman.getOverlayFilesDir(oname), out),
+                          depends=repoTaskList, resource="network")
+            syncTaskList.append("sync-overlay-%s" % (oname))
+
+        # add pre-enabled overlays and packages, refresh package related stuff
+        graph.addTask("post-sync", "Refreshing overlays and package related stuff",
+                      lambda out: self._postSync(buildServer, pkgwh, out),
+                      depends=syncTaskList, resource="disk")
+
+    def _postSync(self, buildServer, pkgwh, out):
+        # add pre-enabled overlays
+        for oname, ourl in pkgwh.getPreEnableOverlays().items():
+            if not pkgwh.layman.isOverlayExist(oname):
+                out.printInfo("Installing overlay \"%s\"..." % (oname))
+                argstr = "add-trusted-overlay %s \'%s\'" % (oname, ourl)
+                if buildServer is None:
+                    out.shellExec(self.opSync + " " + argstr)
+                else:
+                    buildServer.sshExec(self.opSync + " " + argstr)
+                    buildServer.syncDownWildcardList([
+                        os.path.join(pkgwh.layman.getOverlayFilesDir(oname), "***"),
+                        pkgwh.layman.getOverlayDir(oname),
+                        pkgwh.layman.getOverlayCfgReposFile(oname),
+                    ], quiet=True)
+
+        # add pre-enabled overlays by pre-enabled package
+        for oname, data in pkgwh.getPreEnablePackages().items():
+            if not pkgwh.layman.isOverlayExist(oname):
+                out.printInfo("Installing overlay \"%s\"..." % (oname))
+                argstr = "add-transient-overlay %s \'%s\'" % (oname, data[0])
+                if buildServer is None:
+                    out.shellExec(self.opSync + " " + argstr)
+                else:
+                    buildServer.sshExec(self.opSync + " " + argstr)
+                    buildServer.syncDownWildcardList([
+                        os.path.join(pkgwh.layman.getOverlayFilesDir(oname), "***"),
+                        pkgwh.layman.getOverlayDir(oname),
+                        pkgwh.layman.getOverlayCfgReposFile(oname),
+                    ], quiet=True)
+
+        # add pre-enabled packages
+        for oname, data in pkgwh.getPreEnablePackages().items():
+            tlist = [x for x in data[1] if not pkgwh.layman.isOverlayPackageEnabled(oname, x)]
+            if tlist != []:
+                out.printInfo("Enabling packages in overlay \"%s\"..." % (oname))
+                argstr = "enable-overlay-package %s %s" % (oname, " ".join(["\'%s\'" % (x) for x in tlist]))
+                self._exec(buildServer, self.opSync, argstr, out)
+        if buildServer is not None:
+            buildServer.syncDownDirectory(os.path.join(FmConst.portageDataDir, "overlay-*"), quiet=True)
+
+        # refresh package related stuff
+        self._execAndSyncDownQuietly(buildServer, self.opSync, "refresh-package-related-stuff", FmConst.portageCfgDir, out)
+
+        # eliminate "Performing Global Updates"
+        self._execAndSyncDownQuietly(buildServer, self.opSync, "touch-portage-tree", FmConst.portageDbDir, out)     # FIXME
+
+    def _addFetchTasks(self, graph, buildServer, kcache):
+        # versions are read from kcache when the task starts, after kcache is synchronized
+
+        # update kernel in kcache
+        graph.addTask("fetch-kernel",
+                      lambda: "Fetching %s" % (os.path.basename(kcache.getKernelFileByVersion(kcache.getLatestKernelVersion()))),
+                      lambda out: self._execAndSyncDownQuietly(buildServer, self.opFetch, "kernel \'%s\'" % (kcache.getLatestKernelVersion()), FmConst.kcacheDir, out),
+                      depends=["sync-kcache"], resource="network")
+
+        # update firmware in kcache
+        graph.addTask("fetch-firmware",
+                      lambda: "Fetching %s" % (os.path.basename(kcache.getFirmwareFileByVersion(kcache.getLatestFirmwareVersion()))),
+                      lambda out: self._execAndSyncDownQuietly(buildServer, self.opFetch, "firmware \'%s\'" % (kcache.getLatestFirmwareVersion()), FmConst.kcacheDir, out),
+                      depends=["sync-kcache"], resource="network")
+
+        # update extra firmware in kcache
+        for name in ["ath6k", "ath10k"]:
+            graph.addTask("fetch-%s-firmware" % (name), "Fetching %s firmware" % (name),
+                          lambda out, name=name: self._execAndSyncDownQuietly(buildServer, self.opFetch, "extra-firmware \'%s\'" % (name), FmConst.kcacheDir, out),
+                          depends=["sync-kcache"], resource="network")
+
+        # update wireless-regulatory-database in kcache
+        graph.addTask("fetch-wireless-regdb",
+                      lambda: "Fetching %s" % (os.path.basename(kcache.getWirelessRegDbFileByVersion(kcache.getLatestWirelessRegDbVersion()))),
+                      lambda out: self._execAndSyncDownQuietly(buildServer, self.opFetch, "wireless-regdb \'%s\'" % (kcache.getLatestWirelessRegDbVersion()), FmConst.kcacheDir, out),
+                      depends=["sync-kcache"], resource="network")
+
+        # update tbs-driver in kcache
+        if "tbs" in kcache.getKernelUseFlags():
+            graph.addTask("fetch-tbs-driver", "Fetching TBS driver",
+                          lambda out: self._execAndSyncDownQuietly(buildServer, self.opFetch, "tbs-driver", FmConst.kcacheDir, out),
+                          depends=["sync-kcache"], resource="network")
+
+        # update vbox-driver in kcache
+        if "vbox" in kcache.getKernelUseFlags():
+            graph.addTask("fetch-vbox-driver", "Fetching VirtualBox driver",
+                          lambda out: self._execAndSyncDownQuietly(buildServer, self.opFetch, "vbox-driver", FmConst.kcacheDir, out),
+                          depends=["sync-kcache"], resource="network")
+
+        # update distfiles
+        graph.addTask("fetch-distfiles", "Fetching %s" % (FmConst.distDir),
+                      lambda out: self._fetchDistfiles(buildServer, out),
+                      depends=["post-sync"], resource="network")
+
+    def _fetchDistfiles(self, buildServer, out):
+        if buildServer is not None:
+            try:
+                buildServer.sshExec(self.opFetch + " distfiles")
+            finally:
+                out.printInfo("Synchronizing down %s..." % (FmConst.distDir))
+                buildServer.syncDownDirectory(FmConst.distDir)
+        else:
+            out.shellExec(self.opFetch + " distfiles")
+
     def stablize(self):
         layout = self.param.storageManager.getStorageLayout()
 
@@ -303,9 +323,12 @@ class FmSysUpdater:
             self.param.storageManager.syncBootPartition(layout)
             print("")
 
-    def _exec(self, buildServer, cmd, argstr):
+    def _exec(self, buildServer, cmd, argstr, out=None):
         if buildServer is None:
-            FmUtil.shellExec(cmd + " " + argstr)
+            if out is not None:
+                out.shellExec(cmd + " " + argstr)
+            else:
+                FmUtil.shellExec(cmd + " " + argstr)
         else:
             buildServer.sshExec(cmd + " " + argstr)
 
@@ -316,9 +339,12 @@ class FmSysUpdater:
         else:
             return buildServer.getFile(resultFile).decode("iso8859-1")
 
-    def _execAndSyncDownQuietly(self, buildServer, cmd, argstr, directory):
+    def _execAndSyncDownQuietly(self, buildServer, cmd, argstr, directory, out=None):
         if buildServer is None:
-            FmUtil.shellExec(cmd + " " + argstr)
+            if out is not None:
+                out.shellExec(cmd + " " + argstr)
+            else:
+                FmUtil.shellExec(cmd + " " + argstr)
         else:
             buildServer.sshExec(cmd + " " + argstr)
             buildServer.syncDownDirectory(directory, quiet=True)
@@ -358,7 +384,9 @@ class FmSysUpdater:
                 pass
             else:
                 assert False
-            iBuilder.build(buildTarget.initrdFile, buildTarget.initrdTarFile)
+            if not iBuilder.build(buildTarget.initrdFile, buildTarget.initrdTarFile):
+                print("Initramfs content not changed.")
+            print("Time used: %s." % (", ".join("%s %.1fs" % (x[0], x[1]) for x in iBuilder.stageTimeList)))
         else:
             print("No operation needed.")
 
@@ -6,12 +6,14 @@ import re
 import pwd
 import grp
 import portage
-import fnmatch
 from fm_util import FmUtil
 from fm_param import FmConst
 from fm_param import UsrParam
 from helper_pkg_warehouse import Ebuild2Dir
 from helper_pkg_warehouse import Ebuild2CheckError
+from helper_pattern_matcher import GlobPatternMatcher
+from helper_check_engine import CheckEngine
+from helper_tree_walker import TreeWalker
 
 
 class FmChecker:
@@ -24,50 +26,52 @@ class FmChecker:
 
         self.uid = uid
         self.userName = pwd.getpwuid(uid).pw_name
+        try:
+            self.gid = grp.getgrnam(self.userName).gr_gid
+        except KeyError:
+            self.gid = None
         self.homeDir = FmUtil.getHomeDir(self.userName)
 
         self.bAutoFix = False
 
-    def doCheck(self, bAutoFix):
+    def doCheck(self, bAutoFix, reportFile=None, reportFormat="json"):
         self.bAutoFix = bAutoFix
 
         if not os.path.exists(self.homeDir):
-            self.infoPrinter.printError("directory \"%s\" does not exist." % (self.homeDir))
+            self.infoPrinter.printError("directory \"%s\" does not exist." % (self.homeDir), path=self.homeDir)
             return
 
-        self.infoPrinter.printInfo(">> Check directory %s..." % (self.homeDir))
-        self.infoPrinter.incIndent()
-        self._checkItem002()
-        self.infoPrinter.decIndent()
+        # all the checks are read-only
+        engine = CheckEngine(self.param.infoPrinter)
 
-        self.infoPrinter.printInfo(">> Check files in directory %s..." % (self.homeDir))
-        self.infoPrinter.incIndent()
-        self._checkItem003()
-        self.infoPrinter.decIndent()
+        engine.beginGroup(">> Check directory %s..." % (self.homeDir))
+        engine.addCheck("home-dir", self._checkItem002)
+        engine.endGroup()
 
-        self.infoPrinter.printInfo(">> Check user configuration...")
-        self.infoPrinter.incIndent()
-        self._checkItem004()
-        self.infoPrinter.decIndent()
+        engine.beginGroup(">> Check files in directory %s..." % (self.homeDir))
+        engine.addCheck("home-files", self._checkItem003)
+        engine.endGroup()
 
-        self.infoPrinter.printInfo(">> Do per-package check...")
-        self.infoPrinter.incIndent()
-        try:
-            for pkgNameVer in sorted(FmUtil.getFileList(FmConst.portageDbDir, 2, "d")):
-                if FmUtil.repoIsSysFile(pkgNameVer):
-                    continue
-                if pkgNameVer.split("/")[1].startswith("-MERGING"):
-                    continue
-                self._checkPkgEbuild2(pkgNameVer)
-        finally:
-            self.infoPrinter.decIndent()
+        engine.beginGroup(">> Check user configuration...")
+        engine.addCheck("user-configuration", self._checkItem004)
+        engine.endGroup()
 
-        self.infoPrinter.printInfo(">> Find user cruft files...")
-        self.infoPrinter.incIndent()
+        engine.beginGroup(">> Do per-package check...")
+        engine.addCheck("packages", self._checkPackages)
+        engine.endGroup()
+
+        engine.beginGroup(">> Find user cruft files...")
+        engine.addCheck("user-cruft", self._checkCruft)
+        engine.endGroup()
+
+        self.infoPrinter = engine.printer
         try:
-            self._checkCruft()
+            engine.run(bAutoFix)
         finally:
-            self.infoPrinter.decIndent()
+            self.infoPrinter = self.param.infoPrinter
+            if reportFile is not None:
+                engine.writeReport(reportFile, reportFormat)
+        return engine.getResultList()
 
     def _checkItem002(self):
         self.infoPrinter.printInfo("- Processing")
@@ -75,11 +79,11 @@ class FmChecker:
         # check home directory permission
         s = os.stat(self.homeDir)
         if s.st_mode != 0o40700:
-            self.infoPrinter.printError("Invalid permission for directory \"%s\"." % (self.homeDir))
+            self.infoPrinter.printError("Invalid permission for directory \"%s\"." % (self.homeDir), path=self.homeDir)
         if pwd.getpwuid(s.st_uid).pw_name != self.userName:
-            self.infoPrinter.printError("Invalid owner for directory \"%s\"." % (self.homeDir))
+            self.infoPrinter.printError("Invalid owner for directory \"%s\"." % (self.homeDir), path=self.homeDir)
         if grp.getgrgid(s.st_gid).gr_name != self.userName:
-            self.infoPrinter.printError("Invalid owner group for directory \"%s\"." % (self.homeDir))
+            self.infoPrinter.printError("Invalid owner group for directory \"%s\"." % (self.homeDir), path=self.homeDir)
 
     def _checkItem003(self):
         self.infoPrinter.printInfo("- Processing")
@@ -88,27 +92,24 @@ class FmChecker:
         pass
 
         # check file permission for all the files in home directory
-        for root, dirs, files in os.walk(self.homeDir):
-            for f in files:
-                fullfn = os.path.join(root, f)
-                if not os.path.exists(fullfn):
-                    continue        # ignore broken link
-                s = os.lstat(fullfn)
-                owner = pwd.getpwuid(s.st_uid).pw_name
-                owner_group = grp.getgrgid(s.st_gid).gr_name
-                if owner != self.userName:
-                    self.infoPrinter.printError("Invalid owner (%s) for file \"%s\"." % (owner, fullfn))
-                if owner_group != self.userName:
-                    self.infoPrinter.printError("Invalid owner group (%s) for file \"%s\"." % (owner_group, fullfn))
-            for d in dirs:
-                fullfn = os.path.join(root, d)
-                s = os.lstat(fullfn)
-                owner = pwd.getpwuid(s.st_uid).pw_name
-                owner_group = grp.getgrgid(s.st_gid).gr_name
-                if owner != self.userName:
-                    self.infoPrinter.printError("Invalid owner (%s) for directory \"%s\"." % (owner, fullfn))
-                if owner_group != self.userName:
-                    self.infoPrinter.printError("Invalid owner group (%s) for directory \"%s\"." % (owner_group, fullfn))
+        # findings are printed as soon as they are found, in no particular order
+        idCache = _IdNameCache()
+        for entry in TreeWalker(self.homeDir).walk():
+            s = entry.stat(follow_symlinks=False)
+            if s.st_uid == self.uid and s.st_gid == self.gid:
+                continue
+            if entry.is_dir():
+                desc = "directory"
+            elif entry.is_symlink() and not os.path.exists(entry.path):
+                continue        # ignore broken link
+            else:
+                desc = "file"
+            owner = idCache.getUserName(s.st_uid)
+            owner_group = idCache.getGroupName(s.st_gid)
+            if owner != self.userName:
+                self.infoPrinter.printError("Invalid owner (%s) for %s \"%s\"." % (owner, desc, entry.path), path=entry.path)
+            if owner_group != self.userName:
+                self.infoPrinter.printError("Invalid owner group (%s) for %s \"%s\"." % (owner_group, desc, entry.path), path=entry.path)
 
     def _checkItem004(self):
         self.infoPrinter.printInfo("- Processing")
@@ -123,14 +124,14 @@ class FmChecker:
                     m = re.fullmatch("export LANG=[\'\"]?(\\S*?)[\'\"]?", line)
                     if m is not None:
                         if localeStr is not None:
-                            self.infoPrinter.printError("Duplicate locale definition.")
+                            self.infoPrinter.printError("Duplicate locale definition.", path=profileFn)
                         localeStr = m.group(1)
             if localeStr is None:
-                self.infoPrinter.printError("No locale defined.")
+                self.infoPrinter.printError("No locale defined.", path=profileFn)
             else:
                 localeList = [x for x in FmUtil.cmdCall("/usr/bin/locale", "-a").split("\n") if x != ""]
                 if localeStr not in localeList:
-                    self.infoPrinter.printError("Locale definition (%s) is invalid." % (localeStr))
+                    self.infoPrinter.printError("Locale definition (%s) is invalid." % (localeStr), path=profileFn)
 
         # check broken link in configuration directories
         for root, dirs, files in os.walk(self.homeDir):
@@ -150,7 +151,11 @@ class FmChecker:
             for f in files:
                 fullfn = os.path.join(root, f)
                 if not os.path.exists(fullfn):
-                    self.infoPrinter.printError("File \"%s\" is a broken link." % (fullfn))
+                    self.infoPrinter.printError("File \"%s\" is a broken link." % (fullfn), path=fullfn)
+
+    def _checkPackages(self):
+        for pkgNameVer in self._getInstalledPkgNameVerList():
+            self._checkPkgEbuild2(pkgNameVer)
 
     def _checkPkgEbuild2(self, pkgNameVer):
         e2dir = Ebuild2Dir()
@@ -161,7 +166,7 @@ class FmChecker:
             try:
                 e2dir.execUserPkgCheckScript(fbasename, self.uid, self.userName, self.homeDir)
             except Ebuild2CheckError as e:
-                self.infoPrinter.printError(e.message)
+                self.infoPrinter.printError(e.message, pkg=pkgNameVer)
             finally:
                 self.infoPrinter.decIndent()
 
@@ -169,13 +174,6 @@ class FmChecker:
         self.infoPrinter.printInfo("- Processing")
         self.infoPrinter.incIndent()
         try:
-            def filterByPatternSet(cruftFileSet, patternSet):
-                ret = set()
-                for fn in cruftFileSet:
-                    if not any(fnmatch.fnmatchcase(fn, pattern) for pattern in patternSet):
-                        ret.add(fn)
-                return ret
-
             # get whole file set
             cruftFileSet = set()
             for f in set(FmUtil.cmdCall("/usr/bin/find", self.homeDir, "-print0").split("\x00")):
@@ -203,18 +201,52 @@ class FmChecker:
                     patternSet.add(os.path.join(self.homeDir, x))
                     patternSet.add(os.path.realpath(os.path.join(self.homeDir, x)))
 
-                cruftFileSet = filterByPatternSet(cruftFileSet, patternSet)
+                cruftFileSet = GlobPatternMatcher(patternSet).filter(cruftFileSet)
 
             # per-package filter
-            for cp in portage.db[portage.root]['vartree'].dbapi.cp_all():
-                patternSet = Ebuild2Dir().getUserCruftFilterPatternSet(self.userName, self.homeDir, cp)
-                if len(patternSet) == 0:
-                    # for performance
-                    continue
-                cruftFileSet = filterByPatternSet(cruftFileSet, patternSet)
+            cpList = sorted(set(portage.versions.cpv_getkey(x) for x in self._getInstalledPkgNameVerList()))
+            patternSet = set()
+            for cp, patternSet2 in Ebuild2Dir().getUserCruftFilterPatternDict(self.userName, self.homeDir, cpList).items():
+                patternSet |= patternSet2
+            cruftFileSet = GlobPatternMatcher(patternSet).filter(cruftFileSet)
 
             # show
             for cf in sorted(list(cruftFileSet)):
-                self.infoPrinter.printError("Cruft file found: %s" % (cf))
+                self.infoPrinter.printError("Cruft file found: %s" % (cf), path=cf)
         finally:
             self.infoPrinter.decIndent()
+
+    def _getInstalledPkgNameVerList(self):
+        ret = []
+        for pkgNameVer in sorted(FmUtil.getFileList(FmConst.portageDbDir, 2, "d")):
+            if FmUtil.repoIsSysFile(pkgNameVer):
+                continue
+            if pkgNameVer.split("/")[1].startswith("-MERGING"):
+                continue
+            ret.append(pkgNameVer)
+        return ret
+
+
+class _IdNameCache:
+
+    """pwd.getpwuid() and grp.getgrgid() may do NSS lookups, so the results are memoized"""
+
+    def __init__(self):
+        self._userDict = dict()
+        self._groupDict = dict()
+
+    def getUserName(self, uid):
+        if uid not in self._userDict:
+            try:
+                self._userDict[uid] = pwd.getpwuid(uid).pw_name
+            except KeyError:
+                self._userDict[uid] = str(uid)
+        return self._userDict[uid]
+
+    def getGroupName(self, gid):
+        if gid not in self._groupDict:
+            try:
+                self._groupDict[gid] = grp.getgrgid(gid).gr_name
+            except KeyError:
+                self._groupDict[gid] = str(gid)
+        return self._groupDict[gid]
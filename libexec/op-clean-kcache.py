@@ -50,8 +50,19 @@ else:
     for f in wirelessRegDbFileList:
         print("              %s" % (f))
 
+# get pristine source tree list to be removed in cache directory
+pristineTreeList = kcacheUpdater.getOldPristineTreeList()
+
+# show information
+print("            Pristine source trees to be removed in \"%s\":" % (FmConst.kcacheDir))
+if pristineTreeList == []:
+    print("              None")
+else:
+    for f in pristineTreeList:
+        print("              %s" % (f))
+
 # remove files
-if len(kernelFileList) > 0 or len(firmwareFileList) > 0 or len(wirelessRegDbFileList) > 0:
+if len(kernelFileList) > 0 or len(firmwareFileList) > 0 or len(wirelessRegDbFileList) > 0 or len(pristineTreeList) > 0:
     print("        - Deleting...")
     for f in kernelFileList:
         FmUtil.forceDelete(os.path.join(FmConst.kcacheDir, f))
@@ -59,3 +70,5 @@ if len(kernelFileList) > 0 or len(firmwareFileList) > 0 or len(wirelessRegDbFile
         FmUtil.forceDelete(os.path.join(FmConst.kcacheDir, f))
     for f in wirelessRegDbFileList:
         FmUtil.forceDelete(os.path.join(FmConst.kcacheDir, f))
+    for f in pristineTreeList:
+        FmUtil.forceDelete(os.path.join(FmConst.kcacheDir, f))
@@ -4,11 +4,11 @@
 import os
 import re
 import sys
-import glob
 sys.path.append('/usr/lib64/fpemud-refsystem')
 from fm_util import FmUtil
 from helper_boot import FkmBootDir
 from helper_boot import FkmBootEntry
+from helper_kmod_index import KmodInfoIndex
 
 
 bootDir = "/boot"
@@ -38,18 +38,13 @@ if os.path.exists(firmwareDir):
     for ver in os.listdir(kernelModuleDir):
         if ver in moduleFileList:
             continue
-        verDir = os.path.join(kernelModuleDir, ver)
-        for fullfn in glob.glob(os.path.join(verDir, "**", "*.ko"), recursive=True):
-            # python-kmod bug: can only recognize the last firmware in modinfo
-            # so use the command output of modinfo directly
-            for line in FmUtil.cmdCall("/bin/modinfo", fullfn).split("\n"):
-                m = re.fullmatch("firmware: +(\\S.*)", line)
-                if m is None:
-                    continue
-                firmwareName = m.group(1)
+        kmodIndex = KmodInfoIndex(os.path.join(kernelModuleDir, ver))
+        for fullfn in kmodIndex.getModuleList():
+            for firmwareName in kmodIndex.getFirmwareList(fullfn):
                 if not os.path.exists(os.path.join(firmwareDir, firmwareName)):
                     continue
                 validList.append(firmwareName)
+        kmodIndex.save()
 
     standardFiles = [
         ".ctime",
@@ -98,6 +93,7 @@ if len(bootFileList) > 0 or len(moduleFileList) > 0 or len(firmwareFileList) > 0
         FmUtil.forceDelete(os.path.join(bootDir, f))
     for f in moduleFileList:
         FmUtil.forceDelete(os.path.join(kernelModuleDir, f))
+        FmUtil.forceDelete(KmodInfoIndex.getCacheFile(os.path.basename(f)))
     for f in firmwareFileList:
         fullfn = os.path.join(firmwareDir, f)
         FmUtil.forceDelete(os.path.join(firmwareDir, f))
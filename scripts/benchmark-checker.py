@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import bz2
+import json
+import lzma
+import time
+import random
+import shutil
+import struct
+import hashlib
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from fm_util import FmUtil
+from fm_util import InfoPrinter
+from fm_util import RepoPkgIndex
+from fm_param import FmConst
+from fm_param import UsrParam
+from helper_pkg_file_index import PkgInstalledFileIndex
+from helper_kmod_index import KmodInfoIndex
+from sys_checker import FmSysChecker
+from sys_checker import _CruftFinder
+from usr_checker import FmChecker
+
+
+class FixtureGenerator:
+
+    """
+    Generate a synthetic system in a directory:
+      root/                     fake file system, files are owned by the fake packages, some cruft files are added
+      db/<cat>/<pkg>-<ver>/     fake /var/db/pkg, with CONTENTS, CONTENTS_2 and environment.bz2
+      repo/                     fake ebuild repository
+      ebuild2/                  fake ebuild2 directory, some packages have cruft filter functions
+      home/user/                fake home directory
+      modules/<ver>/            fake /lib/modules/<ver>, modules are minimal ELF files with a .modinfo section
+    """
+
+    def __init__(self, fixtureDir, args):
+        self.fixtureDir = fixtureDir
+        self.args = args
+        self.rootDir = os.path.join(fixtureDir, "root")
+        self.dbDir = os.path.join(fixtureDir, "db")
+        self.repoDir = os.path.join(fixtureDir, "repo")
+        self.ebuild2Dir = os.path.join(fixtureDir, "ebuild2")
+        self.homeDir = os.path.join(fixtureDir, "home", "user")
+        self.modulesDir = os.path.join(fixtureDir, "modules", "5.99.0-benchmark")
+        self.cacheDir = os.path.join(fixtureDir, "cache")
+        self.tmpDir = os.path.join(fixtureDir, "tmp")
+        self.scaleFile = os.path.join(fixtureDir, "scale.json")
+
+    def getScale(self):
+        return {
+            "packages": self.args.packages,
+            "files_per_package": self.args.files,
+            "file_size": self.args.file_size,
+            "repo_packages": self.args.repo_packages,
+            "home_files": self.args.home_files,
+            "modules": self.args.modules,
+            "module_size": self.args.module_size,
+        }
+
+    def isGenerated(self):
+        return FmUtil.cacheLoad(self.scaleFile) == self.getScale()
+
+    def generate(self):
+        for d in [self.rootDir, self.dbDir, self.repoDir, self.ebuild2Dir, self.homeDir, self.modulesDir, self.cacheDir, self.tmpDir]:
+            FmUtil.forceDelete(d)
+            os.makedirs(d)
+
+        random.seed(0)
+        self._generatePackages()
+        self._generateRepository()
+        self._generateHomeDir()
+        self._generateModules()
+
+        with open(self.scaleFile, "w") as f:
+            json.dump(self.getScale(), f)
+
+    def _generatePackages(self):
+        uid = os.getuid()
+        gid = os.getgid()
+        for i in range(0, self.args.packages):
+            cat, pkg = self._pkgName(i)
+            pkgDir = os.path.join(self.dbDir, cat, "%s-1.%d" % (pkg, i % 7))
+            os.makedirs(pkgDir)
+
+            contents = ""
+            contents2 = ""
+            dirList = [os.path.join(self.rootDir, "usr", "lib", pkg), os.path.join(self.rootDir, "usr", "share", pkg)]
+            for d in dirList:
+                os.makedirs(d)
+                s = os.stat(d)
+                contents += "dir %s\n" % (d)
+                contents2 += "dir %s %o %d %d\n" % (d, s.st_mode, uid, gid)
+            for j in range(0, self.args.files):
+                fn = os.path.join(dirList[j % 2], "file%d.%s" % (j, random.choice(["so", "py", "conf", "png"])))
+                buf = os.urandom(self.args.file_size)
+                with open(fn, "wb") as f:
+                    f.write(buf)
+                md5 = hashlib.md5(buf).hexdigest()
+                s = os.stat(fn)
+                contents += "obj %s %s %d\n" % (fn, md5, int(s.st_mtime))
+                contents2 += "obj %s %s %d %o %d %d\n" % (fn, md5, int(s.st_mtime), s.st_mode, uid, gid)
+            if True:
+                fn = os.path.join(dirList[0], "libfoo.so")
+                target = sorted(os.listdir(dirList[0]))[0]
+                os.symlink(target, fn)
+                mtime = int(os.lstat(fn).st_mtime)
+                contents += "sym %s -> %s %d\n" % (fn, target, mtime)
+                contents2 += "sym %s -> %s %d %d %d\n" % (fn, target, mtime, uid, gid)
+
+            # cruft files, half of them are filtered by ebuild2 cruft filter
+            for j in range(0, max(1, self.args.files // 20)):
+                with open(os.path.join(dirList[0], "stale-%d" % (j)), "w") as f:
+                    f.write("stale\n")
+
+            with open(os.path.join(pkgDir, "CONTENTS"), "w") as f:
+                f.write(contents)
+            with open(os.path.join(pkgDir, "CONTENTS_2"), "w") as f:
+                f.write(contents2)
+            with bz2.open(os.path.join(pkgDir, "environment.bz2"), "wt") as f:
+                f.write(self._environmentContent(i))
+            with open(os.path.join(pkgDir, "SLOT"), "w") as f:
+                f.write("0\n")
+            with open(os.path.join(pkgDir, "repository"), "w") as f:
+                f.write("gentoo\n")
+
+            if i % 2 == 0:
+                e2dir = os.path.join(self.ebuild2Dir, cat, pkg)
+                os.makedirs(e2dir)
+                with open(os.path.join(e2dir, pkg + ".ebuild2"), "w") as f:
+                    f.write("pkg_cruft_filter() {\n")
+                    f.write("    echo \"%s/stale-*\"\n" % (dirList[0]))
+                    f.write("}\n")
+                    f.write("\n")
+                    f.write("pkg_cruft_filter_user() {\n")
+                    f.write("    echo \".%s/*\"\n" % (pkg))
+                    f.write("}\n")
+
+    def _generateRepository(self):
+        os.makedirs(os.path.join(self.repoDir, "metadata"))
+        with open(os.path.join(self.repoDir, "metadata", "layout.conf"), "w") as f:
+            f.write("repo-name = benchmark\n")
+        os.makedirs(os.path.join(self.repoDir, "profiles"))
+        with open(os.path.join(self.repoDir, "profiles", "repo_name"), "w") as f:
+            f.write("benchmark\n")
+        for i in range(0, self.args.repo_packages):
+            cat, pkg = self._pkgName(i)
+            d = os.path.join(self.repoDir, cat, pkg)
+            os.makedirs(d)
+            for ver in ["1.0", "1.%d" % (i % 7)]:
+                with open(os.path.join(d, "%s-%s.ebuild" % (pkg, ver)), "w") as f:
+                    f.write("EAPI=7\nSLOT=\"0\"\nKEYWORDS=\"amd64\"\nIUSE=\"doc test\"\n")
+            with open(os.path.join(d, "metadata.xml"), "w") as f:
+                f.write("<pkgmetadata/>\n")
+
+    def _generateHomeDir(self):
+        for i in range(0, self.args.home_files):
+            cat, pkg = self._pkgName(i % self.args.packages)
+            r = i % 4
+            if r == 0:
+                fn = os.path.join(self.homeDir, "." + pkg, "data%d" % (i))                # filtered by ebuild2 for half of the packages
+            elif r == 1:
+                fn = os.path.join(self.homeDir, ".config", pkg, "cfg%d" % (i))            # only ".config" itself is in the global filter
+            elif r == 2:
+                fn = os.path.join(self.homeDir, ".local", "share", "Trash", "files", "trash%d" % (i))
+            else:
+                fn = os.path.join(self.homeDir, "Documents", "doc%d.txt" % (i))           # data files
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            with open(fn, "w") as f:
+                f.write("x\n")
+
+    def _generateModules(self):
+        for i in range(0, self.args.modules):
+            d = os.path.join(self.modulesDir, "kernel", "drivers", "subsys%d" % (i % 40))
+            os.makedirs(d, exist_ok=True)
+            modinfo = [
+                "license=GPL",
+                "alias=pci:v%08Xd*sv*sd*bc*sc*i*" % (i),
+                "depends=%s" % (",".join("mod%d" % (x) for x in range(max(0, i - 2), i))),
+                "firmware=vendor/fw%d.bin" % (i % 300),
+            ]
+            fn = os.path.join(d, "mod%d.ko" % (i))
+            if i % 2 == 0:
+                with open(fn + ".xz", "wb") as f:
+                    f.write(lzma.compress(self._elfModule(modinfo)))
+            else:
+                with open(fn, "wb") as f:
+                    f.write(self._elfModule(modinfo))
+
+    def _elfModule(self, modinfoList):
+        text = os.urandom(self.args.module_size)
+        modinfo = "".join(x + "\x00" for x in modinfoList).encode("utf-8")
+        shstrtab = b"\x00.text\x00.modinfo\x00.shstrtab\x00"
+
+        textOff = 64
+        modinfoOff = textOff + len(text)
+        shstrtabOff = modinfoOff + len(modinfo)
+        shOff = (shstrtabOff + len(shstrtab) + 7) // 8 * 8
+
+        # section header: name, type, flags, addr, offset, size, link, info, addralign, entsize
+        shList = [
+            (0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+            (1, 1, 6, 0, textOff, len(text), 0, 0, 16, 0),
+            (7, 1, 2, 0, modinfoOff, len(modinfo), 0, 0, 1, 0),
+            (16, 3, 0, 0, shstrtabOff, len(shstrtab), 0, 0, 1, 0),
+        ]
+        header = struct.pack("<16sHHIQQQIHHHHHH", b"\x7fELF\x02\x01\x01", 1, 62, 1, 0, 0, shOff, 0, 64, 0, 0, 64, len(shList), len(shList) - 1)
+
+        buf = header + text + modinfo + shstrtab
+        buf += b"\x00" * (shOff - len(buf))
+        for sh in shList:
+            buf += struct.pack("<IIQQQQIIQQ", *sh)
+        return buf
+
+    def _environmentContent(self, i):
+        buf = ""
+        buf += "declare -x CATEGORY=\"%s\"\n" % (self._pkgName(i)[0])
+        buf += "declare -x IUSE=\"doc test %s\"\n" % (" ".join("l10n_x%d" % (x) for x in range(0, 20)))
+        buf += "declare -x USE=\"amd64 elibc_glibc kernel_linux userland_GNU\"\n"
+        for j in range(0, 100):
+            buf += "declare -x VAR%d=\"%s\"\n" % (j, "v" * 40)
+        return buf
+
+    def _pkgName(self, i):
+        # 50 categories, no "-<digit>" in category names
+        cat = "%s-%s" % (["app", "dev", "media", "net", "sys"][i % 5], ["misc", "libs", "util", "tools", "base", "video", "sound", "python", "perl", "fonts"][i // 5 % 10])
+        return (cat, "pkg%d" % (i))
+
+
+class BenchmarkInfoPrinter(InfoPrinter):
+
+    def __init__(self):
+        super().__init__()
+        self.errorCount = 0
+
+    def printInfo(self, s):
+        pass
+
+    def printError(self, s, path=None, pkg=None, bAutoFixable=False):
+        self.errorCount += 1
+
+
+class Benchmark:
+
+    def __init__(self, fixture, repeat):
+        self.fixture = fixture
+        self.repeat = repeat
+        self.resultDict = dict()
+
+    def run(self):
+        f = self.fixture
+
+        self._time("FmUtil.getFileList", lambda: FmUtil.getFileList(f.dbDir, 2, "d"))
+
+        self._time("FmUtil.repoGetPkgNameList", lambda: FmUtil.repoGetPkgNameList(f.repoDir), lambda: RepoPkgIndex._indexDict.clear())
+        self._time("FmUtil.repoGetPkgNameList (revalidate)", lambda: FmUtil.repoGetPkgNameList(f.repoDir))
+
+        cacheFile = os.path.join(f.cacheDir, "installed-files.cache")
+        self._time("PkgInstalledFileIndex (cold)", lambda: PkgInstalledFileIndex(f.dbDir, cacheFile).save(), lambda: FmUtil.forceDelete(cacheFile))
+        self._time("PkgInstalledFileIndex (warm)", lambda: PkgInstalledFileIndex(f.dbDir, cacheFile))
+        fileIndex = PkgInstalledFileIndex(f.dbDir, cacheFile)
+
+        cacheFile = os.path.join(f.cacheDir, "pkg-md5.cache")
+        self._time("FmSysChecker._checkPackages (cold)", lambda: self._runSysCheckerPackages(fileIndex), lambda: FmUtil.forceDelete(cacheFile))
+        self._time("FmSysChecker._checkPackages (warm)", lambda: self._runSysCheckerPackages(fileIndex))
+
+        cacheFile = os.path.join(f.cacheDir, "ebuild2-cruft-filter.cache")
+        self._time("_CruftFinder.findCruft (cold)", lambda: self._runCruftFinder(fileIndex), lambda: FmUtil.forceDelete(cacheFile))
+        self._time("_CruftFinder.findCruft (warm)", lambda: self._runCruftFinder(fileIndex))
+
+        self._time("FmChecker._checkCruft", self._runUsrCheckerCruft)
+
+        cacheFile = os.path.join(f.cacheDir, "kmod-info.cache")
+        self._time("KmodInfoIndex (cold)", lambda: KmodInfoIndex(f.modulesDir, cacheFile).save(), lambda: FmUtil.forceDelete(cacheFile))
+        self._time("KmodInfoIndex (warm)", lambda: KmodInfoIndex(f.modulesDir, cacheFile))
+
+        return self.resultDict
+
+    def _runSysCheckerPackages(self, fileIndex):
+        param = _BenchmarkParam(self.fixture.tmpDir)
+        obj = FmSysChecker(param)
+        obj.fileIndex = fileIndex
+        obj._checkPackages()
+        return param.infoPrinter.errorCount
+
+    def _runCruftFinder(self, fileIndex):
+        param = _BenchmarkParam(self.fixture.tmpDir)
+        return len(_CruftFinder(param, fileIndex, self.fixture.rootDir).findCruft())
+
+    def _runUsrCheckerCruft(self):
+        param = UsrParam()
+        param.infoPrinter = BenchmarkInfoPrinter()
+        obj = FmChecker(param, os.getuid())
+        obj.homeDir = self.fixture.homeDir
+        obj._checkCruft()
+        return param.infoPrinter.errorCount
+
+    def _time(self, name, func, prepareFunc=None):
+        runList = []
+        for i in range(0, self.repeat):
+            if prepareFunc is not None:
+                prepareFunc()
+            t = time.perf_counter()
+            ret = func()
+            runList.append(time.perf_counter() - t)
+
+        self.resultDict[name] = {
+            "min": min(runList),
+            "mean": sum(runList) / len(runList),
+            "runs": runList,
+        }
+        if isinstance(ret, int):
+            self.resultDict[name]["result"] = ret
+        elif isinstance(ret, list):
+            self.resultDict[name]["result"] = len(ret)
+        print("%-40s %8.3fs" % (name, min(runList)), file=sys.stderr)
+
+
+class _BenchmarkParam:
+
+    def __init__(self, tmpDir):
+        self.tmpDir = tmpDir
+        self.infoPrinter = BenchmarkInfoPrinter()
+
+
+def _getCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.realpath(__file__)),
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _compare(oldFile, newResultDict):
+    with open(oldFile, "r") as f:
+        oldResultDict = json.load(f)["results"]
+    for name, value in newResultDict.items():
+        if name not in oldResultDict:
+            continue
+        old = oldResultDict[name]["min"]
+        new = value["min"]
+        ratio = old / new if new > 0 else float("inf")
+        print("%-40s %8.3fs -> %8.3fs  %6.2fx" % (name, old, new, ratio), file=sys.stderr)
+
+
+parser = argparse.ArgumentParser(description="Benchmark the checker, cruft finder and index code paths against a synthetic system.")
+parser.add_argument("--fixture-dir", help="directory to generate the fixture in, it is reused if the scale is the same (default: a temporary directory)")
+parser.add_argument("--packages", type=int, default=300, help="number of installed packages")
+parser.add_argument("--files", type=int, default=40, help="number of files per installed package")
+parser.add_argument("--file-size", type=int, default=4096, help="size of the package files")
+parser.add_argument("--repo-packages", type=int, default=20000, help="number of packages in the repository")
+parser.add_argument("--home-files", type=int, default=5000, help="number of files in the home directory")
+parser.add_argument("--modules", type=int, default=2000, help="number of kernel modules")
+parser.add_argument("--module-size", type=int, default=8192, help="size of the .text section of kernel modules")
+parser.add_argument("--repeat", type=int, default=3, help="number of runs for each benchmark")
+parser.add_argument("--output", help="write JSON results to this file (default: stdout)")
+parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+args = parser.parse_args()
+
+if args.fixture_dir is not None:
+    fixtureDir = os.path.abspath(args.fixture_dir)
+    bRemoveFixture = False
+else:
+    fixtureDir = tempfile.mkdtemp(prefix="fpemud-refsystem-benchmark-")
+    bRemoveFixture = True
+
+try:
+    fixture = FixtureGenerator(fixtureDir, args)
+    if not fixture.isGenerated():
+        print("Generating fixture in %s..." % (fixtureDir), file=sys.stderr)
+        fixture.generate()
+
+    # all the cache files go into the fixture directory
+    FmConst.cacheDir = fixture.cacheDir
+    FmConst.portageDbDir = fixture.dbDir
+    FmConst.ebuild2Dir = fixture.ebuild2Dir
+
+    resultDict = Benchmark(fixture, args.repeat).run()
+
+    data = {
+        "commit": _getCommit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "scale": fixture.getScale(),
+        "results": resultDict,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=4)
+    else:
+        json.dump(data, sys.stdout, indent=4)
+        print("")
+
+    if args.compare is not None:
+        _compare(args.compare, resultDict)
+finally:
+    if bRemoveFixture:
+        shutil.rmtree(fixtureDir)
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from fm_util import FmUtil
+from sys_checker import _CruftFinder
+
+
+def generateRoot(rootDir, entryCount, cruftRatio):
+    """Returns the installed file set, the top-level directories have very different sizes, like a real root."""
+
+    random.seed(0)
+    topList = ["usr", "var", "etc", "opt", "lib64", "home", "tmp", "var/tmp"]
+    weightList = [60, 10, 3, 5, 10, 8, 2, 2]
+    ret = set()
+    for top, weight in zip(topList, weightList):
+        total = entryCount * weight // sum(weightList)
+        dirList = [os.path.join(rootDir, top)]
+        os.makedirs(dirList[0], exist_ok=True)
+        ret.add(dirList[0])
+        for n in range(0, total):
+            d = dirList[random.randrange(0, len(dirList))]
+            if n % 40 == 0:
+                d = os.path.join(d, "d%d" % (n))
+                os.mkdir(d)
+                dirList.append(d)
+            else:
+                d = os.path.join(d, "f%d" % (n))
+                with open(d, "w"):
+                    pass
+            if random.random() >= cruftRatio:
+                ret.add(d)
+    return ret
+
+
+def findCruftByFind(obj, portageFileSet):
+    # the implementation of _CruftFinder before the walker was used
+    cmdStr = "/usr/bin/find \"%s\" '(' -false " % (obj.rootDir)
+    for f in obj.ignoreList:
+        cmdStr += "-or -path \"%s\" " % (os.path.join(obj.rootDir, f[1:]))
+    cmdStr += "')' -prune -or -print0"
+    systemFileSet = set(FmUtil.shellCall(cmdStr).split("\x00"))
+    systemFileSet.discard("")
+    return systemFileSet - portageFileSet
+
+
+def findCruftByWalker(obj, portageFileSet):
+    return {x for x in obj._walkSystemFiles() if x not in portageFileSet}
+
+
+def bench(name, func, repeat):
+    runList = []
+    for i in range(0, repeat):
+        t = time.perf_counter()
+        ret = func()
+        runList.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("%-30s %8.3fs %8.1fMiB  (%d cruft files)" % (name, min(runList), peak / 1024 / 1024, len(ret)), file=sys.stderr)
+    return (min(runList), peak, ret)
+
+
+parser = argparse.ArgumentParser(description="Benchmark the system file walk of the cruft finder against the find pipeline, on a generated root.")
+parser.add_argument("--fixture-dir", help="directory to generate the root in, it is reused if the scale is the same (default: a temporary directory)")
+parser.add_argument("--entries", type=int, default=500000, help="number of files and directories in the root")
+parser.add_argument("--cruft-ratio", type=float, default=0.01, help="ratio of files not owned by any package")
+parser.add_argument("--repeat", type=int, default=3, help="number of runs for each implementation")
+args = parser.parse_args()
+
+if args.fixture_dir is not None:
+    fixtureDir = os.path.abspath(args.fixture_dir)
+    bRemoveFixture = False
+else:
+    fixtureDir = tempfile.mkdtemp(prefix="fpemud-refsystem-benchmark-")
+    bRemoveFixture = True
+
+try:
+    rootDir = os.path.join(fixtureDir, "root")
+    scaleFile = os.path.join(fixtureDir, "scale.json")
+    portageFile = os.path.join(fixtureDir, "portage.json")
+    scale = {"entries": args.entries, "cruft_ratio": args.cruft_ratio}
+    if not (os.path.exists(scaleFile) and json.load(open(scaleFile)) == scale):
+        shutil.rmtree(rootDir, ignore_errors=True)
+        print("Generating root in %s..." % (rootDir), file=sys.stderr)
+        fileSet = generateRoot(rootDir, args.entries, args.cruft_ratio)
+        with open(portageFile, "w") as f:
+            json.dump(sorted(fileSet), f)
+        with open(scaleFile, "w") as f:
+            json.dump(scale, f)
+    portageFileSet = set(json.load(open(portageFile)))
+    portageFileSet.add(rootDir)
+
+    obj = _CruftFinder(None, None, rootDir)
+    findCruftByFind(obj, portageFileSet)            # warm up the dentry cache
+    tOld, mOld, rOld = bench("find pipeline", lambda: findCruftByFind(obj, portageFileSet), args.repeat)
+    tNew, mNew, rNew = bench("TreeWalker streaming", lambda: findCruftByWalker(obj, portageFileSet), args.repeat)
+    print("%-30s %7.2fx %7.2fx" % ("improvement", tOld / tNew, mOld / mNew), file=sys.stderr)
+    assert rOld == rNew
+finally:
+    if bRemoveFixture:
+        shutil.rmtree(fixtureDir)
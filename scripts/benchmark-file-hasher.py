@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from fm_util import FileHasher
+
+
+def generateTree(srcDir, fileCount, bigFileSize):
+    """A driver source tree of small files, and a big file like a kernel tarball."""
+
+    random.seed(0)
+    for i in range(0, fileCount):
+        d = os.path.join(srcDir, "d%d" % (i // 100))
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, "f%d.c" % (i)), "wb") as f:
+            f.write(random.randbytes(random.randrange(0, 64 * 1024)))
+    with open(os.path.join(srcDir, "big.tar.xz"), "wb") as f:
+        for i in range(0, bigFileSize // (1024 * 1024)):
+            f.write(random.randbytes(1024 * 1024))
+
+
+def oldHashDir(dirname):
+    # the implementation of FmUtil.hashDir() before FileHasher was used
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(dirname):
+        for filepath in files:
+            with open(os.path.join(root, filepath), "rb") as f1:
+                buf = f1.read(4096)
+                while buf != b'':
+                    h.update(hashlib.sha1(buf).digest())
+                    buf = f1.read(4096)
+    return h.hexdigest()
+
+
+def oldHashFileList(filenameList):
+    # the implementation of FmUtil.verifyFileMd5() before FileHasher was used
+    ret = []
+    for fn in filenameList:
+        with open(fn, "rb") as f:
+            thash = hashlib.md5()
+            while True:
+                block = f.read(65536)
+                if len(block) == 0:
+                    break
+                thash.update(block)
+            ret.append(thash.hexdigest())
+    return ret
+
+
+def bench(name, func, repeat):
+    runList = []
+    for i in range(0, repeat):
+        t = time.perf_counter()
+        ret = func()
+        runList.append(time.perf_counter() - t)
+    print("%-30s %8.3fs" % (name, min(runList)), file=sys.stderr)
+    return (min(runList), ret)
+
+
+parser = argparse.ArgumentParser(description="Benchmark FileHasher against the old hashing loops.")
+parser.add_argument("--files", type=int, default=5000, help="number of small files in the tree")
+parser.add_argument("--big-file-size", type=int, default=512, help="size of the big file in MiB")
+parser.add_argument("--repeat", type=int, default=3, help="number of runs for each implementation")
+args = parser.parse_args()
+
+tmpDir = tempfile.mkdtemp(prefix="fpemud-refsystem-benchmark-")
+try:
+    srcDir = os.path.join(tmpDir, "src")
+    print("Generating tree in %s..." % (srcDir), file=sys.stderr)
+    generateTree(srcDir, args.files, args.big_file_size * 1024 * 1024)
+    fileList = sorted(os.path.join(root, fn) for root, dirs, files in os.walk(srcDir) for fn in files)
+    cacheFile = os.path.join(tmpDir, "digest.cache")
+
+    oldHashDir(srcDir)                              # warm up the page cache
+    tOld, rOld = bench("hashDir (old)", lambda: oldHashDir(srcDir), args.repeat)
+    tNew, rNew = bench("hashDir (FileHasher)", lambda: FileHasher("sha1").hashDir(srcDir), args.repeat)
+    print("%-30s %7.2fx" % ("speedup", tOld / tNew), file=sys.stderr)
+    assert rOld == rNew
+
+    tOld, rOld = bench("md5 file list (old)", lambda: oldHashFileList(fileList), args.repeat)
+    tNew, rNew = bench("md5 file list (FileHasher)", lambda: FileHasher("md5").hashFileList(fileList), args.repeat)
+    print("%-30s %7.2fx" % ("speedup", tOld / tNew), file=sys.stderr)
+    assert rOld == rNew
+
+    hasher = FileHasher("md5", cacheFile=cacheFile)
+    hasher.hashFileList(fileList)
+    hasher.saveCache()
+    tCached, rCached = bench("md5 file list (cached)", lambda: FileHasher("md5", cacheFile=cacheFile).hashFileList(fileList), args.repeat)
+    print("%-30s %7.2fx" % ("speedup", tOld / tCached), file=sys.stderr)
+    assert rOld == rCached
+finally:
+    shutil.rmtree(tmpDir)
@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import pwd
+import grp
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from fm_util import InfoPrinter
+from fm_param import UsrParam
+from usr_checker import FmChecker
+
+
+def generateHomeTree(homeDir, entryCount, foreignRatio):
+    """Directories of 50 entries, the top-level sub-trees have very different sizes, like a real home directory."""
+
+    random.seed(0)
+    subtreeList = [".cache", ".local", ".config", ".mozilla", "Documents", "Downloads", "Music", "Pictures", "src", ".npm", ".cargo", "Videos"]
+    weightList = [30, 15, 2, 5, 10, 4, 6, 8, 12, 4, 3, 1]
+    foreignUid = pwd.getpwnam("nobody").pw_uid if os.getuid() == 0 else None
+
+    count = 0
+    for subtree, weight in zip(subtreeList, weightList):
+        total = entryCount * weight // sum(weightList)
+        n = 0
+        dirList = [os.path.join(homeDir, subtree)]
+        os.makedirs(dirList[0])
+        while n < total:
+            d = dirList[random.randrange(0, len(dirList))]
+            if len(os.listdir(d)) >= 50:
+                d = os.path.join(d, "d%d" % (n))
+                os.mkdir(d)
+                dirList.append(d)
+                n += 1
+                continue
+            fn = os.path.join(d, "f%d" % (n))
+            with open(fn, "w"):
+                pass
+            if foreignUid is not None and random.random() < foreignRatio:
+                os.chown(fn, foreignUid, -1)
+            n += 1
+        count += n
+        print("%s: %d entries" % (subtree, n), file=sys.stderr)
+    os.symlink("non-exist", os.path.join(homeDir, ".broken-link"))
+    return count
+
+
+def oldCheckItem003(homeDir, userName):
+    # the implementation before TreeWalker was used
+    ret = []
+    for root, dirs, files in os.walk(homeDir):
+        for f in files:
+            fullfn = os.path.join(root, f)
+            if not os.path.exists(fullfn):
+                continue        # ignore broken link
+            s = os.lstat(fullfn)
+            owner = pwd.getpwuid(s.st_uid).pw_name
+            owner_group = grp.getgrgid(s.st_gid).gr_name
+            if owner != userName:
+                ret.append("Invalid owner (%s) for file \"%s\"." % (owner, fullfn))
+            if owner_group != userName:
+                ret.append("Invalid owner group (%s) for file \"%s\"." % (owner_group, fullfn))
+        for d in dirs:
+            fullfn = os.path.join(root, d)
+            s = os.lstat(fullfn)
+            owner = pwd.getpwuid(s.st_uid).pw_name
+            owner_group = grp.getgrgid(s.st_gid).gr_name
+            if owner != userName:
+                ret.append("Invalid owner (%s) for directory \"%s\"." % (owner, fullfn))
+            if owner_group != userName:
+                ret.append("Invalid owner group (%s) for directory \"%s\"." % (owner_group, fullfn))
+    return ret
+
+
+class _CollectInfoPrinter(InfoPrinter):
+
+    def __init__(self):
+        super().__init__()
+        self.errorList = []
+
+    def printInfo(self, s):
+        pass
+
+    def printError(self, s, path=None, pkg=None, bAutoFixable=False):
+        self.errorList.append(s)
+
+
+def newCheckItem003(homeDir):
+    param = UsrParam()
+    param.infoPrinter = _CollectInfoPrinter()
+    obj = FmChecker(param, os.getuid())
+    obj.homeDir = homeDir
+    obj._checkItem003()
+    return param.infoPrinter.errorList
+
+
+def bench(name, func, repeat):
+    runList = []
+    for i in range(0, repeat):
+        t = time.perf_counter()
+        ret = func()
+        runList.append(time.perf_counter() - t)
+    print("%-30s %8.3fs  (%d findings)" % (name, min(runList), len(ret)), file=sys.stderr)
+    return (min(runList), ret)
+
+
+parser = argparse.ArgumentParser(description="Benchmark the home directory permission check of usrman against a generated home tree.")
+parser.add_argument("--fixture-dir", help="directory to generate the home tree in, it is reused if the scale is the same (default: a temporary directory)")
+parser.add_argument("--entries", type=int, default=1000000, help="number of files and directories in the home tree")
+parser.add_argument("--foreign-ratio", type=float, default=0.001, help="ratio of files owned by another user, only used when run as root")
+parser.add_argument("--repeat", type=int, default=3, help="number of runs for each implementation")
+args = parser.parse_args()
+
+if args.fixture_dir is not None:
+    fixtureDir = os.path.abspath(args.fixture_dir)
+    bRemoveFixture = False
+else:
+    fixtureDir = tempfile.mkdtemp(prefix="fpemud-refsystem-benchmark-")
+    bRemoveFixture = True
+
+try:
+    homeDir = os.path.join(fixtureDir, "home")
+    scaleFile = os.path.join(fixtureDir, "scale.json")
+    scale = {"entries": args.entries, "foreign_ratio": args.foreign_ratio}
+    if not (os.path.exists(scaleFile) and json.load(open(scaleFile)) == scale):
+        shutil.rmtree(homeDir, ignore_errors=True)
+        print("Generating home tree in %s..." % (homeDir), file=sys.stderr)
+        generateHomeTree(homeDir, args.entries, args.foreign_ratio)
+        with open(scaleFile, "w") as f:
+            json.dump(scale, f)
+
+    userName = pwd.getpwuid(os.getuid()).pw_name
+    oldList = oldCheckItem003(homeDir, userName)             # warm up the dentry cache
+    tOld, oldList = bench("os.walk + getpwuid", lambda: oldCheckItem003(homeDir, userName), args.repeat)
+    tNew, newList = bench("TreeWalker + id cache", lambda: newCheckItem003(homeDir), args.repeat)
+    print("%-30s %7.2fx" % ("speedup", tOld / tNew), file=sys.stderr)
+    assert sorted(oldList) == sorted(newList)
+finally:
+    if bRemoveFixture:
+        shutil.rmtree(fixtureDir)
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from fm_util import MakeConf
+from fm_param import FmConst
+import sys_checker
+from sys_checker import FmSysChecker
+
+
+def generateMakeConf(filename, bConforming):
+    buf = ""
+    buf += "# These settings were set by the catalyst build script that automatically\n"
+    buf += "# built this stage.\n"
+    buf += "# Please consult /usr/share/portage/config/make.conf.example for a more\n"
+    buf += "# detailed example.\n"
+    buf += "\n"
+    buf += "COMMON_FLAGS=\"-O2 -pipe\"\n"
+    buf += "CFLAGS=\"${COMMON_FLAGS}\"\n"
+    buf += "CXXFLAGS=\"${COMMON_FLAGS}\"\n"
+    buf += "\n"
+    for i in range(0, 60):
+        buf += "# option %d\n" % (i)
+        buf += "USER_VAR_%d=\"value %d ${COMMON_FLAGS}\"\n" % (i, i)
+    buf += "\n"
+    if bConforming:
+        buf += "ACCEPT_LICENSE=\"*\"\n"
+        buf += "DISTDIR=\"%s\"\n" % (FmConst.distDir)
+        buf += "ACCEPT_KEYWORDS=\"~x86 ~amd64\"\n"
+        buf += "EMERGE_DEFAULT_OPTS=\"--quiet-build --backtrack=30 --jobs=4 --load-average=3\"\n"
+        buf += "MAKEOPTS=\"--jobs=4 --load-average=3 -j4 -l3\"\n"
+        buf += "GENTOO_DEFAULT_MIRROR=\"%s\"\n" % (FmConst.defaultGentooMirror)
+        buf += "RSYNC_DEFAULT_MIRROR=\"%s\"\n" % (FmConst.defaultRsyncMirror)
+        buf += "KERNEL_DEFAULT_MIRROR=\"%s\"\n" % (FmConst.defaultKernelMirror)
+    else:
+        buf += "EMERGE_DEFAULT_OPTS=\"--backtrack=10\"\n"
+        buf += "MAKEOPTS=\"-j2\"\n"
+    with open(filename, "w") as f:
+        f.write(buf)
+
+
+def oldGetMakeConfVar(makeConfFile, varName):
+    # FmUtil.getMakeConfVar() before MakeConf was added
+    buf = ""
+    with open(makeConfFile, 'r') as f:
+        buf = f.read()
+
+    m = re.search("^%s=\"(.*)\"$" % (varName), buf, re.MULTILINE)
+    if m is None:
+        return ""
+    varVal = m.group(1)
+
+    while True:
+        m = re.search("\\${(\\S+)?}", varVal)
+        if m is None:
+            break
+        varName2 = m.group(1)
+        varVal2 = oldGetMakeConfVar(makeConfFile, varName2)
+        if varVal2 is None:
+            varVal2 = ""
+
+        varVal = varVal.replace(m.group(0), varVal2)
+
+    return varVal
+
+
+def oldSetMakeConfVar(makeConfFile, varName, varValue):
+    # FmUtil.setMakeConfVar() before MakeConf was added
+    endEnter = False
+    buf = ""
+    with open(makeConfFile, 'r') as f:
+        buf = f.read()
+        if buf[-1] == "\n":
+            endEnter = True
+
+    m = re.search("^%s=\"(.*)\"$" % (varName), buf, re.MULTILINE)
+    if m is not None:
+        if m.group(1) != varValue:
+            newLine = "%s=\"%s\"" % (varName, varValue)
+            buf = buf.replace(m.group(0), newLine)
+            with open(makeConfFile, 'w') as f:
+                f.write(buf)
+    else:
+        with open(makeConfFile, 'a') as f:
+            if not endEnter:
+                f.write("\n")
+            f.write("%s=\"%s\"\n" % (varName, varValue))
+
+
+class PerCallMakeConf:
+
+    """Has the interface of MakeConf used by the check, every call reads and writes the file like the old code did"""
+
+    def __init__(self, filename):
+        self._filename = filename
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+    def get(self, varName):
+        return oldGetMakeConfVar(self._filename, varName)
+
+    def set(self, varName, varValue):
+        oldSetMakeConfVar(self._filename, varName, varValue)
+
+
+class FakePkgWarehouse:
+
+    # PkgWarehouse.getKeywordList() runs portageq, which would dominate the timing
+    def getKeywordList(self):
+        return ["x86", "amd64"]
+
+
+def runCheck(makeConfClass):
+    def _run(filename):
+        FmConst.portageCfgMakeConf = filename
+        sys_checker.MakeConf = makeConfClass
+        checker = FmSysChecker.__new__(FmSysChecker)
+        checker.bAutoFix = True
+        checker.pkgwh = FakePkgWarehouse()
+        checker._checkPortageMakeConf()
+    return _run
+
+
+def bench(name, func, bConforming, count):
+    tmpDir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpDir, "make.conf")
+        total = 0
+        for i in range(0, count):
+            generateMakeConf(filename, bConforming)
+            t = time.perf_counter()
+            func(filename)
+            total += time.perf_counter() - t
+        with open(filename) as f:
+            result = f.read()
+        print("%-40s %8.3fms" % (name, total * 1000 / count))
+        return (total, result)
+    finally:
+        shutil.rmtree(tmpDir)
+
+
+if len(sys.argv) > 1 and sys.argv[1] in ["-h", "--help"]:
+    print("syntax: benchmark-make-conf.py [count]")
+    sys.exit(0)
+
+count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+for bConforming in [True, False]:
+    desc = "conforming make.conf" if bConforming else "make.conf needs fixing"
+    tOld, rOld = bench("per-call (%s)" % (desc), runCheck(PerCallMakeConf), bConforming, count)
+    tNew, rNew = bench("transaction (%s)" % (desc), runCheck(MakeConf), bConforming, count)
+    print("%-40s %7.1fx" % ("speedup", tOld / tNew))
+    assert rOld == rNew
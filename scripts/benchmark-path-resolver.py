@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from helper_path_resolver import PathResolver
+
+
+def generateRoot(rootDir, fileCount):
+    """Returns the installed file set. The root has merged-usr style directory symlinks, some of them
+       nested and some of them chained, installed files are recorded through both names."""
+
+    random.seed(0)
+    for d in ["usr/lib64", "usr/bin", "usr/share", "opt/app/lib64"]:
+        os.makedirs(os.path.join(rootDir, d))
+    os.symlink("usr/lib64", os.path.join(rootDir, "lib64"))
+    os.symlink("lib64", os.path.join(rootDir, "lib"))                         # chained: /lib -> /lib64 -> /usr/lib64
+    os.symlink("lib64", os.path.join(rootDir, "usr", "lib"))
+    os.symlink("usr/bin", os.path.join(rootDir, "bin"))
+    os.symlink("../../usr/lib64", os.path.join(rootDir, "opt", "app", "lib"))  # nested: /opt/app/lib -> /usr/lib64
+    os.symlink(os.path.join(rootDir, "usr", "share"), os.path.join(rootDir, "usr", "lib64", "share"))
+
+    aliasDict = {
+        "usr/lib64": ["lib", "lib64", "usr/lib", "usr/lib64", "opt/app/lib"],
+        "usr/bin": ["bin", "usr/bin"],
+        "usr/share": ["usr/share", "usr/lib64/share", "lib/share"],
+        "opt/app/lib64": ["opt/app/lib64"],
+    }
+    dirList = []
+    for top in aliasDict:
+        for i in range(0, 40):
+            d = os.path.join(top, "pkg%d" % (i))
+            os.makedirs(os.path.join(rootDir, d))
+            dirList.append((top, d))
+            for j in range(0, 5):
+                d2 = os.path.join(d, "sub%d" % (j))
+                os.makedirs(os.path.join(rootDir, d2))
+                dirList.append((top, d2))
+
+    ret = set()
+    for i in range(0, fileCount):
+        top, d = random.choice(dirList)
+        alias = random.choice(aliasDict[top])
+        ret.add(os.path.join(rootDir, alias + d[len(top):], "f%d" % (i)))
+    return ret
+
+
+def oldExpand(fileSet):
+    # the implementation of _CruftFinder._expandPortageFileSet() before PathResolver was used
+    ret = set()
+    for f in fileSet:
+        f2 = os.path.join(os.path.realpath(os.path.dirname(f)), os.path.basename(f))
+        if f2 != f:
+            ret.add(f2)
+    return ret
+
+
+def newExpand(fileSet):
+    ret = set()
+    for f, f2 in PathResolver().realDirPathDict(fileSet).items():
+        if f2 != f:
+            ret.add(f2)
+    return ret
+
+
+def bench(name, func, repeat):
+    runList = []
+    for i in range(0, repeat):
+        t = time.perf_counter()
+        ret = func()
+        runList.append(time.perf_counter() - t)
+    print("%-30s %8.3fs  (%d paths resolved to another name)" % (name, min(runList), len(ret)), file=sys.stderr)
+    return (min(runList), ret)
+
+
+parser = argparse.ArgumentParser(description="Benchmark the directory symlink expansion of the cruft finder on a generated root.")
+parser.add_argument("--files", type=int, default=300000, help="number of installed files")
+parser.add_argument("--repeat", type=int, default=3, help="number of runs for each implementation")
+args = parser.parse_args()
+
+tmpDir = tempfile.mkdtemp(prefix="fpemud-refsystem-benchmark-")
+try:
+    rootDir = os.path.join(tmpDir, "root")
+    fileSet = generateRoot(rootDir, args.files)
+    tOld, rOld = bench("os.path.realpath", lambda: oldExpand(fileSet), args.repeat)
+    tNew, rNew = bench("PathResolver", lambda: newExpand(fileSet), args.repeat)
+    print("%-30s %7.2fx" % ("speedup", tOld / tNew), file=sys.stderr)
+    assert rOld == rNew
+finally:
+    shutil.rmtree(tmpDir)
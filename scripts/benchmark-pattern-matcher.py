@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import time
+import random
+import fnmatch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from helper_pattern_matcher import GlobPatternMatcher
+
+
+def generatePathList(count):
+    topDirList = ["/usr/lib", "/usr/share", "/usr/bin", "/etc", "/var/lib", "/opt", "/home/user/.config", "/home/user/.local/share"]
+    ret = []
+    for i in range(0, count):
+        ret.append("%s/pkg%d/dir%d/file%d.%s" % (random.choice(topDirList), random.randrange(0, 2000), random.randrange(0, 20), i, random.choice(["so", "py", "conf", "png", "txt"])))
+    return ret
+
+
+def generatePatternList(count):
+    ret = []
+    for i in range(0, count):
+        pathList = generatePathList(1)
+        dirname = os.path.dirname(pathList[0])
+        r = random.randrange(0, 4)
+        if r == 0:
+            ret.append(pathList[0])                                 # literal
+        elif r == 1:
+            ret.append(dirname + "/*")                              # whole directory
+        elif r == 2:
+            ret.append(dirname + "/*." + pathList[0].split(".")[-1])     # suffix
+        else:
+            ret.append(os.path.dirname(dirname) + "/dir?/*")        # single char wildcard
+    return ret
+
+
+if len(sys.argv) > 1 and sys.argv[1] in ["-h", "--help"]:
+    print("syntax: benchmark-pattern-matcher.py [path-count] [pattern-count] [sample-count]")
+    sys.exit(0)
+
+pathCount = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+patternCount = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+sampleCount = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+random.seed(0)
+pathList = generatePathList(pathCount)
+patternList = generatePatternList(patternCount)
+print("%d paths, %d patterns" % (pathCount, patternCount))
+
+# the fnmatch loop is too slow to run on all the paths, run it on a sample and extrapolate
+sampleList = pathList[:sampleCount]
+t = time.time()
+oldResult = [any(fnmatch.fnmatchcase(x, pattern) for pattern in patternList) for x in sampleList]
+tOld = (time.time() - t) * pathCount / len(sampleList)
+print("fnmatch loop:        %.2fs (estimated from %d paths)" % (tOld, len(sampleList)))
+
+t = time.time()
+matcher = GlobPatternMatcher(set(patternList))
+tCompile = time.time() - t
+t = time.time()
+newResult = [matcher.match(x) for x in pathList]
+tNew = time.time() - t
+print("GlobPatternMatcher:  %.2fs (compile %.2fs)" % (tNew + tCompile, tCompile))
+print("speedup:             %.1fx" % (tOld / (tNew + tCompile)))
+
+assert oldResult == newResult[:len(sampleList)]
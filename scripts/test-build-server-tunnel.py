@@ -0,0 +1,262 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import re
+import sys
+import ssl
+import json
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from fm_util import FmUtil
+from fm_param import FmConst
+import helper_build_server
+from helper_build_server import BuildServer
+
+
+class LoopbackBuildServer:
+
+    """
+    A build server on 127.0.0.1 that speaks the control protocol, an echo service stands for the rsync
+    daemon, and a catfile service serves files from a dictionary. Every data connection is recorded
+    with whether its TLS session was resumed.
+
+    Like the rsync daemon, the echo service speaks first. Its TLS is done on memory BIOs, so that the
+    greeting is sent in the same segment as the last handshake flight.
+    """
+
+    greeting = b'@RSYNCD: 31.0\n'
+
+    def __init__(self, certFile, keyFile, fileDict):
+        self.fileDict = fileDict
+        self.connList = []                  # list<(service, bSessionReused)>
+        self.lock = threading.Lock()
+
+        self.ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.ctx.load_cert_chain(certFile, keyFile)
+
+        self.ctrlSock = self._listen(self._ctrlFunc)
+        self.echoSock = self._listen(self._echoFunc, bRawSocket=True)
+        self.catFileSock = self._listen(self._catFileFunc)
+
+    def getCtrlPort(self):
+        return self.ctrlSock.getsockname()[1]
+
+    def dispose(self):
+        for sock in [self.ctrlSock, self.echoSock, self.catFileSock]:
+            sock.close()
+
+    def _listen(self, func, bRawSocket=False):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(8)
+        threading.Thread(target=self._acceptFunc, args=(sock, func, bRawSocket), daemon=True).start()
+        return sock
+
+    def _acceptFunc(self, sock, func, bRawSocket):
+        while True:
+            try:
+                clientSock, addr = sock.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serveFunc, args=(clientSock, func, bRawSocket), daemon=True).start()
+
+    def _serveFunc(self, clientSock, func, bRawSocket):
+        try:
+            if bRawSocket:
+                with clientSock:
+                    func(clientSock)
+            else:
+                with self.ctx.wrap_socket(clientSock, server_side=True) as sslSock:
+                    func(sslSock)
+        except (OSError, EOFError):
+            pass
+
+    def _ctrlFunc(self, sslSock):
+        f = sslSock.makefile("rwb")
+        while True:
+            line = f.readline()
+            if line == b'':
+                break
+            command = json.loads(line.decode("iso8859-1"))["command"]
+            if command == "init":
+                resp = {"return": {}}
+            elif command == "stage-syncup":
+                resp = {"return": {"stage": "syncup", "rsync-port": self.echoSock.getsockname()[1]}}
+            elif command == "stage-working":
+                resp = {"return": {
+                    "stage": "working",
+                    "ssh-port": 22,
+                    "ssh-key": "fake key",
+                    "rsync-port": self.echoSock.getsockname()[1],
+                    "catfile-port": self.catFileSock.getsockname()[1],
+                }}
+            else:
+                resp = {"error": "invalid command %s" % (command)}
+            f.write((json.dumps(resp) + "\n").encode("iso8859-1"))
+            f.flush()
+
+    def _echoFunc(self, sock):
+        inBio = ssl.MemoryBIO()
+        outBio = ssl.MemoryBIO()
+        sslObj = self.ctx.wrap_bio(inBio, outBio, server_side=True)
+        while True:
+            try:
+                sslObj.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                sock.sendall(outBio.read())
+                buf = sock.recv(65536)
+                if len(buf) == 0:
+                    raise EOFError()
+                inBio.write(buf)
+        self._record("rsync", sslObj)
+
+        sslObj.write(self.greeting)
+        sock.sendall(outBio.read())
+
+        while True:
+            buf = sock.recv(65536)
+            if len(buf) == 0:
+                break
+            inBio.write(buf)
+            bEof = False
+            while True:
+                try:
+                    buf = sslObj.read(65536)
+                except ssl.SSLWantReadError:
+                    break
+                except ssl.SSLZeroReturnError:
+                    buf = b''
+                if len(buf) == 0:
+                    bEof = True
+                    break
+                sslObj.write(buf)
+            sock.sendall(outBio.read())
+            if bEof:
+                break
+        sock.shutdown(socket.SHUT_WR)
+
+    def _catFileFunc(self, sslSock):
+        self._record("catfile", sslSock)
+        nameLen = struct.unpack("!I", self._recvAll(sslSock, 4))[0]
+        filename = self._recvAll(sslSock, nameLen).decode("utf-8")
+        if filename in self.fileDict:
+            sslSock.sendall(b'\x00' + struct.pack("!Q", len(self.fileDict[filename])) + self.fileDict[filename])
+        else:
+            err = ("%s does not exist" % (filename)).encode("utf-8")
+            sslSock.sendall(b'\x01' + struct.pack("!Q", len(err)) + err)
+
+    def _record(self, service, sslObj):
+        with self.lock:
+            self.connList.append((service, sslObj.session_reused))
+
+    def _recvAll(self, sock, datasize):
+        buf = b''
+        while len(buf) < datasize:
+            buf2 = sock.recv(datasize - len(buf))
+            if len(buf2) == 0:
+                raise EOFError()
+            buf += buf2
+        return buf
+
+
+class FakeShell:
+
+    """Replaces FmUtil.shellExec() in helper_build_server, rsync is replaced by reading the greeting and an echo round
+       trip through the tunnel"""
+
+    def __init__(self):
+        self.rsyncPortList = []
+        self.sshCfgFileList = []
+
+    def shellExec(self, cmd):
+        m = re.search("rsync://127.0.0.1:([0-9]+)/main", cmd)
+        if m is not None:
+            port = int(m.group(1))
+            self.rsyncPortList.append(port)
+            data = os.urandom(4 * 1024 * 1024)
+            with socket.create_connection(("127.0.0.1", port), timeout=10) as sock:
+                buf = b''
+                while len(buf) < len(LoopbackBuildServer.greeting):
+                    buf2 = sock.recv(len(LoopbackBuildServer.greeting) - len(buf))
+                    assert len(buf2) > 0, "no greeting"
+                    buf += buf2
+                assert buf == LoopbackBuildServer.greeting, "greeting corrupted by tunnel"
+
+                threading.Thread(target=self._sendAndShut, args=(sock, data)).start()
+                buf = b''
+                while True:
+                    buf2 = sock.recv(65536)
+                    if len(buf2) == 0:
+                        break
+                    buf += buf2
+            assert buf == data, "data corrupted by tunnel"
+            return
+
+        m = re.search("^/usr/bin/ssh .* -F (\\S+) ", cmd)
+        if m is not None:
+            self.sshCfgFileList.append(m.group(1))
+            return
+
+        assert False, "unexpected command: %s" % (cmd)
+
+    def _sendAndShut(self, sock, data):
+        sock.sendall(data)
+        sock.shutdown(socket.SHUT_WR)
+
+
+tmpDir = tempfile.mkdtemp(prefix="fpemud-refsystem-test-")
+try:
+    # certificates of the client and the fixture
+    FmConst.myCertFile = os.path.join(tmpDir, "cert.pem")
+    FmConst.myPrivKeyFile = os.path.join(tmpDir, "privkey.pem")
+    cert, key = FmUtil.genSelfSignedCertAndKey("client", 2048)
+    FmUtil.dumpCertAndKey(cert, key, FmConst.myCertFile, FmConst.myPrivKeyFile)
+    serverCertFile = os.path.join(tmpDir, "server-cert.pem")
+    serverKeyFile = os.path.join(tmpDir, "server-privkey.pem")
+    cert, key = FmUtil.genSelfSignedCertAndKey("server", 2048)
+    FmUtil.dumpCertAndKey(cert, key, serverCertFile, serverKeyFile)
+
+    fakeShell = FakeShell()
+    helper_build_server.FmUtil = type("FmUtil", (FmUtil,), {"shellExec": staticmethod(fakeShell.shellExec)})
+
+    server = LoopbackBuildServer(serverCertFile, serverKeyFile, {"/etc/hostname": b'builder\n'})
+    buildServer = BuildServer("127.0.0.1", server.getCtrlPort())
+    try:
+        buildServer.connectAndInit()
+        buildServer.syncUp()
+        buildServer.startWorking()
+        buildServer.syncDownKernel()
+        buildServer.sshExec("/usr/bin/true")
+        buildServer.syncDownSystem()
+        buildServer.syncDownDirectory("/var/db/pkg", quiet=True)
+        buildServer.sshExec("/usr/bin/true")
+        buildServer.syncDownWildcardList(["/boot/*"], quiet=True)
+        assert buildServer.getFile("/etc/hostname") == b'builder\n'
+        assert buildServer.getFile("/etc/hostname") == b'builder\n'
+        sshCfgFile = buildServer.sshCfgFile
+    finally:
+        buildServer.dispose()
+        server.dispose()
+
+    # one tunnel for all the rsync transfers
+    assert len(set(fakeShell.rsyncPortList)) == 1, fakeShell.rsyncPortList
+
+    # only the first connection to each service does a full handshake
+    for service in ["rsync", "catfile"]:
+        reusedList = [x[1] for x in server.connList if x[0] == service]
+        print("%-10s %d connections, %d resumed" % (service, len(reusedList), reusedList.count(True)), file=sys.stderr)
+        assert reusedList == [False] + [True] * (len(reusedList) - 1), reusedList
+
+    # all the ssh sessions use the same config file, which has one master connection
+    assert fakeShell.sshCfgFileList == [sshCfgFile] * 2
+    assert not os.path.exists(sshCfgFile)
+    print("ok", file=sys.stderr)
+finally:
+    shutil.rmtree(tmpDir)
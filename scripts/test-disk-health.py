@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+selfDir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(selfDir, "..", "lib"))
+from fm_util import InfoPrinter
+from helper_check_engine import CheckEngine
+from helper_disk_health import DiskHealthChecker
+
+
+def prepare(scenario):
+    """Returns a DiskHealthChecker using the fake smartctl, there's no poll interval"""
+
+    for fn in os.listdir(tmpDir):
+        os.unlink(os.path.join(tmpDir, fn))
+    with open(os.path.join(tmpDir, "scenario.json"), "w") as f:
+        json.dump(scenario, f)
+    open(os.path.join(tmpDir, "log"), "w").close()
+    return DiskHealthChecker(smartctl=os.path.join(selfDir, "fake-smartctl"), pollInterval=0)
+
+
+def readLog():
+    with open(os.path.join(tmpDir, "log")) as f:
+        return f.read().split("\n")[:-1]
+
+
+def testStartProgressCompletion():
+    checker = prepare({
+        "/dev/sda": {"health": True, "start": "ok", "minutes": 120, "polls": [70, 40, "passed"]},
+        "/dev/sdb": {"health": False, "start": "ok", "minutes": 60, "polls": [50, "failed"]},
+        "/dev/sdc": {"health": True, "start": "fail", "polls": ["passed"]},
+        "/dev/sdd": {"health": True, "start": "busy", "polls": [20, "passed"]},
+    })
+    hddList = ["/dev/sda", "/dev/sdb", "/dev/sdc", "/dev/sdd"]
+
+    assert checker.checkHealth(hddList) == [True, False, True, True]
+
+    testList = checker.startSelfTests(hddList)
+    assert [x.status for x in testList] == ["running", "running", "start-failed", "running"]
+    assert [x.minutes for x in testList] == [120, 60, None, None]
+    assert [x.bAlreadyRunning for x in testList] == [False, False, False, True]
+    assert "-X /dev/sdc" in readLog()                   # a test that failed to start is aborted
+
+    endList = []
+    progressList = []
+    checker.waitSelfTests(lambda test: endList.append((test.hdd, test.status)), progressList.append)
+    assert endList == [("/dev/sdb", "failed"), ("/dev/sdd", "passed"), ("/dev/sda", "passed")], endList
+    assert progressList == [30, 60], progressList
+    assert not checker.hasRunningSelfTest()
+    assert [x for x in readLog() if x.startswith("-X")] == ["-X /dev/sdc"]
+    print("start, progress and completion: ok", file=sys.stderr)
+
+
+def testAbort():
+    # the test never ends, and the poll interval is long, so only abortSelfTests() makes the wait return
+    checker = prepare({
+        "/dev/sda": {"health": True, "start": "ok", "minutes": 600, "polls": [90]},
+    })
+    checker._pollInterval = 3600
+    test = checker.startSelfTests(["/dev/sda"])[0]
+
+    th = threading.Thread(target=checker.waitSelfTests)
+    th.start()
+    checker.abortSelfTests()
+    th.join(10)
+    assert not th.is_alive()
+    assert test.status == "aborted"
+    assert "-X /dev/sda" in readLog()
+    print("abort: ok", file=sys.stderr)
+
+
+def testAbortByEngine():
+    # a failed check cancels the wait, the engine re-raises the error without waiting for the self-tests
+    checker = prepare({
+        "/dev/sda": {"health": True, "start": "ok", "minutes": 600, "polls": [90]},
+    })
+    checker._pollInterval = 3600
+    started = threading.Event()
+
+    def _startTests():
+        checker.startSelfTests(["/dev/sda"])
+
+    def _waitTests():
+        started.set()
+        checker.waitSelfTests()
+
+    def _fail():
+        started.wait()
+        raise Exception("check failed")
+
+    engine = CheckEngine(InfoPrinter())
+    engine.addCheck("hardware", _startTests)
+    engine.addCheck("hardware-self-test", _waitTests, depends=["hardware"], cancelFunc=checker.abortSelfTests)
+    engine.addCheck("failing", _fail, depends=["hardware"])
+
+    t = time.time()
+    try:
+        engine.run(False)
+        assert False
+    except Exception as e:
+        assert str(e) == "check failed"
+    assert time.time() - t < 10
+    assert not checker.hasRunningSelfTest()
+    assert "-X /dev/sda" in readLog()
+    print("abort by engine: ok", file=sys.stderr)
+
+
+tmpDir = tempfile.mkdtemp(prefix="fpemud-refsystem-test-")
+try:
+    os.environ["FAKE_SMARTCTL_DIR"] = tmpDir
+    testStartProgressCompletion()
+    testAbort()
+    testAbortByEngine()
+    print("ok", file=sys.stderr)
+finally:
+    shutil.rmtree(tmpDir)
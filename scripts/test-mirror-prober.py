@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+# -*- coding: utf-8; tab-width: 4; indent-tabs-mode: t -*-
+
+import os
+import sys
+import time
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import http.server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "lib"))
+from helper_mirror_prober import MirrorProber
+
+
+class LocalMirror:
+
+    """
+    A mirror on 127.0.0.1 serving files from a dictionary. A slow mirror waits before sending the
+    headers and between the chunks of the body, every wait is shorter than the probe timeout, so only
+    the deadline of MirrorProber.selectMirror() can stop waiting for it.
+    """
+
+    def __init__(self, fileDict, delay=0):
+        mirror = self
+
+        class _Handler(http.server.BaseHTTPRequestHandler):
+
+            def do_HEAD(self):
+                mirror._serve(self, False)
+
+            def do_GET(self):
+                mirror._serve(self, True)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.fileDict = fileDict
+        self.delay = delay
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def getUrl(self):
+        return "http://127.0.0.1:%d" % (self.server.server_address[1])
+
+    def dispose(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _serve(self, handler, bWithBody):
+        time.sleep(self.delay)
+        data = self.fileDict.get(handler.path)
+        if data is None:
+            handler.send_error(404)
+            return
+        handler.send_response(200)
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        if bWithBody:
+            chunkSize = 4096
+            for i in range(0, len(data), chunkSize):
+                handler.wfile.write(data[i:i + chunkSize])
+                handler.wfile.flush()
+                time.sleep(self.delay)
+
+
+def getRefusedUrl():
+    # a port that was just released has no listener
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return "http://127.0.0.1:%d" % (port)
+
+
+timeout = 0.5
+fileDict = {"/distfiles/foo.tar.gz": os.urandom(16 * 1024)}
+
+tmpDir = tempfile.mkdtemp(prefix="fpemud-refsystem-test-")
+fast = LocalMirror(fileDict)
+slow = LocalMirror(fileDict, delay=0.4)           # 5 waits, the probe takes 2 seconds
+missing = LocalMirror({})
+try:
+    cacheFile = os.path.join(tmpDir, "mirror-ranking.cache")
+    refusedUrl = getRefusedUrl()
+    mirrorList = [refusedUrl, missing.getUrl(), slow.getUrl(), fast.getUrl()]
+    candidateList = [(mr, [mr + "/distfiles/foo.tar.gz"]) for mr in mirrorList]
+
+    # first run: no ranking, candidates are checked in the configured order, the slow mirror is waited until the deadline
+    prober = MirrorProber(cacheFile=cacheFile, timeout=timeout)
+    assert prober.getRankedMirrorList(mirrorList) == mirrorList
+    t = time.monotonic()
+    assert prober.selectMirror(candidateList) == 3
+    assert time.monotonic() - t < timeout * 4
+    print("first run: ok", file=sys.stderr)
+
+    # the late result of the slow mirror is dropped, it stays recorded as a failure
+    time.sleep(3)
+    with open(cacheFile) as f:
+        rankDict = json.load(f)
+    assert sorted(rankDict.keys()) == sorted([refusedUrl, slow.getUrl(), fast.getUrl()])     # a missing file is not a failure
+    assert rankDict[refusedUrl]["failure"] == 1 and rankDict[refusedUrl]["latency"] is None
+    assert rankDict[slow.getUrl()]["failure"] == 1 and rankDict[slow.getUrl()]["latency"] is None
+    assert rankDict[fast.getUrl()]["failure"] == 0 and rankDict[fast.getUrl()]["throughput"] is not None
+    assert prober._rankDict == rankDict                 # nothing is recorded after the save
+    print("late result dropped: ok", file=sys.stderr)
+
+    # second run: the ranking is loaded from the cache file, the fast mirror is checked first and selected at once
+    prober = MirrorProber(cacheFile=cacheFile, timeout=timeout)
+    rankList = prober.getRankedMirrorList(mirrorList)
+    assert rankList[0] == fast.getUrl()
+    assert set(rankList[1:3]) == set([refusedUrl, slow.getUrl()])
+    assert rankList[3] == missing.getUrl()
+    t = time.monotonic()
+    assert prober.selectMirror(candidateList) == 3
+    assert time.monotonic() - t < timeout
+    print("second run: ok", file=sys.stderr)
+
+    # no candidate has the file
+    prober = MirrorProber(cacheFile=cacheFile, timeout=timeout)
+    assert prober.selectMirror([(mr, [mr + "/distfiles/foo.tar.gz"]) for mr in [refusedUrl, missing.getUrl()]]) is None
+    print("no mirror: ok", file=sys.stderr)
+
+    print("ok", file=sys.stderr)
+finally:
+    fast.dispose()
+    slow.dispose()
+    missing.dispose()
+    shutil.rmtree(tmpDir)